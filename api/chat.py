@@ -2,11 +2,12 @@ from typing import Optional, Iterable
 import time
 from datetime import datetime
 
-from fastapi import APIRouter, Form
+from fastapi import APIRouter, Form, HTTPException
 from fastapi.responses import StreamingResponse
 
 from core.state import app_state, rag_chat_stream, DEFAULT_MODEL
 from api.history import save_chat_message, init_history_db
+from config.database import validate_collection_name, DEFAULT_COLLECTION
 
 
 router = APIRouter(prefix="/chat", tags=["chat"])
@@ -31,7 +32,12 @@ router = APIRouter(prefix="/chat", tags=["chat"])
 
 
 @router.post("/stream")
-async def chat_stream(query: str = Form(...), session_id: Optional[str] = Form(None), model: Optional[str] = Form(None)):
+async def chat_stream(query: str = Form(...), session_id: Optional[str] = Form(None), model: Optional[str] = Form(None),
+                      collection: str = Form(DEFAULT_COLLECTION)):
+    try:
+        collection = validate_collection_name(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     enter_ts = time.time()
     print(f"进入 stream 接口 ts={datetime.now().strftime('%Y-%m-%d %H:%M:%S')} sid={session_id or 'default'}")
     sid = session_id or "default"
@@ -48,6 +54,7 @@ async def chat_stream(query: str = Form(...), session_id: Optional[str] = Form(N
             system_message=app_state.system_message,
             conversation_history=app_state.histories[sid],
             model=(model or DEFAULT_MODEL),
+            collection=collection,
         ):
             if first_chunk_ts is None:
                 first_chunk_ts = time.time()
@@ -1,10 +1,11 @@
 from typing import List, Dict, Optional
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Response
 from fastapi.responses import JSONResponse
 from datetime import datetime
 import json
 
 from config.database import get_db_connection
+from core.pagination import encode_cursor, decode_time_cursor
 
 router = APIRouter(prefix="/history", tags=["history"])
 
@@ -36,7 +37,9 @@ def init_history_db():
             """
         )
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_session_id ON chat_messages (session_id);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated_at ON chat_sessions (updated_at);")
+        # (updated_at, id) 复合索引支持历史列表的 keyset 分页
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated_at_id ON chat_sessions (updated_at, id);")
+        cursor.execute("DROP INDEX IF EXISTS idx_chat_sessions_updated_at;")
         conn.commit()
     finally:
         cursor.close()
@@ -103,36 +106,46 @@ async def startup_event():
 
 @router.get("/list")
 async def get_chat_history(
+    response: Response,
     query: Optional[str] = Query(None, description="搜索关键词"),
     limit: int = Query(50, ge=1, le=200, description="返回数量上限"),
-    offset: int = Query(0, ge=0, description="偏移量")
+    offset: int = Query(0, ge=0, description="偏移量"),
+    page_cursor: Optional[str] = Query(None, alias="cursor", description="分页游标（上一页响应头 X-Next-Cursor，优先于 offset）")
 ) -> List[Dict]:
-    """获取聊天历史记录列表"""
+    """获取聊天历史记录列表，按 (updated_at, id) 倒序；下一页游标通过 X-Next-Cursor 响应头返回"""
     try:
-        conn = get_db_connection()
+        after = decode_time_cursor(page_cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        conn = get_db_connection(readonly=True)
         cursor = conn.cursor()
-        
-        # 构建查询SQL
+
+        # 构建查询SQL（游标分页沿 (updated_at, id) 索引定位，不再扫描并丢弃前面的行）
+        conditions = []
+        params = []
         if query:
-            sql = '''
-                SELECT DISTINCT cs.id, cs.title, cs.updated_at, cs.message_count
-                FROM chat_sessions cs
-                JOIN chat_messages cm ON cs.id = cm.session_id
-                WHERE cs.title LIKE %s OR cm.content LIKE %s
-                ORDER BY cs.updated_at DESC
-                LIMIT %s OFFSET %s
-            '''
             search_param = f"%{query}%"
-            cursor.execute(sql, (search_param, search_param, limit, offset))
-        else:
-            sql = '''
-                SELECT id, title, updated_at, message_count
-                FROM chat_sessions
-                ORDER BY updated_at DESC
-                LIMIT %s OFFSET %s
-            '''
-            cursor.execute(sql, (limit, offset))
-        
+            conditions.append(
+                "(cs.title LIKE %s OR EXISTS ("
+                "SELECT 1 FROM chat_messages cm WHERE cm.session_id = cs.id AND cm.content LIKE %s))"
+            )
+            params += [search_param, search_param]
+        if after:
+            conditions.append("(cs.updated_at, cs.id) < (%s, %s)")
+            params += list(after)
+            offset = 0
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f'''
+            SELECT cs.id, cs.title, cs.updated_at, cs.message_count
+            FROM chat_sessions cs
+            {where}
+            ORDER BY cs.updated_at DESC, cs.id DESC
+            LIMIT %s OFFSET %s
+        '''
+        cursor.execute(sql, (*params, limit, offset))
+
         rows = cursor.fetchall()
         
         # 格式化返回数据
@@ -144,7 +157,7 @@ async def get_chat_history(
             if not title:
                 cursor.execute('''
                     SELECT content FROM chat_messages 
-                    WHERE session_id = ? AND role = 'user' 
+                    WHERE session_id = %s AND role = 'user'
                     ORDER BY timestamp ASC LIMIT 1
                 ''', (session_id,))
                 first_msg = cursor.fetchone()
@@ -159,6 +172,10 @@ async def get_chat_history(
         
         cursor.close()
         conn.close()
+
+        if len(rows) == limit:
+            last_id, _, last_updated_at, _ = rows[-1]
+            response.headers["X-Next-Cursor"] = encode_cursor([last_updated_at, last_id])
         return history_list
         
     except Exception as e:
@@ -172,7 +189,7 @@ async def get_session_messages(
 ) -> Dict:
     """获取指定会话的聊天消息"""
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(readonly=True)
         cursor = conn.cursor()
         
         # 获取会话信息
@@ -281,7 +298,7 @@ async def clear_all_history() -> Dict:
 async def get_history_stats() -> Dict:
     """获取聊天历史统计信息"""
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(readonly=True)
         cursor = conn.cursor()
         
         # 总会话数
@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import asyncio
+from typing import AsyncIterator, List, Dict, Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from config.database import SHARD_DSNS
+from core.jobs import get_job, list_jobs
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+# SSE 进度流轮询任务状态的间隔（秒）与保活注释的间隔
+JOB_EVENTS_POLL_INTERVAL = float(os.environ.get("JOB_EVENTS_POLL_INTERVAL", "1"))
+_KEEPALIVE_SECONDS = 15
+
+
+def _check_shard(shard: Optional[int]) -> None:
+    if shard is not None and shard >= len(SHARD_DSNS):
+        raise HTTPException(status_code=400, detail=f"分片不存在: {shard}")
+
+
+@router.get("")
+async def get_jobs(
+    status: Optional[str] = Query(None, description="按状态过滤: queued/running/done/failed"),
+    limit: int = Query(50, ge=1, le=200, description="返回数量上限"),
+    shard: Optional[int] = Query(None, ge=0, description="分片模式下列出该分片的任务"),
+) -> List[Dict]:
+    """列出最近的后台任务"""
+    _check_shard(shard)
+    try:
+        return list_jobs(status=status, limit=limit, shard=shard)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取任务列表失败: {str(e)}")
+
+
+@router.get("/{job_id}")
+async def get_job_status(
+    job_id: int,
+    shard: Optional[int] = Query(None, ge=0, description="任务所在分片（删除文件接口返回的 shard）"),
+) -> Dict:
+    """查询后台任务的状态与进度"""
+    _check_shard(shard)
+    try:
+        job = get_job(job_id, shard=shard)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取任务状态失败: {str(e)}")
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+@router.get("/{job_id}/events")
+async def stream_job_events(
+    job_id: int,
+    shard: Optional[int] = Query(None, ge=0, description="任务所在分片"),
+) -> StreamingResponse:
+    """以 SSE 推送任务进度：状态或进度变化时发送 progress 事件，任务结束时发送 end 事件（数据为完整任务）"""
+    _check_shard(shard)
+    job = await run_in_threadpool(get_job, job_id, shard)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    async def events() -> AsyncIterator[str]:
+        last = None
+        last_sent = time.monotonic()
+        current = job
+        while True:
+            if current is None:
+                yield _sse("error", {"detail": "任务不存在"})
+                return
+            if current["status"] in ("done", "failed"):
+                yield _sse("end", current)
+                return
+            snapshot = {"id": current["id"], "status": current["status"], "progress": current["progress"],
+                        "error": current["error"], "attempts": current["attempts"]}
+            if snapshot != last:
+                yield _sse("progress", snapshot)
+                last, last_sent = snapshot, time.monotonic()
+            elif time.monotonic() - last_sent >= _KEEPALIVE_SECONDS:
+                # 注释行保活，避免代理因空闲断开连接
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            await asyncio.sleep(JOB_EVENTS_POLL_INTERVAL)
+            current = await run_in_threadpool(get_job, job_id, shard)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,67 +1,217 @@
-from typing import List, Dict
-from fastapi import APIRouter, HTTPException, Query
+import os
+from typing import List, Dict, Optional
+from fastapi import APIRouter, HTTPException, Query, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 
 from core.vector_store import vector_store
-from config.database import get_chunk_count, clear_all_chunks, delete_trace_data
+from config.database import (
+    get_chunk_count, get_collection_stats, delete_trace_data,
+    validate_collection_name, ensure_collection, list_collections, drop_collection, DEFAULT_COLLECTION,
+)
 from config.models import model_config
 from core.model_client import ModelClientFactory
+from core.pagination import decode_int_cursor, next_cursor
+from core.maintenance import schedule_purge
+from core.jobs import enqueue_job
+from core.bulk_import import BULK_MODES
+from core.snapshot import list_snapshots, resolve_snapshot_path
+from core.conversion_cache import conversion_cache
+from core.embedding_migration import start_embedding_migration, finalize_embedding_migration, get_migration_status
 
 router = APIRouter(prefix="/manage", tags=["manage"])
 
 
+def _resolve_collection(collection: str) -> str:
+    """校验请求中的集合名称，非法时返回 400"""
+    try:
+        return validate_collection_name(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _resolve_cursor(cursor: Optional[str]):
+    """解码 (chunk_index, id) 分页游标，非法时返回 400"""
+    try:
+        return decode_int_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/collections")
+async def get_collections() -> List[Dict]:
+    """获取所有集合及其近似chunk数"""
+    try:
+        return list_collections()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取集合列表失败: {str(e)}")
+
+
+@router.post("/collections")
+async def create_collection(name: str) -> Dict:
+    """创建集合（对应 document_chunks 的一个分区）"""
+    name = _resolve_collection(name)
+    try:
+        ensure_collection(name)
+        return {"message": f"集合 {name} 已就绪", "collection": name}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"创建集合失败: {str(e)}")
+
+
+@router.delete("/collections/{name}")
+async def delete_collection(name: str) -> Dict:
+    """删除集合：直接删除分区表，不逐行 DELETE"""
+    name = _resolve_collection(name)
+    try:
+        dropped = drop_collection(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"删除集合失败: {str(e)}")
+    if not dropped:
+        raise HTTPException(status_code=404, detail="集合不存在")
+    return {"message": f"成功删除集合 {name}", "collection": name}
+
+
+@router.post("/collections/{name}/bulk-import", status_code=202)
+async def bulk_import_collection(
+    name: str,
+    files: List[UploadFile] = File(...),
+    mode: str = Form("append", description="append: 追加; replace: 替换集合全部内容"),
+) -> Dict:
+    """后台批量导入：append 直接写入集合分区，文档在导入结束时统一生效；
+    replace 写入无索引暂存表，完成后一次性建索引并原子替换集合分区。进度见 /jobs/{job_id}"""
+    from core.ingestion import enqueue_bulk_import
+    from core.document_ingest import guess_file_type
+
+    name = _resolve_collection(name)
+    if mode not in BULK_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的导入模式: {mode}")
+    if not files:
+        raise HTTPException(status_code=400, detail="No files provided")
+
+    # 上传的临时文件在线程池中按块写入任务文件表，导入本身由 worker 执行
+    uploads = [(f.file, f.filename or "unknown", guess_file_type(f.filename or "")) for f in files]
+    try:
+        job_id = await run_in_threadpool(enqueue_bulk_import, name, mode, uploads)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"提交批量导入任务失败: {str(e)}")
+    return {"message": f"已提交批量导入任务: {name}", "job_id": job_id}
+
+
+@router.get("/snapshots")
+async def get_snapshots() -> List[Dict]:
+    """列出服务器上的语料快照"""
+    try:
+        return await run_in_threadpool(list_snapshots)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取快照列表失败: {str(e)}")
+
+
+@router.post("/snapshots/{name}/export", status_code=202)
+async def export_snapshot_job(
+    name: str,
+    collections: Optional[List[str]] = Query(None, description="只导出这些集合，缺省导出全部"),
+) -> Dict:
+    """后台导出语料快照（文本、元数据与 float16 向量），进度见 /jobs/{job_id}"""
+    try:
+        resolve_snapshot_path(name)
+        collections = [validate_collection_name(c) for c in collections] if collections else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job_id = enqueue_job("snapshot_export", {"name": name, "collections": collections})
+    return {"message": f"已提交快照导出任务: {name}", "job_id": job_id}
+
+
+@router.post("/snapshots/{name}/import", status_code=202)
+async def import_snapshot_job(
+    name: str,
+    mode: str = Query("replace", description="append: 追加到集合; replace: 替换集合全部内容"),
+    collections: Optional[List[str]] = Query(None, description="只导入这些集合，缺省导入全部"),
+    verify: bool = Query(True, description="导入前校验快照文件的 sha256"),
+) -> Dict:
+    """后台导入语料快照：COPY 到暂存表 → 一次性建索引 → 原子替换集合分区，进度见 /jobs/{job_id}"""
+    if mode not in BULK_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的导入模式: {mode}")
+    try:
+        path = resolve_snapshot_path(name)
+        collections = [validate_collection_name(c) for c in collections] if collections else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not os.path.isfile(os.path.join(path, "manifest.json")):
+        raise HTTPException(status_code=404, detail=f"快照不存在: {name}")
+    job_id = enqueue_job("snapshot_import", {"name": name, "mode": mode, "collections": collections,
+                                             "verify": verify})
+    return {"message": f"已提交快照导入任务: {name}", "job_id": job_id}
+
+
 @router.get("/files")
-async def get_files() -> List[Dict]:
+async def get_files(collection: str = Query(DEFAULT_COLLECTION, description="集合名称")) -> List[Dict]:
     """获取已上传文件的聚合信息：文件名、类型、chunk 数、首次/最后上传时间"""
+    collection = _resolve_collection(collection)
     try:
-        files = vector_store.get_file_list()
+        files = vector_store.get_file_list(collection=collection)
         return files
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取文件列表失败: {str(e)}")
 
 
 @router.get("/stats")
-async def get_stats() -> Dict:
-    """获取整体统计信息：总chunk数与文件汇总列表"""
+async def get_stats(
+    collection: str = Query(DEFAULT_COLLECTION, description="集合名称"),
+    exact: bool = Query(True, description="false 时总 chunk 数使用 pg_class.reltuples 估算值"),
+) -> Dict:
+    """获取整体统计信息：总chunk数与文件汇总列表（读取增量维护的统计表）"""
+    collection = _resolve_collection(collection)
     try:
-        chunk_count = get_chunk_count()
-        files = vector_store.get_file_list()
+        stats = get_collection_stats(collection)
+        chunk_count = stats["chunk_count"] if exact else get_chunk_count(collection, approximate=True)
+        files = vector_store.get_file_list(collection=collection)
         
         return {
+            "collection": collection,
             "total_chunks": chunk_count,
-            "total_files": len(files),
+            "total_files": stats["file_count"],
+            "total_bytes": stats["byte_size"],
+            "total_chars": stats["char_count"],
+            "exact": exact,
             "files": files
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取统计信息失败: {str(e)}")
 
 
-@router.delete("/files/{file_name}")
-async def delete_file(file_name: str) -> Dict:
-    """删除指定文件的所有文档块和轨迹数据，返回删除数量"""
+@router.delete("/files/{file_name}", status_code=202)
+async def delete_file(file_name: str, collection: str = Query(DEFAULT_COLLECTION, description="集合名称")) -> Dict:
+    """删除指定文件：文件立即对检索不可见，文档块由后台任务分批删除（进度见 /jobs/{job_id}）"""
+    collection = _resolve_collection(collection)
     try:
-        # 删除向量数据
-        deleted_chunks = vector_store.delete_file_chunks(file_name)
+        job_id = vector_store.delete_file_chunks(file_name, collection=collection)
         
         # 删除轨迹数据
         trace_deleted = delete_trace_data(file_name)
         
         return {
-            "message": f"成功删除文件 {file_name}",
-            "deleted_chunks": deleted_chunks,
+            "message": f"已提交文件 {file_name} 的删除任务" if job_id else f"文件 {file_name} 不存在",
+            "job_id": job_id,
+            "shard": vector_store.shard_for(collection, file_name),
             "trace_deleted": trace_deleted
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"删除文件失败: {str(e)}")
 
 
-@router.delete("/all")
-async def clear_all() -> Dict:
-    """清空所有文档块（谨慎操作）"""
+@router.delete("/all", status_code=202)
+async def clear_all(collection: Optional[str] = Query(None, description="只清空该集合，缺省清空全部")) -> Dict:
+    """清空所有文档块（谨慎操作）：后台以 TRUNCATE 执行，进度见 /jobs/{job_id}"""
+    if collection is not None:
+        collection = _resolve_collection(collection)
     try:
-        clear_all_chunks()
+        job_id = schedule_purge(collection)
         return {
-            "message": "成功清空所有文档块"
+            "message": "已提交清空任务",
+            "collection": collection,
+            "job_id": job_id
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"清空文档块失败: {str(e)}")
@@ -73,18 +223,25 @@ async def get_file_chunks(
     limit: int = Query(50, ge=1, le=500, description="返回数量上限"),
     offset: int = Query(0, ge=0, description="偏移量"),
     preview_length: int = Query(200, ge=0, le=2000, description="预览长度(0返回完整content)"),
+    collection: str = Query(DEFAULT_COLLECTION, description="集合名称"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor，优先于 offset）"),
 ) -> Dict:
     """按文件名分页获取chunk列表，支持返回内容预览长度控制"""
+    collection = _resolve_collection(collection)
+    after = _resolve_cursor(cursor)
     try:
-        total = vector_store.get_chunk_count_by_file(file_name)
-        items = vector_store.get_chunks_by_file(file_name, limit=limit, offset=offset, preview_length=preview_length)
+        total = vector_store.get_chunk_count_by_file(file_name, collection=collection)
+        items = vector_store.get_chunks_by_file(file_name, limit=limit, offset=offset, preview_length=preview_length,
+                                                collection=collection, after=after)
         return {
+            "collection": collection,
             "file_name": file_name,
             "total": total,
             "limit": limit,
             "offset": offset,
             "preview_length": preview_length,
             "items": items,
+            "next_cursor": next_cursor(items, limit, "chunk_index", "id"),
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取文件chunks失败: {str(e)}")
@@ -97,22 +254,73 @@ async def search_in_file(
     limit: int = Query(50, ge=1, le=500),
     offset: int = Query(0, ge=0),
     preview_length: int = Query(200, ge=0, le=2000),
+    collection: str = Query(DEFAULT_COLLECTION, description="集合名称"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor，优先于 offset）"),
 ) -> Dict:
     """在指定文件内按关键字检索chunk，支持分页与内容预览"""
+    collection = _resolve_collection(collection)
+    after = _resolve_cursor(cursor)
     try:
-        items = vector_store.search_chunks_in_file(file_name, q, limit=limit, offset=offset, preview_length=preview_length)
+        items = vector_store.search_chunks_in_file(file_name, q, limit=limit, offset=offset, preview_length=preview_length,
+                                                   collection=collection, after=after)
         return {
+            "collection": collection,
             "file_name": file_name,
             "query": q,
             "limit": limit,
             "offset": offset,
             "preview_length": preview_length,
             "items": items,
+            "next_cursor": next_cursor(items, limit, "chunk_index", "id"),
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"文件内搜索失败: {str(e)}")
 
 
+@router.get("/embedding")
+async def get_embedding_status() -> Dict:
+    """当前检索使用的向量列/模型；迁移进行中时附带新列的覆盖率"""
+    try:
+        return await run_in_threadpool(get_migration_status)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取向量设置失败: {str(e)}")
+
+
+@router.post("/embedding/migrate", status_code=202)
+async def migrate_embedding_model(
+    model: str = Query(..., min_length=1, max_length=128, description="新的向量模型（Ollama 模型名）")
+) -> Dict:
+    """在线迁移向量模型：新增向量列并在后台回填，覆盖率 100% 后自动切换检索，进度见 /jobs/{job_id}"""
+    try:
+        result = await run_in_threadpool(start_embedding_migration, model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"提交向量模型迁移失败: {str(e)}")
+    return {"message": f"已开始迁移到向量模型 {model}", **result}
+
+
+@router.post("/embedding/finalize")
+async def finalize_embedding() -> Dict:
+    """删除迁移切换前使用的旧向量列"""
+    try:
+        return await run_in_threadpool(finalize_embedding_migration)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"删除旧向量列失败: {str(e)}")
+
+
+@router.delete("/conversion-cache")
+async def clear_conversion_cache() -> Dict:
+    """清空文档转换结果缓存（如调整了 Docling 转换参数后）"""
+    try:
+        removed = await run_in_threadpool(conversion_cache.clear)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"清空转换缓存失败: {str(e)}")
+    return {"message": f"已删除 {removed} 个转换缓存条目", "removed": removed}
+
+
 @router.get("/model/config")
 async def get_model_config() -> Dict:
     """获取当前模型配置信息"""
@@ -1,242 +1,98 @@
-import io
-import json
-import logging
-from typing import List
-from datetime import datetime
+from typing import Dict, List, Optional
 
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from PyPDF2 import PdfReader
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
 
-from core.vector_store import vector_store
-from config.database import save_trace_data, get_trace_data, get_all_traces, delete_trace_data
+from core.document_ingest import guess_file_type
+from core.ingestion import enqueue_ingest
+from config.database import (get_trace_data, get_trace_payload, get_all_traces, delete_trace_data,
+                             validate_collection_name, DEFAULT_COLLECTION)
+from core.pagination import decode_time_cursor, next_cursor
 
 
 router = APIRouter(prefix="/upload", tags=["upload"])
 
 
-def extract_text_from_pdf(file_bytes: bytes) -> str:
-    """从PDF字节内容中提取所有页面文本并拼接返回"""
-    reader = PdfReader(io.BytesIO(file_bytes))
-    pages: List[str] = []
-    for page in reader.pages:
-        try:
-            pages.append(page.extract_text() or "")
-        except Exception:
-            pages.append("")
-    return "\n".join([p for p in pages if p]).strip()
-
-
-def normalize_and_chunk_text(raw_text: str, max_chunk_size: int = 1000) -> List[str]:
-    """规范化空白并按句子边界切分文本，保证每块不超过max_chunk_size字符"""
-    import re as _re
-    # Normalize whitespace
-    text = _re.sub(r"\s+", " ", raw_text or "").strip()
-    if not text:
-        return []
-    # Split by sentences (keep delimiters) and make <= max_chunk_size chunks
-    sentences = _re.split(r"(?<=[.!?]) +", text)
-    chunks: List[str] = []
-    current_chunk = ""
-    for sentence in sentences:
-        candidate = (current_chunk + (" " if current_chunk else "") + sentence).strip()
-        if len(candidate) <= max_chunk_size:
-            current_chunk = candidate
-        else:
-            if current_chunk:
-                chunks.append(current_chunk)
-            current_chunk = sentence.strip()
-            if len(current_chunk) > max_chunk_size:
-                # Hard wrap very long single sentence
-                start = 0
-                while start < len(current_chunk):
-                    end = start + max_chunk_size
-                    chunks.append(current_chunk[start:end])
-                    start = end
-                current_chunk = ""
-    if current_chunk:
-        chunks.append(current_chunk)
-    return chunks
+def _resolve_collection(collection: str) -> str:
+    """校验请求中的集合名称，非法时返回 400"""
+    try:
+        return validate_collection_name(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
-@router.post("/simple")
-async def upload_simple(files: List[UploadFile] = File(...)):
-    """上传文件并写入向量库：解析文本→正则分块→生成向量→入pgvector"""
+async def _enqueue_upload(mode: str, files: List[UploadFile], collection: str) -> Dict:
+    """保存上传文件并提交后台入库任务，立即返回任务 id（进度见 /jobs/{job_id} 与 /jobs/{job_id}/events）"""
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
+    collection = _resolve_collection(collection)
 
-    total_added = 0
-    for f in files:
-        data = await f.read()
-        name_lower = (f.filename or "").lower()
-        content = ""
-        file_type = "unknown"
-        
-        if name_lower.endswith(".pdf"):
-            content = extract_text_from_pdf(data)
-            file_type = "pdf"
-        elif name_lower.endswith(".json"):
-            try:
-                import json as _json
-                obj = _json.loads(data.decode("utf-8"))
-                content = _json.dumps(obj, ensure_ascii=False)
-                file_type = "json"
-            except Exception:
-                try:
-                    content = data.decode("utf-8")
-                    file_type = "text"
-                except Exception:
-                    content = data.decode("latin-1", errors="ignore")
-                    file_type = "text"
-        else:
-            try:
-                content = data.decode("utf-8")
-                file_type = "text"
-            except Exception:
-                content = data.decode("latin-1", errors="ignore")
-                file_type = "text"
+    # 直接传递 Starlette 的 SpooledTemporaryFile（大文件已在磁盘上），在线程池中逐个读取入库
+    uploads = [(f.file, f.filename or "unknown", guess_file_type(f.filename or "")) for f in files]
+    try:
+        job_id = await run_in_threadpool(enqueue_ingest, mode, collection, uploads)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"提交入库任务失败: {str(e)}")
+    return {
+        "job_id": job_id,
+        "mode": mode,
+        "total_files": len(uploads),
+        "collection": collection,
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+    }
 
-        # 分块处理
-        chunks = normalize_and_chunk_text(content, max_chunk_size=1000)
-        
-        if chunks:
-            # 存储到向量数据库
-            try:
-                added_count = vector_store.store_chunks(chunks, f.filename or "unknown", file_type)
-                total_added += added_count
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"存储文件失败: {str(e)}")
 
-    return {"added": total_added}
+@router.post("/simple", status_code=202)
+async def upload_simple(files: List[UploadFile] = File(...), collection: str = Form(DEFAULT_COLLECTION)):
+    """上传文件并在后台写入向量库：解析文本→正则分块→生成向量→入pgvector"""
+    return await _enqueue_upload("simple", files, collection)
 
 
-@router.post("/docling")
-async def upload_docling(files: List[UploadFile] = File(...)):
-    """使用 Docling export_to_text 解析多种文档并入库。
+@router.post("/docling", status_code=202)
+async def upload_docling(files: List[UploadFile] = File(...), collection: str = Form(DEFAULT_COLLECTION)):
+    """使用 Docling export_to_text 在后台解析多种文档并入库（多个文件在转换进程池中并行解析）。
     保留原 /upload/simple 作为简易文本路径。
     """
-    from core.document_ingest import ingest_bytes
-
-    if not files:
-        raise HTTPException(status_code=400, detail="No files provided")
+    return await _enqueue_upload("docling", files, collection)
 
-    total_added = 0
-    for f in files:
-        data = await f.read()
-        name_lower = (f.filename or "").lower()
-        file_type = "unknown"
-        if name_lower.endswith(".pdf"):
-            file_type = "pdf"
-        elif name_lower.endswith((".docx", ".doc")):
-            file_type = "docx"
-        elif name_lower.endswith((".pptx", ".ppt")):
-            file_type = "pptx"
-        elif name_lower.endswith((".png", ".jpg", ".jpeg", ".tiff", ".bmp")):
-            file_type = "image"
-        elif name_lower.endswith((".html", ".htm")):
-            file_type = "html"
-        elif name_lower.endswith((".md", ".markdown")):
-            file_type = "markdown"
-        elif name_lower.endswith((".adoc", ".asciidoc")):
-            file_type = "asciidoc"
-        else:
-            file_type = "text"
-
-        try:
-            added = ingest_bytes(data, f.filename or "unknown", file_type=file_type)
-            total_added += added
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Docling 解析或入库失败: {str(e)}")
 
-    return {"added": total_added}
-
-
-@router.post("/langgraph")
-async def upload_langgraph(files: List[UploadFile] = File(...)):
-    """使用 LangGraph 处理文档上传，返回完整的执行轨迹"""
-    from core.langgraph_document_flow import process_document_with_trace
-    
-    if not files:
-        raise HTTPException(status_code=400, detail="No files provided")
-
-    results = []
-    for f in files:
-        data = await f.read()
-        name_lower = (f.filename or "").lower()
-        file_type = "unknown"
-        if name_lower.endswith(".pdf"):
-            file_type = "pdf"
-        elif name_lower.endswith((".docx", ".doc")):
-            file_type = "docx"
-        elif name_lower.endswith((".pptx", ".ppt")):
-            file_type = "pptx"
-        elif name_lower.endswith((".png", ".jpg", ".jpeg", ".tiff", ".bmp")):
-            file_type = "image"
-        elif name_lower.endswith((".html", ".htm")):
-            file_type = "html"
-        elif name_lower.endswith((".md", ".markdown")):
-            file_type = "markdown"
-        elif name_lower.endswith((".adoc", ".asciidoc")):
-            file_type = "asciidoc"
-        else:
-            file_type = "text"
-
-        try:
-            # 使用 LangGraph 处理文档
-            result = process_document_with_trace(
-                file_bytes=data,
-                filename=f.filename or "unknown",
-                file_type=file_type
-            )
-            
-            # 保存轨迹数据到数据库
-            if result["execution_trace"] and f.filename:
-                try:
-                    save_trace_data(f.filename, file_type, result["execution_trace"])
-                except Exception as e:
-                    logging.error(f"保存轨迹数据到数据库失败: {e}")
-                    # 继续处理，不中断上传流程
-            
-            results.append({
-                "filename": f.filename,
-                "success": result["success"],
-                "result": result["result"],
-                "execution_trace": result["execution_trace"]
-            })
-        except Exception as e:
-            results.append({
-                "filename": f.filename,
-                "success": False,
-                "result": None,
-                "execution_trace": {
-                    "total_steps": 0,
-                    "steps": [],
-                    "errors": [f"处理失败: {str(e)}"],
-                    "execution_time": ""
-                }
-            })
-
-    return {
-        "results": results,
-        "total_files": len(files),
-        "successful_files": sum(1 for r in results if r["success"])
-    }
+@router.post("/langgraph", status_code=202)
+async def upload_langgraph(files: List[UploadFile] = File(...), collection: str = Form(DEFAULT_COLLECTION)):
+    """使用 LangGraph 在后台处理文档上传；每个文件的执行轨迹保存到 /upload/traces，结果汇总在任务进度中"""
+    return await _enqueue_upload("langgraph", files, collection)
 
 
 @router.get("/traces")
-async def get_traces():
-    """获取所有轨迹数据列表"""
+async def get_traces(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200, description="返回数量上限"),
+    page_cursor: Optional[str] = Query(None, alias="cursor", description="分页游标（上一页响应头 X-Next-Cursor）")
+):
+    """获取轨迹数据列表，按 (upload_time, id) 倒序；下一页游标通过 X-Next-Cursor 响应头返回"""
     try:
-        traces = get_all_traces()
-        return {"traces": traces}
+        after = decode_time_cursor(page_cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        traces = await run_in_threadpool(get_all_traces, limit, after)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取轨迹列表失败: {str(e)}")
+    cursor = next_cursor(traces, limit, "upload_time", "id")
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return {"traces": traces}
 
 
 @router.get("/traces/{file_name}")
-async def get_trace(file_name: str):
-    """根据文件名获取轨迹数据"""
+async def get_trace(
+    file_name: str,
+    include_payloads: bool = Query(False, description="同时返回各步骤完整的输入/输出（默认只返回摘要）")
+):
+    """根据文件名获取最近一次的轨迹数据；较大的步骤字段默认只返回占位摘要（payload: true），
+    详情通过 /traces/{file_name}/steps/{step_index} 按需读取"""
     try:
-        trace_data = get_trace_data(file_name)
+        trace_data = await run_in_threadpool(get_trace_data, file_name, include_payloads)
         if trace_data:
             return trace_data
         else:
@@ -247,6 +103,24 @@ async def get_trace(file_name: str):
         raise HTTPException(status_code=500, detail=f"获取轨迹数据失败: {str(e)}")
 
 
+@router.get("/traces/{file_name}/steps/{step_index}")
+async def get_trace_step(
+    file_name: str,
+    step_index: int,
+    trace_id: Optional[int] = Query(None, description="轨迹ID（默认为该文件最近一次的轨迹）")
+):
+    """读取一个步骤被移出摘要的完整输入/输出"""
+    try:
+        payload = await run_in_threadpool(get_trace_payload, file_name, step_index, trace_id)
+        if payload is None:
+            raise HTTPException(status_code=404, detail="该步骤没有详细数据")
+        return {"step_index": step_index, **payload}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取轨迹步骤详情失败: {str(e)}")
+
+
 @router.delete("/traces/{file_name}")
 async def delete_trace(file_name: str):
     """删除指定文件的轨迹数据"""
@@ -1,8 +1,19 @@
 import os
+import re
 import json
+import time
+import zlib
+import random
+import hashlib
+import functools
+import itertools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
 import psycopg2
+from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
-from typing import Optional, List
+from typing import Any, Callable, Optional, List, Dict, Tuple
 import logging
 
 # 数据库配置
@@ -14,8 +25,171 @@ DB_CONFIG = {
     'password': os.environ.get('DB_PASSWORD', 'password'),
 }
 
-def get_db_connection():
-    """获取数据库连接"""
+# 知识库集合配置：每个集合对应 document_chunks 的一个 LIST 分区
+DEFAULT_COLLECTION = os.environ.get('DEFAULT_COLLECTION', 'default')
+_COLLECTION_NAME_RE = re.compile(r'^[a-z0-9_]{1,48}$')
+# 已确认存在分区的 (分片, 集合)（进程内缓存，避免每次写入都查询系统表）
+_known_collections = set()
+
+# 只读副本配置：逗号分隔的 host[:port]（其余连接参数同主库），或完整的 libpq 连接串/URI
+DB_REPLICAS = [r.strip() for r in os.environ.get('DB_REPLICAS', '').split(',') if r.strip()]
+# 复制延迟超过该秒数的副本不参与读请求
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+# 副本健康状态（延迟检查结果）的缓存时间
+REPLICA_HEALTH_TTL = float(os.environ.get('REPLICA_HEALTH_TTL', '10'))
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('REPLICA_CONNECT_TIMEOUT', '2'))
+
+# 分片模式（可选）：分号分隔的各分片连接串。文档块与文档记录按文件路由到分片，
+# 主库（DB_CONFIG）保留聊天历史、轨迹等全局数据
+SHARD_DSNS = [d.strip() for d in os.environ.get('SHARD_DSNS', '').split(';') if d.strip()]
+# 分片只读查询（检索、列表）的语句超时（毫秒），超时分片的结果会被舍弃
+SHARD_STATEMENT_TIMEOUT_MS = int(os.environ.get('SHARD_STATEMENT_TIMEOUT_MS', '3000'))
+# 当前上下文使用的分片（None 表示主库）
+_current_shard: ContextVar[Optional[int]] = ContextVar('current_shard', default=None)
+
+# 向量列配置：检索使用 embedding_settings 中的 active 列，模型迁移期间同时写入 target 列
+DEFAULT_EMBEDDING_MODEL = 'nomic-embed-text'
+DEFAULT_EMBEDDING_DIM = 768
+_EMBEDDING_COLUMN_RE = re.compile(r'^embedding(_[a-z0-9_]{1,40})?$')
+# 向量设置的进程内缓存时间（秒），迁移切换后各进程最迟在该时间后改用新列
+EMBEDDING_SETTINGS_TTL = float(os.environ.get('EMBEDDING_SETTINGS_TTL', '5'))
+
+# LangGraph 执行轨迹：步骤中序列化后超过该字节数的字段压缩存入 langgraph_trace_payloads，按需读取
+TRACE_INLINE_BYTES = int(os.environ.get('TRACE_INLINE_BYTES', '512'))
+# 轨迹保留天数（0 表示不按时间清理）/ 每个文件保留的最近轨迹数（0 表示不限制）
+TRACE_RETENTION_DAYS = int(os.environ.get('TRACE_RETENTION_DAYS', '30'))
+TRACE_KEEP_PER_FILE = int(os.environ.get('TRACE_KEEP_PER_FILE', '5'))
+# 执行成功的轨迹按该比例采样保存（0~1），失败的轨迹总是保存
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '1.0'))
+# (加载时间, 设置)
+_embedding_settings_cache: tuple = (0.0, None)
+
+# replica -> (是否可用, 检查时间)
+_replica_health: Dict[str, tuple] = {}
+_replica_lock = threading.Lock()
+_replica_cursor = itertools.count()
+
+def _replica_connect_args(replica: str) -> dict:
+    """把 DB_REPLICAS 中的一项转换为 psycopg2.connect 参数"""
+    if '=' in replica or '://' in replica:
+        return {'dsn': replica, 'connect_timeout': REPLICA_CONNECT_TIMEOUT}
+    host, _, port = replica.partition(':')
+    return {**DB_CONFIG, 'host': host, 'port': port or DB_CONFIG['port'], 'connect_timeout': REPLICA_CONNECT_TIMEOUT}
+
+def _replica_lag_ok(conn) -> bool:
+    """检查副本复制延迟：WAL 接收进程正在流复制且已全部回放时视为无延迟，
+    否则（包括与主库断开后停在已接收位置的副本）按最后回放事务的时间计算，无法得知时视为不可用"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming')
+                     AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp())
+            END;
+        """)
+        lag = cursor.fetchone()[0]
+        conn.rollback()
+        if lag is None:
+            logging.warning("只读副本未连接主库且没有回放记录，无法确定延迟，暂不使用")
+            return False
+        lag = float(lag)
+        if lag > REPLICA_MAX_LAG_SECONDS:
+            logging.warning(f"只读副本延迟 {lag:.1f}s 超过阈值 {REPLICA_MAX_LAG_SECONDS}s，暂不使用")
+            return False
+        return True
+    finally:
+        cursor.close()
+
+def _connect_replica():
+    """按轮询顺序连接一个健康的只读副本，全部不可用时返回 None"""
+    start = next(_replica_cursor)
+    now = time.monotonic()
+    for i in range(len(DB_REPLICAS)):
+        replica = DB_REPLICAS[(start + i) % len(DB_REPLICAS)]
+        with _replica_lock:
+            healthy, checked_at = _replica_health.get(replica, (True, None))
+        fresh = checked_at is not None and now - checked_at < REPLICA_HEALTH_TTL
+        if fresh and not healthy:
+            continue
+        conn = None
+        try:
+            conn = psycopg2.connect(**_replica_connect_args(replica))
+            # 健康状态过期时在本连接上顺带检查延迟，不额外建立连接
+            if not fresh:
+                healthy = _replica_lag_ok(conn)
+                with _replica_lock:
+                    _replica_health[replica] = (healthy, now)
+                if not healthy:
+                    conn.close()
+                    continue
+            return conn
+        except Exception as e:
+            logging.warning(f"只读副本 {replica} 不可用: {e}")
+            if conn is not None:
+                conn.close()
+            with _replica_lock:
+                _replica_health[replica] = (False, now)
+    return None
+
+@contextmanager
+def use_shard(index: Optional[int]):
+    """在上下文内把 get_db_connection 指向第 index 个分片（None 表示主库）"""
+    token = _current_shard.set(index)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+def current_shard() -> Optional[int]:
+    return _current_shard.get()
+
+def data_shards() -> List[Optional[int]]:
+    """需要访问的数据分片：已在分片上下文内时只返回当前分片，分片模式下返回全部分片，否则只有主库"""
+    shard = _current_shard.get()
+    if shard is not None:
+        return [shard]
+    if SHARD_DSNS:
+        return list(range(len(SHARD_DSNS)))
+    return [None]
+
+def _across_shards(merge: Callable[[list], Any]):
+    """装饰器：分片模式下在每个分片上依次执行，并用 merge 合并各分片的返回值"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            shards = data_shards()
+            if shards == [_current_shard.get()]:
+                return func(*args, **kwargs)
+            results = []
+            for shard in shards:
+                with use_shard(shard):
+                    results.append(func(*args, **kwargs))
+            return merge(results)
+        return wrapper
+    return decorator
+
+def get_db_connection(readonly: bool = False):
+    """获取数据库连接。
+    在 use_shard 上下文内连接对应分片（只读查询附带语句超时）；
+    readonly=True 时优先使用配置的只读副本（延迟超限或不可用的副本会被跳过），没有可用副本时回退到主库；
+    写操作以及需要读到刚写入数据的查询应使用默认的主库连接。
+    """
+    shard = _current_shard.get()
+    if shard is not None:
+        kwargs = {'dsn': SHARD_DSNS[shard]}
+        if readonly and SHARD_STATEMENT_TIMEOUT_MS > 0:
+            kwargs['options'] = f'-c statement_timeout={SHARD_STATEMENT_TIMEOUT_MS}'
+        try:
+            return psycopg2.connect(**kwargs)
+        except Exception as e:
+            logging.error(f"分片 {shard} 连接失败: {e}")
+            raise
+    if readonly and DB_REPLICAS:
+        conn = _connect_replica()
+        if conn is not None:
+            return conn
     try:
         conn = psycopg2.connect(**DB_CONFIG)
         return conn
@@ -23,8 +197,475 @@ def get_db_connection():
         logging.error(f"数据库连接失败: {e}")
         raise
 
+def validate_collection_name(name: str) -> str:
+    """校验集合名称（小写字母、数字、下划线，最长48位），返回规范化后的名称"""
+    name = (name or "").strip()
+    if not _COLLECTION_NAME_RE.match(name):
+        raise ValueError(f"非法的集合名称: {name!r}，仅支持小写字母、数字和下划线，长度 1-48")
+    return name
+
+def collection_partition_name(name: str) -> str:
+    """集合对应的分区表名"""
+    return f"document_chunks_{validate_collection_name(name)}"
+
+def _ensure_partitioned_chunks_table(cursor):
+    """确保 document_chunks 为按 collection 分区的父表；旧版单表会被迁移到默认集合分区"""
+    cursor.execute("""
+        SELECT c.relkind FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = 'document_chunks' AND n.nspname = current_schema();
+    """)
+    row = cursor.fetchone()
+    relkind = row[0] if row else None
+    if relkind == 'p':
+        return
+
+    if relkind == 'r':
+        logging.info("检测到旧版 document_chunks 单表，迁移到分区表结构")
+        cursor.execute("ALTER TABLE document_chunks RENAME TO document_chunks_legacy;")
+
+    cursor.execute("""
+        CREATE TABLE document_chunks (
+            id SERIAL,
+            collection VARCHAR(64) NOT NULL DEFAULT %s,
+            content TEXT NOT NULL,
+            file_name VARCHAR(255),
+            chunk_index INTEGER,
+            file_type VARCHAR(50),
+            created_at TIMESTAMP DEFAULT NOW(),
+            embedding vector(768),
+            content_tsv tsvector GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED,
+            PRIMARY KEY (id, collection)
+        ) PARTITION BY LIST (collection);
+    """, (DEFAULT_COLLECTION,))
+
+    if relkind == 'r':
+        _create_collection_partition(cursor, DEFAULT_COLLECTION)
+        cursor.execute("""
+            INSERT INTO document_chunks (id, collection, content, file_name, chunk_index, file_type, created_at, embedding)
+            SELECT id, %s, content, file_name, chunk_index, file_type, created_at, embedding
+            FROM document_chunks_legacy;
+        """, (DEFAULT_COLLECTION,))
+        cursor.execute("""
+            SELECT setval(pg_get_serial_sequence('document_chunks', 'id'),
+                          GREATEST((SELECT MAX(id) FROM document_chunks), 1));
+        """)
+        # 旧表的索引随表一起删除，新索引在分区父表上重新创建
+        cursor.execute("DROP TABLE document_chunks_legacy;")
+
+def _create_collection_partition(cursor, name: str):
+    """为集合创建 LIST 分区并登记到集合注册表（幂等）"""
+    name = validate_collection_name(name)
+    partition = collection_partition_name(name)
+    cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF document_chunks FOR VALUES IN ({});").format(
+        sql.Identifier(partition), sql.Literal(name)
+    ))
+    cursor.execute("""
+        INSERT INTO document_collections (name, partition_name)
+        VALUES (%s, %s)
+        ON CONFLICT (name) DO NOTHING;
+    """, (name, partition))
+
+def _ensure_documents_table(cursor):
+    """创建 documents 表、document_chunks.document_id 列，并为旧数据补齐文档记录"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS documents (
+            id BIGSERIAL PRIMARY KEY,
+            collection VARCHAR(64) NOT NULL,
+            name VARCHAR(255) NOT NULL,
+            file_type VARCHAR(50),
+            content_hash CHAR(64),
+            version INTEGER NOT NULL DEFAULT 1,
+            status VARCHAR(16) NOT NULL DEFAULT 'pending',
+            chunk_count INTEGER NOT NULL DEFAULT 0,
+            byte_size BIGINT,
+            char_count BIGINT,
+            created_at TIMESTAMP DEFAULT NOW(),
+            activated_at TIMESTAMP
+        );
+    """)
+    # 同一集合内同名文件最多一个 active 版本
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_documents_active
+        ON documents (collection, name) WHERE status = 'active';
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_documents_collection_name
+        ON documents (collection, name, version);
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_documents_status
+        ON documents (status) WHERE status <> 'active';
+    """)
+
+    cursor.execute("ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS document_id BIGINT;")
+    # (document_id, chunk_index, id) 同时服务按文档删除与按文件的 keyset 分页，取代单列索引
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_document_chunks_document_chunk
+        ON document_chunks (document_id, chunk_index, id);
+    """)
+    cursor.execute("DROP INDEX IF EXISTS idx_document_chunks_document_id;")
+    # 文档块内容哈希：重新入库时按块比对，未变化的块复用已有向量
+    cursor.execute("ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS chunk_hash CHAR(64);")
+    # 文档块元数据（如 {"pages": [起始页, 结束页]}）
+    cursor.execute("ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS metadata JSONB;")
+
+    # 旧数据（无 document_id）按 (collection, file_name) 补建 active 文档
+    cursor.execute("SELECT 1 FROM document_chunks WHERE document_id IS NULL LIMIT 1;")
+    if cursor.fetchone():
+        logging.info("为已有文档块补建 documents 记录")
+        cursor.execute("""
+            INSERT INTO documents (collection, name, file_type, version, status, chunk_count, char_count, created_at, activated_at)
+            SELECT collection, COALESCE(file_name, 'unknown'), MIN(file_type), 1, 'active',
+                   COUNT(*), SUM(LENGTH(content)), MIN(created_at), NOW()
+            FROM document_chunks
+            WHERE document_id IS NULL
+            GROUP BY collection, COALESCE(file_name, 'unknown')
+            ON CONFLICT DO NOTHING;
+        """)
+        cursor.execute("""
+            UPDATE document_chunks c SET document_id = d.id
+            FROM documents d
+            WHERE c.document_id IS NULL AND d.status = 'active'
+              AND d.collection = c.collection AND d.name = COALESCE(c.file_name, 'unknown');
+        """)
+
+    # 同名文件首次上传时间随版本继承，文件列表无需回查旧版本
+    cursor.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS first_uploaded_at TIMESTAMP;")
+    cursor.execute("UPDATE documents SET first_uploaded_at = created_at WHERE first_uploaded_at IS NULL;")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_documents_active_recent
+        ON documents (collection, activated_at DESC) WHERE status = 'active';
+    """)
+
+def _ensure_collection_stats_table(cursor):
+    """创建集合级统计表，并按 documents 的 active 版本重算一次（纠正可能的漂移）"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS collection_stats (
+            collection VARCHAR(64) PRIMARY KEY,
+            file_count BIGINT NOT NULL DEFAULT 0,
+            chunk_count BIGINT NOT NULL DEFAULT 0,
+            byte_size BIGINT NOT NULL DEFAULT 0,
+            char_count BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT NOW()
+        );
+    """)
+    refresh_collection_stats(cursor)
+
+def refresh_collection_stats(cursor, collection: Optional[str] = None):
+    """在调用方事务内按 documents 表重算集合统计（只扫描文档记录，不扫描文档块）"""
+    if collection:
+        cursor.execute("DELETE FROM collection_stats WHERE collection = %s;", (collection,))
+    else:
+        cursor.execute("DELETE FROM collection_stats;")
+    cursor.execute("""
+        INSERT INTO collection_stats (collection, file_count, chunk_count, byte_size, char_count)
+        SELECT collection, COUNT(*), COALESCE(SUM(chunk_count), 0),
+               COALESCE(SUM(byte_size), 0), COALESCE(SUM(char_count), 0)
+        FROM documents
+        WHERE status = 'active' AND (%s IS NULL OR collection = %s)
+        GROUP BY collection;
+    """, (collection, collection))
+
+def _ensure_jobs_table(cursor):
+    """创建后台任务表（删除、清空、VACUUM 等耗时操作在后台按批执行，可断点续跑）"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS background_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            kind VARCHAR(64) NOT NULL,
+            params JSONB NOT NULL DEFAULT '{}'::jsonb,
+            status VARCHAR(16) NOT NULL DEFAULT 'queued',
+            progress JSONB NOT NULL DEFAULT '{}'::jsonb,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            dedupe_key VARCHAR(255),
+            worker VARCHAR(128),
+            run_after TIMESTAMP,
+            created_at TIMESTAMP DEFAULT NOW(),
+            started_at TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT NOW(),
+            finished_at TIMESTAMP
+        );
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_background_jobs_pending
+        ON background_jobs (id) WHERE status IN ('queued', 'running');
+    """)
+    # 同一 dedupe_key 同时只保留一个排队中的任务（如同一分区的 VACUUM）
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_background_jobs_dedupe
+        ON background_jobs (dedupe_key) WHERE status = 'queued' AND dedupe_key IS NOT NULL;
+    """)
+    # 任务附带的上传文件（入库任务可由其它机器上的 worker 读取），任务结束后删除
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_blobs (
+            id BIGSERIAL PRIMARY KEY,
+            job_id BIGINT NOT NULL REFERENCES background_jobs(id) ON DELETE CASCADE,
+            file_name VARCHAR(255) NOT NULL,
+            file_type VARCHAR(50),
+            byte_size BIGINT NOT NULL,
+            content_hash VARCHAR(64),
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_blobs_job_id ON job_blobs (job_id);")
+    # 文件内容按块存放（每行不超过 1MB），上传与读取都逐块进行，文件大小不受单个 bytea 的限制
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_blob_parts (
+            blob_id BIGINT NOT NULL REFERENCES job_blobs(id) ON DELETE CASCADE,
+            part INTEGER NOT NULL,
+            data BYTEA NOT NULL,
+            PRIMARY KEY (blob_id, part)
+        );
+    """)
+    # 已经是按块写入的上传内容，不再尝试 TOAST 压缩
+    cursor.execute("ALTER TABLE job_blob_parts ALTER COLUMN data SET STORAGE EXTERNAL;")
+    cursor.execute("ALTER TABLE job_blobs ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);")
+    # 旧版本整文件存放在 job_blobs.data 中：未处理完的文件转为一个块后删除该列
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'job_blobs' AND table_schema = current_schema() AND column_name = 'data';
+    """)
+    if cursor.fetchone():
+        cursor.execute("""
+            INSERT INTO job_blob_parts (blob_id, part, data)
+            SELECT id, 0, data FROM job_blobs WHERE data IS NOT NULL
+            ON CONFLICT DO NOTHING;
+        """)
+        cursor.execute("""
+            UPDATE job_blobs SET content_hash = encode(sha256(data), 'hex')
+            WHERE content_hash IS NULL AND data IS NOT NULL;
+        """)
+        cursor.execute("ALTER TABLE job_blobs DROP COLUMN data;")
+
+def _ensure_embedding_settings_table(cursor):
+    """创建向量设置表（单行）：检索使用的列与模型，以及迁移中的目标列"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_settings (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            active_column VARCHAR(63) NOT NULL,
+            active_model VARCHAR(128) NOT NULL,
+            active_dim INTEGER NOT NULL,
+            target_column VARCHAR(63),
+            target_model VARCHAR(128),
+            target_dim INTEGER,
+            previous_column VARCHAR(63),
+            updated_at TIMESTAMP DEFAULT NOW()
+        );
+    """)
+    cursor.execute("""
+        INSERT INTO embedding_settings (id, active_column, active_model, active_dim)
+        VALUES (TRUE, 'embedding', %s, %s)
+        ON CONFLICT (id) DO NOTHING;
+    """, (DEFAULT_EMBEDDING_MODEL, DEFAULT_EMBEDDING_DIM))
+
+def validate_embedding_column(name: str) -> str:
+    """校验向量列名（列名会拼接进 SQL 标识符）"""
+    if not name or not _EMBEDDING_COLUMN_RE.match(name):
+        raise ValueError(f"非法的向量列名: {name}")
+    return name
+
+def get_embedding_settings(refresh: bool = False) -> dict:
+    """当前的向量列设置（以主库为准，进程内缓存 EMBEDDING_SETTINGS_TTL 秒）。
+    返回 active_column/active_model/active_dim，迁移进行中时 target_* 非空。
+    """
+    global _embedding_settings_cache
+    loaded_at, settings = _embedding_settings_cache
+    if not refresh and settings is not None and time.monotonic() - loaded_at < EMBEDDING_SETTINGS_TTL:
+        return settings
+
+    with use_shard(None):
+        conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute("""
+            SELECT active_column, active_model, active_dim, target_column, target_model, target_dim, previous_column
+            FROM embedding_settings WHERE id;
+        """)
+        row = cursor.fetchone()
+    except psycopg2.ProgrammingError:
+        # 尚未初始化（init_database 之前）时使用默认列
+        row = None
+    finally:
+        cursor.close()
+        conn.close()
+
+    settings = dict(row) if row else {
+        'active_column': 'embedding', 'active_model': DEFAULT_EMBEDDING_MODEL, 'active_dim': DEFAULT_EMBEDDING_DIM,
+        'target_column': None, 'target_model': None, 'target_dim': None, 'previous_column': None,
+    }
+    for key in ('active_column', 'target_column', 'previous_column'):
+        if settings[key]:
+            validate_embedding_column(settings[key])
+    _embedding_settings_cache = (time.monotonic(), settings)
+    return settings
+
+def _apply_stats_delta(cursor, collection: str, files: int, chunks: int, byte_size: int, char_count: int):
+    """在调用方事务内对集合统计做增量更新"""
+    cursor.execute("""
+        INSERT INTO collection_stats (collection, file_count, chunk_count, byte_size, char_count)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (collection) DO UPDATE SET
+            file_count = collection_stats.file_count + EXCLUDED.file_count,
+            chunk_count = collection_stats.chunk_count + EXCLUDED.chunk_count,
+            byte_size = collection_stats.byte_size + EXCLUDED.byte_size,
+            char_count = collection_stats.char_count + EXCLUDED.char_count,
+            updated_at = NOW();
+    """, (collection, files, chunks, byte_size, char_count))
+
+def create_document_version(cursor, collection: str, name: str, file_type: str,
+                            content_hash: Optional[str] = None, byte_size: Optional[int] = None,
+                            first_uploaded_at: Optional[str] = None) -> int:
+    """在调用方事务内创建一个 pending 状态的新文档版本，返回 document_id。
+    first_uploaded_at（如快照中记录的首次上传时间）早于已有版本时作为该文件的首次上传时间"""
+    # 同名文件的版本号分配需要串行化
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (f"documents:{collection}/{name}",))
+    cursor.execute("""
+        INSERT INTO documents (collection, name, file_type, content_hash, version, status, byte_size, first_uploaded_at)
+        SELECT %s, %s, %s, %s, COALESCE(MAX(version), 0) + 1, 'pending', %s,
+               COALESCE(LEAST(MIN(first_uploaded_at), %s::timestamp), NOW())
+        FROM documents WHERE collection = %s AND name = %s
+        RETURNING id;
+    """, (collection, name, file_type, content_hash, byte_size, first_uploaded_at, collection, name))
+    return cursor.fetchone()[0]
+
+def activate_document(cursor, document_id: int, chunk_count: int, char_count: int) -> List[int]:
+    """在调用方事务内把文档版本切换为 active，旧的 active 版本标记为 superseded，返回被替换的版本 id。
+    集合统计在同一事务内增量更新。
+    """
+    cursor.execute("SELECT collection, name, COALESCE(byte_size, 0) FROM documents WHERE id = %s FOR UPDATE;",
+                   (document_id,))
+    collection, name, byte_size = cursor.fetchone()
+    cursor.execute("""
+        UPDATE documents SET status = 'superseded'
+        WHERE collection = %s AND name = %s AND status = 'active' AND id <> %s
+        RETURNING id, chunk_count, COALESCE(byte_size, 0), COALESCE(char_count, 0);
+    """, (collection, name, document_id))
+    rows = cursor.fetchall()
+    superseded = [r[0] for r in rows]
+    cursor.execute("""
+        UPDATE documents
+        SET status = 'active', activated_at = NOW(), chunk_count = %s, char_count = %s
+        WHERE id = %s;
+    """, (chunk_count, char_count, document_id))
+    _apply_stats_delta(
+        cursor, collection,
+        1 - len(rows),
+        chunk_count - sum(r[1] for r in rows),
+        byte_size - sum(r[2] for r in rows),
+        char_count - sum(r[3] for r in rows),
+    )
+    return superseded
+
+def chunk_hash(content: str) -> str:
+    """文档块内容的 sha256（十六进制），与 document_chunks.chunk_hash 对应"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def find_active_document(cursor, collection: str, name: str) -> Optional[Tuple[int, Optional[str], int]]:
+    """同名文件当前 active 版本的 (document_id, content_hash, chunk_count)，不存在时返回 None"""
+    cursor.execute("""
+        SELECT id, content_hash, chunk_count FROM documents
+        WHERE collection = %s AND name = %s AND status = 'active';
+    """, (collection, name))
+    return cursor.fetchone()
+
+def document_chunk_ids(cursor, collection: str, document_id: int, columns: List[str]) -> Dict[str, int]:
+    """文档版本中 块内容哈希 → 文档块 id，只包含 columns 中向量列都已填充的块。
+    早期写入的块没有 chunk_hash，按内容现算。
+    """
+    filled = sql.SQL(" AND ").join(sql.SQL("{} IS NOT NULL").format(sql.Identifier(c)) for c in columns)
+    cursor.execute(sql.SQL("""
+        SELECT COALESCE(chunk_hash, encode(sha256(convert_to(content, 'UTF8')), 'hex')), id
+        FROM document_chunks
+        WHERE collection = %s AND document_id = %s AND {};
+    """).format(filled), (collection, document_id))
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+def copy_document_chunks(cursor, collection: str, document_id: int, file_type: str,
+                         reused: List[Tuple[int, int, Optional[dict]]], columns: List[str]) -> int:
+    """在调用方事务内把已有文档块（含向量列 columns）复制到新文档版本，
+    reused 为 (原文档块 id, 新 chunk_index, 新元数据)，返回复制的块数。复制在数据库内完成，不重新生成向量。
+    """
+    if not reused:
+        return 0
+    vectors = sql.SQL(", ").join(map(sql.Identifier, columns))
+    cursor.execute(sql.SQL("""
+        INSERT INTO document_chunks (collection, document_id, content, file_name, chunk_index, file_type, chunk_hash,
+                                     metadata, {cols})
+        SELECT c.collection, %s, c.content, c.file_name, m.chunk_index, %s,
+               COALESCE(c.chunk_hash, encode(sha256(convert_to(c.content, 'UTF8')), 'hex')), m.metadata, {src}
+        FROM unnest(%s::bigint[], %s::int[], %s::jsonb[]) AS m(chunk_id, chunk_index, metadata)
+        JOIN document_chunks c ON c.id = m.chunk_id AND c.collection = %s;
+    """).format(
+        cols=vectors,
+        src=sql.SQL(", ").join(sql.SQL("c.{}").format(sql.Identifier(c)) for c in columns),
+    ), (
+        document_id, file_type,
+        [r[0] for r in reused], [r[1] for r in reused],
+        [json.dumps(r[2], ensure_ascii=False) if r[2] else None for r in reused],
+        collection,
+    ))
+    return cursor.rowcount
+
+def retire_documents(cursor, document_ids: List[int]) -> List[int]:
+    """在调用方事务内把文档版本标记为 deleting（立即对检索和文件列表不可见），
+    active 版本同步扣减集合统计，返回实际被标记的 id。文档块由后台任务分批删除。
+    """
+    if not document_ids:
+        return []
+    cursor.execute("""
+        UPDATE documents d SET status = 'deleting'
+        FROM (
+            SELECT id, status AS old_status FROM documents
+            WHERE id = ANY(%s) AND status <> 'deleting'
+            FOR UPDATE
+        ) o
+        WHERE d.id = o.id
+        RETURNING d.id, d.collection, o.old_status, d.chunk_count,
+                  COALESCE(d.byte_size, 0), COALESCE(d.char_count, 0);
+    """, (list(document_ids),))
+    rows = cursor.fetchall()
+    for _, coll, old_status, chunks, byte_size, chars in rows:
+        if old_status == 'active':
+            _apply_stats_delta(cursor, coll, -1, -chunks, -byte_size, -chars)
+    return [r[0] for r in rows]
+
+def delete_documents(cursor, document_ids: List[int], collection: Optional[str] = None) -> int:
+    """在调用方事务内删除文档版本及其文档块，active 版本会同步扣减集合统计，返回删除的chunk数"""
+    if not document_ids:
+        return 0
+    cursor.execute("""
+        DELETE FROM documents WHERE id = ANY(%s)
+        RETURNING collection, status, chunk_count, COALESCE(byte_size, 0), COALESCE(char_count, 0);
+    """, (list(document_ids),))
+    removed: Dict[str, List[int]] = {}
+    for coll, status, chunks, byte_size, chars in cursor.fetchall():
+        if status != 'active':
+            continue
+        totals = removed.setdefault(coll, [0, 0, 0, 0])
+        totals[0] += 1
+        totals[1] += chunks
+        totals[2] += byte_size
+        totals[3] += chars
+    if collection:
+        cursor.execute("DELETE FROM document_chunks WHERE collection = %s AND document_id = ANY(%s);",
+                       (collection, list(document_ids)))
+    else:
+        cursor.execute("DELETE FROM document_chunks WHERE document_id = ANY(%s);", (list(document_ids),))
+    deleted = cursor.rowcount
+    for coll, (files, chunks, byte_size, chars) in removed.items():
+        _apply_stats_delta(cursor, coll, -files, -chunks, -byte_size, -chars)
+    return deleted
+
 def init_database():
-    """初始化数据库和pgvector扩展"""
+    """初始化数据库和pgvector扩展（分片模式下主库与每个分片都会初始化）"""
+    _init_schema()
+    for shard in range(len(SHARD_DSNS)):
+        with use_shard(shard):
+            _init_schema()
+
+def _init_schema():
+    """在当前连接目标（主库或分片）上创建表结构与索引"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -34,18 +675,18 @@ def init_database():
         # 创建 trigram 扩展（用于 BM25 替代的近似匹配/相似度）
         cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
         
-        # 创建文档块表
+        # 创建集合注册表
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS document_chunks (
-                id SERIAL PRIMARY KEY,
-                content TEXT NOT NULL,
-                file_name VARCHAR(255),
-                chunk_index INTEGER,
-                file_type VARCHAR(50),
-                created_at TIMESTAMP DEFAULT NOW(),
-                embedding vector(768)
+            CREATE TABLE IF NOT EXISTS document_collections (
+                name VARCHAR(64) PRIMARY KEY,
+                partition_name VARCHAR(128) NOT NULL,
+                created_at TIMESTAMP DEFAULT NOW()
             );
         """)
+
+        # 创建文档块表（按集合 LIST 分区，旧的单表结构会被迁移）
+        _ensure_partitioned_chunks_table(cursor)
+        _create_collection_partition(cursor, DEFAULT_COLLECTION)
         
         # 创建轨迹数据表
         cursor.execute("""
@@ -58,18 +699,51 @@ def init_database():
                 created_at TIMESTAMP DEFAULT NOW()
             );
         """)
+        # 轨迹中较大的步骤字段（分块列表、文本预览等）压缩后单独存放，查看步骤详情时才读取
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS langgraph_trace_payloads (
+                trace_id INTEGER NOT NULL REFERENCES langgraph_traces(id) ON DELETE CASCADE,
+                step_index INTEGER NOT NULL,
+                byte_size INTEGER NOT NULL,
+                data BYTEA NOT NULL,
+                PRIMARY KEY (trace_id, step_index)
+            );
+        """)
+        # 内容已压缩，不再尝试 TOAST 压缩
+        cursor.execute("ALTER TABLE langgraph_trace_payloads ALTER COLUMN data SET STORAGE EXTERNAL;")
         
         # 创建向量索引（使用HNSW索引提升性能）
+        # 在分区父表上创建的索引会自动下发到每个集合分区，检索只会命中对应分区的较小索引
+        # 向量模型迁移完成并删除旧列后，原 embedding 列可能已不存在（新列的索引由迁移任务创建）
         cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_document_chunks_embedding 
-            ON document_chunks USING hnsw (embedding vector_cosine_ops);
+            DO $$ BEGIN
+                IF EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'document_chunks' AND column_name = 'embedding'
+                ) THEN
+                    CREATE INDEX IF NOT EXISTS idx_document_chunks_embedding
+                    ON document_chunks USING hnsw (embedding vector_cosine_ops);
+                END IF;
+            END $$;
         """)
         
         # 创建文件索引
         cursor.execute("""
             CREATE INDEX IF NOT EXISTS idx_document_chunks_file_name 
-            ON document_chunks (file_name);
+            ON document_chunks (collection, file_name);
         """)
+
+        # 创建文档表（每次上传对应一个版本，检索只看 status='active' 的版本）
+        _ensure_documents_table(cursor)
+
+        # 创建集合统计表（与文档版本切换/删除在同一事务内增量维护）
+        _ensure_collection_stats_table(cursor)
+
+        # 创建后台任务表
+        _ensure_jobs_table(cursor)
+
+        # 创建向量设置表（向量模型迁移时切换检索使用的列）
+        _ensure_embedding_settings_table(cursor)
         
         # 创建轨迹数据索引
         cursor.execute("""
@@ -81,6 +755,11 @@ def init_database():
             CREATE INDEX IF NOT EXISTS idx_langgraph_traces_upload_time 
             ON langgraph_traces (upload_time);
         """)
+        # 轨迹列表按 (upload_time, id) 游标分页
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_langgraph_traces_upload_time_id
+            ON langgraph_traces (upload_time DESC, id DESC);
+        """)
 
         # 创建 trigram 索引以支持 content 相似度检索
         cursor.execute("""
@@ -116,28 +795,96 @@ def init_database():
         cursor.close()
         conn.close()
 
-def get_chunk_count() -> int:
-    """获取文档块总数"""
-    conn = get_db_connection()
+def _merge_stats(results: List[dict]) -> dict:
+    merged = {"file_count": 0, "chunk_count": 0, "byte_size": 0, "char_count": 0, "updated_at": None}
+    for item in results:
+        for key in ("file_count", "chunk_count", "byte_size", "char_count"):
+            merged[key] += item[key]
+        if item["updated_at"] and (merged["updated_at"] is None or item["updated_at"] > merged["updated_at"]):
+            merged["updated_at"] = item["updated_at"]
+    return merged
+
+def _merge_collections(results: List[List[dict]]) -> List[dict]:
+    merged: Dict[str, dict] = {}
+    for items in results:
+        for item in items:
+            if item["name"] in merged:
+                merged[item["name"]]["approx_chunks"] += item["approx_chunks"]
+            else:
+                merged[item["name"]] = dict(item)
+    return [merged[name] for name in sorted(merged)]
+
+@_across_shards(sum)
+def get_chunk_count(collection: Optional[str] = None, approximate: bool = False) -> int:
+    """获取文档块总数（指定 collection 时只统计该集合）。
+    默认读取增量维护的 collection_stats（只计 active 版本）；
+    approximate=True 时读取分区的 pg_class.reltuples 估算值（含未回收的旧版本）。
+    """
+    conn = get_db_connection(readonly=True)
     cursor = conn.cursor()
     
     try:
-        cursor.execute("SELECT COUNT(*) FROM document_chunks;")
+        if approximate:
+            cursor.execute("""
+                SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::BIGINT
+                FROM document_collections dc
+                JOIN pg_class c ON c.relname = dc.partition_name
+                WHERE %s IS NULL OR dc.name = %s;
+            """, (collection, collection))
+        else:
+            cursor.execute("""
+                SELECT COALESCE(SUM(chunk_count), 0)::BIGINT FROM collection_stats
+                WHERE %s IS NULL OR collection = %s;
+            """, (collection, collection))
         count = cursor.fetchone()[0]
         return count
     finally:
         cursor.close()
         conn.close()
 
-def clear_all_chunks():
-    """清空所有文档块"""
+@_across_shards(_merge_stats)
+def get_collection_stats(collection: str) -> dict:
+    """获取集合的文件数、chunk数、字节数与字符数汇总"""
+    conn = get_db_connection(readonly=True)
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        cursor.execute("""
+            SELECT file_count, chunk_count, byte_size, char_count, updated_at
+            FROM collection_stats WHERE collection = %s;
+        """, (collection,))
+        row = cursor.fetchone()
+        if not row:
+            return {"file_count": 0, "chunk_count": 0, "byte_size": 0, "char_count": 0, "updated_at": None}
+        item = dict(row)
+        item["updated_at"] = item["updated_at"].isoformat() if item["updated_at"] else None
+        return item
+    finally:
+        cursor.close()
+        conn.close()
+
+@_across_shards(lambda results: None)
+def clear_all_chunks(collection: Optional[str] = None):
+    """清空所有文档块及文档记录（指定 collection 时只清空该集合）。
+    使用 TRUNCATE 直接释放分区存储与索引，不产生死元组，也不需要事后 VACUUM。
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
-        cursor.execute("DELETE FROM document_chunks;")
+        # TRUNCATE 需要排他锁，等待过久时放弃，由后台任务重试
+        cursor.execute("SET LOCAL lock_timeout = '30s';")
+        if collection:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (collection_partition_name(collection),))
+            if cursor.fetchone()[0]:
+                cursor.execute(sql.SQL("TRUNCATE TABLE {};").format(
+                    sql.Identifier(collection_partition_name(collection))))
+            cursor.execute("DELETE FROM documents WHERE collection = %s;", (collection,))
+            cursor.execute("DELETE FROM collection_stats WHERE collection = %s;", (collection,))
+        else:
+            cursor.execute("TRUNCATE TABLE document_chunks, documents, collection_stats;")
         conn.commit()
-        logging.info("所有文档块已清空")
+        logging.info(f"文档块已清空: {collection or '全部集合'}")
     except Exception as e:
         conn.rollback()
         logging.error(f"清空文档块失败: {e}")
@@ -146,8 +893,136 @@ def clear_all_chunks():
         cursor.close()
         conn.close()
 
-def save_trace_data(file_name: str, file_type: str, trace_data: dict) -> int:
-    """保存轨迹数据到数据库"""
+@_across_shards(lambda results: results[0])
+def ensure_collection(name: str) -> str:
+    """确保集合及其分区存在，返回规范化后的集合名称"""
+    name = validate_collection_name(name)
+    if (_current_shard.get(), name) in _known_collections:
+        return name
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        _create_collection_partition(cursor, name)
+        conn.commit()
+        _known_collections.add((_current_shard.get(), name))
+        return name
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"创建集合失败: {e}")
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+@_across_shards(_merge_collections)
+def list_collections() -> List[dict]:
+    """获取集合列表及各分区的近似行数（来自 pg_class.reltuples）"""
+    conn = get_db_connection(readonly=True)
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        cursor.execute("""
+            SELECT dc.name, dc.partition_name, dc.created_at,
+                   GREATEST(COALESCE(c.reltuples, 0), 0)::BIGINT AS approx_chunks
+            FROM document_collections dc
+            LEFT JOIN pg_class c ON c.relname = dc.partition_name
+            ORDER BY dc.name;
+        """)
+        results = []
+        for row in cursor.fetchall():
+            item = dict(row)
+            item["created_at"] = item["created_at"].isoformat() if item["created_at"] else None
+            results.append(item)
+        return results
+    finally:
+        cursor.close()
+        conn.close()
+
+@_across_shards(any)
+def drop_collection(name: str) -> bool:
+    """删除集合：直接 DROP 对应分区，代替对大表的整体 DELETE"""
+    name = validate_collection_name(name)
+    if name == DEFAULT_COLLECTION:
+        raise ValueError("默认集合不能删除")
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("DELETE FROM document_collections WHERE name = %s RETURNING partition_name;", (name,))
+        row = cursor.fetchone()
+        if not row:
+            conn.rollback()
+            return False
+        cursor.execute(sql.SQL("DROP TABLE IF EXISTS {};").format(sql.Identifier(row[0])))
+        cursor.execute("DELETE FROM documents WHERE collection = %s;", (name,))
+        cursor.execute("DELETE FROM collection_stats WHERE collection = %s;", (name,))
+        conn.commit()
+        _known_collections.discard((_current_shard.get(), name))
+        logging.info(f"集合已删除: {name}")
+        return True
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"删除集合失败: {e}")
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+def _payload_marker(value: Any, size: int) -> dict:
+    """移出的字段在摘要中的占位：大小、条目数（列表）或开头片段（字符串）"""
+    marker = {"payload": True, "bytes": size}
+    if isinstance(value, (list, dict)):
+        marker["items"] = len(value)
+    elif isinstance(value, str):
+        marker["preview"] = value[:120]
+    return marker
+
+
+def compact_trace(trace_data: dict) -> Tuple[dict, List[Tuple[int, bytes, int]]]:
+    """把步骤 input/output 中超过 TRACE_INLINE_BYTES 的字段移出，
+    返回 (摘要轨迹, [(步骤序号, zlib 压缩的 {"input"/"output": {字段: 值}}, 原始字节数)])"""
+    steps = []
+    payloads = []
+    for index, step in enumerate(trace_data.get("steps", [])):
+        step = dict(step)
+        moved: Dict[str, dict] = {}
+        for section in ("input", "output"):
+            fields = step.get(section)
+            if not isinstance(fields, dict):
+                continue
+            fields = dict(fields)
+            for key, value in fields.items():
+                size = len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+                if size > TRACE_INLINE_BYTES:
+                    moved.setdefault(section, {})[key] = value
+                    fields[key] = _payload_marker(value, size)
+            step[section] = fields
+        if moved:
+            raw = json.dumps(moved, ensure_ascii=False, default=str).encode("utf-8")
+            payloads.append((index, zlib.compress(raw, 6), len(raw)))
+        steps.append(step)
+    return {**trace_data, "steps": steps}, payloads
+
+
+def _inline_payloads(trace_data: dict, rows: List[Tuple[int, Any]]) -> dict:
+    """把 (步骤序号, 压缩内容) 还原到摘要轨迹中"""
+    steps = [dict(step) for step in trace_data.get("steps", [])]
+    for step_index, data in rows:
+        if step_index >= len(steps):
+            continue
+        for section, fields in json.loads(zlib.decompress(bytes(data)).decode("utf-8")).items():
+            steps[step_index][section] = {**steps[step_index].get(section, {}), **fields}
+    return {**trace_data, "steps": steps}
+
+
+def save_trace_data(file_name: str, file_type: str, trace_data: dict) -> Optional[int]:
+    """保存轨迹数据到数据库：步骤摘要存入 langgraph_traces，较大的字段压缩存入 langgraph_trace_payloads，
+    同一文件只保留最近 TRACE_KEEP_PER_FILE 条。按 TRACE_SAMPLE_RATE 采样未保存时返回 None"""
+    if not trace_data.get("errors") and random.random() >= TRACE_SAMPLE_RATE:
+        logging.info(f"轨迹未被采样，不保存: {file_name}")
+        return None
+    summary, payloads = compact_trace(trace_data)
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -156,9 +1031,21 @@ def save_trace_data(file_name: str, file_type: str, trace_data: dict) -> int:
             INSERT INTO langgraph_traces (file_name, file_type, trace_data)
             VALUES (%s, %s, %s)
             RETURNING id;
-        """, (file_name, file_type, json.dumps(trace_data)))
+        """, (file_name, file_type, json.dumps(summary, ensure_ascii=False, default=str)))
         
         trace_id = cursor.fetchone()[0]
+        cursor.executemany("""
+            INSERT INTO langgraph_trace_payloads (trace_id, step_index, byte_size, data)
+            VALUES (%s, %s, %s, %s);
+        """, [(trace_id, index, size, psycopg2.Binary(data)) for index, data, size in payloads])
+        if TRACE_KEEP_PER_FILE > 0:
+            cursor.execute("""
+                DELETE FROM langgraph_traces
+                WHERE file_name = %s AND id NOT IN (
+                    SELECT id FROM langgraph_traces WHERE file_name = %s
+                    ORDER BY upload_time DESC, id DESC LIMIT %s
+                );
+            """, (file_name, file_name, TRACE_KEEP_PER_FILE))
         conn.commit()
         logging.info(f"轨迹数据已保存: {file_name}, ID: {trace_id}")
         return trace_id
@@ -170,24 +1057,30 @@ def save_trace_data(file_name: str, file_type: str, trace_data: dict) -> int:
         cursor.close()
         conn.close()
 
-def get_trace_data(file_name: str) -> Optional[dict]:
-    """根据文件名获取轨迹数据"""
-    conn = get_db_connection()
+def get_trace_data(file_name: str, include_payloads: bool = False) -> Optional[dict]:
+    """根据文件名获取最近一次的轨迹数据（步骤摘要）；include_payloads=True 时同时还原被移出的字段"""
+    conn = get_db_connection(readonly=True)
     cursor = conn.cursor()
     
     try:
         cursor.execute("""
-            SELECT trace_data, file_type, upload_time
+            SELECT id, trace_data, file_type, upload_time
             FROM langgraph_traces 
             WHERE file_name = %s
-            ORDER BY upload_time DESC
+            ORDER BY upload_time DESC, id DESC
             LIMIT 1;
         """, (file_name,))
         
         result = cursor.fetchone()
         if result:
-            trace_data, file_type, upload_time = result
+            trace_id, trace_data, file_type, upload_time = result
+            if include_payloads:
+                cursor.execute("""
+                    SELECT step_index, data FROM langgraph_trace_payloads WHERE trace_id = %s ORDER BY step_index;
+                """, (trace_id,))
+                trace_data = _inline_payloads(trace_data, cursor.fetchall())
             return {
+                "trace_id": trace_id,
                 "trace": trace_data,
                 "file_type": file_type,
                 "upload_time": upload_time.isoformat() if upload_time else None
@@ -200,26 +1093,52 @@ def get_trace_data(file_name: str) -> Optional[dict]:
         cursor.close()
         conn.close()
 
-def get_all_traces() -> List[dict]:
-    """获取所有轨迹数据列表"""
-    conn = get_db_connection()
+def get_trace_payload(file_name: str, step_index: int, trace_id: Optional[int] = None) -> Optional[dict]:
+    """读取轨迹中一个步骤被移出的字段（默认为该文件最近一次的轨迹），返回 {"input"/"output": {字段: 值}}"""
+    conn = get_db_connection(readonly=True)
     cursor = conn.cursor()
     
     try:
         cursor.execute("""
-            SELECT file_name, file_type, upload_time, created_at
+            SELECT p.data FROM langgraph_trace_payloads p
+            JOIN langgraph_traces t ON t.id = p.trace_id
+            WHERE t.file_name = %s AND p.step_index = %s AND p.trace_id = COALESCE(%s, (
+                SELECT id FROM langgraph_traces WHERE file_name = %s ORDER BY upload_time DESC, id DESC LIMIT 1
+            ));
+        """, (file_name, step_index, trace_id, file_name))
+        row = cursor.fetchone()
+        return json.loads(zlib.decompress(bytes(row[0])).decode("utf-8")) if row else None
+    except Exception as e:
+        logging.error(f"获取轨迹步骤详情失败: {e}")
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_all_traces(limit: Optional[int] = None, after: Optional[tuple] = None) -> List[dict]:
+    """获取轨迹数据列表，按 (upload_time, id) 倒序；after 为上一页最后一条的 (upload_time, id)"""
+    conn = get_db_connection(readonly=True)
+    cursor = conn.cursor()
+    
+    try:
+        where = "WHERE (upload_time, id) < (%s, %s)" if after else ""
+        cursor.execute(f"""
+            SELECT id, file_name, file_type, upload_time, created_at
             FROM langgraph_traces 
-            ORDER BY upload_time DESC;
-        """)
+            {where}
+            ORDER BY upload_time DESC, id DESC
+            LIMIT %s;
+        """, (*(after or ()), limit))
         
         results = []
         for row in cursor.fetchall():
-            file_name, file_type, upload_time, created_at = row
+            trace_id, file_name, file_type, upload_time, created_at = row
             results.append({
+                "id": trace_id,
                 "file_name": file_name,
                 "file_type": file_type,
                 "upload_time": upload_time.isoformat() if upload_time else None,
-                "created_at": created_at.isoformat() if created_at else None
+                "created_at": created_at.isoformat() if created_at else None,
             })
         
         return results
@@ -230,6 +1149,37 @@ def get_all_traces() -> List[dict]:
         cursor.close()
         conn.close()
 
+def purge_expired_traces(batch_size: int = 5000) -> int:
+    """删除超过 TRACE_RETENTION_DAYS 天的轨迹（分批提交），返回删除的条数"""
+    if TRACE_RETENTION_DAYS <= 0:
+        return 0
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    deleted = 0
+    
+    try:
+        while True:
+            cursor.execute("""
+                DELETE FROM langgraph_traces WHERE id IN (
+                    SELECT id FROM langgraph_traces
+                    WHERE upload_time < NOW() - make_interval(days => %s)
+                    LIMIT %s
+                );
+            """, (TRACE_RETENTION_DAYS, batch_size))
+            conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+        if deleted:
+            logging.info(f"已删除 {deleted} 条过期轨迹")
+        return deleted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
 def delete_trace_data(file_name: str) -> bool:
     """删除指定文件的轨迹数据"""
     conn = get_db_connection()
@@ -0,0 +1,411 @@
+"""
+批量导入模式
+- replace：数据先 COPY 到无索引的暂存表，导入结束后一次性建索引（调大 maintenance_work_mem 并开启并行），
+  最后在一个事务内把暂存表挂载为集合分区；在此之前查询始终命中旧分区的数据。
+- append：直接 COPY 进集合分区，文档保持 pending（检索只命中 active 版本）直到结束时在一个事务内切换为 active；
+  开销只与导入的数据量有关，不复制、不锁定已有数据。
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import json
+import uuid
+import hashlib
+import logging
+from collections import deque
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from psycopg2 import sql
+
+from config.database import (
+    get_db_connection, validate_collection_name, collection_partition_name, ensure_collection,
+    create_document_version, activate_document, refresh_collection_stats, SHARD_DSNS, get_embedding_settings,
+    chunk_hash,
+)
+
+
+BULK_MAINTENANCE_WORK_MEM = os.environ.get("BULK_MAINTENANCE_WORK_MEM", "2GB")
+BULK_PARALLEL_WORKERS = int(os.environ.get("BULK_PARALLEL_WORKERS", "4"))
+BULK_COPY_BATCH_ROWS = int(os.environ.get("BULK_COPY_BATCH_ROWS", "5000"))
+
+BULK_MODES = ("append", "replace")
+
+# COPY 写入的列，顺序与 _format_copy_row 保持一致（向量写入当前检索列，见 BulkImporter.embedding_column）
+_COPY_COLUMNS = ("collection", "document_id", "content", "file_name", "chunk_index", "file_type", "chunk_hash",
+                 "metadata")
+
+# (document_id, content, file_name, chunk_index, file_type, metadata, embedding)
+# metadata 为块元数据（如 {"pages": [首, 尾]}、{"json_path": [首, 尾]}）或已序列化的 JSON 文本，可为 None
+ChunkRow = Tuple[int, str, str, int, str, Union[dict, str, None], Union[Sequence[float], str]]
+
+
+def _copy_escape(value) -> str:
+    """转义 COPY text 格式中的特殊字符"""
+    if value is None:
+        return "\\N"
+    text = str(value)
+    return (text.replace("\\", "\\\\")
+                .replace("\t", "\\t")
+                .replace("\n", "\\n")
+                .replace("\r", "\\r"))
+
+
+def _format_copy_row(collection: str, row: ChunkRow) -> str:
+    document_id, content, file_name, chunk_index, file_type, metadata, embedding = row
+    # 已格式化为 pgvector 文本 / JSON 文本（如快照导入）时直接使用
+    embedding_str = embedding if isinstance(embedding, str) else "[" + ",".join(map(str, embedding)) + "]"
+    if metadata is not None and not isinstance(metadata, str):
+        metadata = json.dumps(metadata, ensure_ascii=False) if metadata else None
+    fields = (collection, document_id, content, file_name, chunk_index, file_type, chunk_hash(content), metadata,
+              embedding_str)
+    return "\t".join(_copy_escape(v) for v in fields) + "\n"
+
+
+class BulkImporter:
+    """集合级批量导入会话
+
+    用法:
+        importer = BulkImporter("docs", mode="append")
+        importer.begin()
+        document_id = importer.register_document("a.pdf", "pdf")
+        importer.copy_rows(rows)
+        importer.finish()
+    mode=append 时直接写入集合分区，mode=replace 时写入暂存表并整体替换集合内容。
+    导入的文档在结束时（replace 为挂载分区的同一事务内）切换为 active。
+    """
+
+    def __init__(self, collection: str, mode: str = "append"):
+        if SHARD_DSNS:
+            # 分区交换只在单库内成立，分片模式下请使用常规上传按文件路由
+            raise RuntimeError("分片模式下不支持批量导入")
+        if mode not in BULK_MODES:
+            raise ValueError(f"不支持的导入模式: {mode}，支持: {', '.join(BULK_MODES)}")
+        settings = get_embedding_settings(refresh=True)
+        if settings["target_column"]:
+            # 迁移期间每行需要同时写入新旧两列，COPY 路径只写一列
+            raise RuntimeError(f"向量模型迁移进行中（{settings['target_model']}），暂不支持批量导入")
+        self.collection = validate_collection_name(collection)
+        self.mode = mode
+        self.embedding_column = settings["active_column"]
+        self.partition = collection_partition_name(self.collection)
+        self.staging = f"bulk_staging_{uuid.uuid4().hex[:12]}"
+        self.rows_copied = 0
+        # document_id -> [chunk_count, char_count]
+        self._documents: Dict[int, List[int]] = {}
+        self._conn = None
+
+    # ---- 生命周期 ----
+
+    def begin(self) -> None:
+        """replace 模式创建无索引的暂存表；append 模式确保集合分区存在"""
+        if self.mode == "append":
+            ensure_collection(self.collection)
+            self._conn = get_db_connection()
+            logging.info(f"批量导入直接写入集合 {self.collection}（模式: append）")
+            return
+        self._conn = get_db_connection()
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(sql.SQL(
+                "CREATE TABLE {} (LIKE document_chunks INCLUDING DEFAULTS INCLUDING GENERATED);"
+            ).format(sql.Identifier(self.staging)))
+            self._conn.commit()
+            logging.info(f"批量导入暂存表已创建: {self.staging}，集合: {self.collection}，模式: {self.mode}")
+        except Exception:
+            cursor.close()
+            self.abort()
+            raise
+        cursor.close()
+
+    def register_document(self, name: str, file_type: str, content_hash: Optional[str] = None,
+                          byte_size: Optional[int] = None, first_uploaded_at: Optional[str] = None) -> int:
+        """登记一个待导入文档（pending 状态，挂载前对检索不可见），返回 document_id"""
+        cursor = self._conn.cursor()
+        try:
+            document_id = create_document_version(cursor, self.collection, name, file_type,
+                                                  content_hash=content_hash, byte_size=byte_size,
+                                                  first_uploaded_at=first_uploaded_at)
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        self._documents[document_id] = [0, 0]
+        return document_id
+
+    def copy_rows(self, rows: Iterable[ChunkRow]) -> int:
+        """以 COPY 批量写入暂存表，返回本次写入行数"""
+        copied = 0
+        for batch in _batched(rows, BULK_COPY_BATCH_ROWS):
+            buf = io.StringIO()
+            for row in batch:
+                buf.write(_format_copy_row(self.collection, row))
+                stats = self._documents.get(row[0])
+                if stats is not None:
+                    stats[0] += 1
+                    stats[1] += len(row[1])
+            buf.seek(0)
+            cursor = self._conn.cursor()
+            try:
+                cursor.copy_expert(
+                    sql.SQL("COPY {} ({}) FROM STDIN").format(
+                        sql.Identifier(self._target),
+                        sql.SQL(", ").join(map(sql.Identifier, _COPY_COLUMNS + (self.embedding_column,))),
+                    ).as_string(self._conn),
+                    buf,
+                )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            finally:
+                cursor.close()
+            copied += len(batch)
+        self.rows_copied += copied
+        return copied
+
+    @property
+    def _target(self) -> str:
+        return "document_chunks" if self.mode == "append" else self.staging
+
+    def finish(self) -> int:
+        """append：在一个事务内启用导入的文档；replace：一次性建索引并原子替换集合分区。返回集合最终行数"""
+        try:
+            if self.mode == "append":
+                return self._activate_appended()
+            self._build_indexes()
+            return self._swap()
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def abort(self) -> None:
+        """放弃导入，删除暂存表（或已写入集合分区的块）和未生效的文档记录"""
+        conn = self._conn if self._conn is not None and not self._conn.closed else get_db_connection()
+        self._conn = None
+        cursor = conn.cursor()
+        try:
+            conn.rollback()
+            cursor.execute(sql.SQL("DROP TABLE IF EXISTS {};").format(sql.Identifier(self.staging)))
+            if self._documents and self.mode == "append":
+                # 已写入集合分区的文档块
+                cursor.execute("DELETE FROM document_chunks WHERE collection = %s AND document_id = ANY(%s);",
+                               (self.collection, list(self._documents)))
+            if self._documents:
+                cursor.execute("DELETE FROM documents WHERE id = ANY(%s) AND status = 'pending';",
+                               (list(self._documents),))
+            conn.commit()
+        except Exception as e:
+            logging.error(f"清理批量导入暂存表失败: {e}")
+        finally:
+            cursor.close()
+            conn.close()
+
+    # ---- 内部步骤 ----
+
+    def _build_indexes(self) -> None:
+        """按父表的索引定义在暂存表上建索引，挂载时会直接复用而不会重建"""
+        conn = self._conn
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT set_config('maintenance_work_mem', %s, false);", (BULK_MAINTENANCE_WORK_MEM,))
+            cursor.execute("SELECT set_config('max_parallel_maintenance_workers', %s, false);",
+                           (str(BULK_PARALLEL_WORKERS),))
+            cursor.execute("""
+                SELECT pg_get_indexdef(i.indexrelid)
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indrelid
+                WHERE c.relname = 'document_chunks' AND NOT i.indisprimary
+                ORDER BY i.indexrelid;
+            """)
+            index_defs = [r[0] for r in cursor.fetchall()]
+
+            cursor.execute(sql.SQL("ALTER TABLE {} ADD PRIMARY KEY (id, collection);").format(
+                sql.Identifier(self.staging)))
+            conn.commit()
+            for i, index_def in enumerate(index_defs):
+                # "CREATE INDEX name ON ONLY public.document_chunks USING hnsw (...)" -> 取 USING 之后的定义
+                body = index_def.split(" USING ", 1)[1]
+                unique = "UNIQUE " if index_def.startswith("CREATE UNIQUE") else ""
+                cursor.execute(
+                    sql.SQL("CREATE {}INDEX {} ON {} USING ").format(
+                        sql.SQL(unique), sql.Identifier(f"{self.staging}_idx{i}"), sql.Identifier(self.staging)
+                    ).as_string(conn) + body
+                )
+                conn.commit()
+                logging.info(f"暂存表索引已建立 ({i + 1}/{len(index_defs)})")
+            cursor.execute(sql.SQL("ANALYZE {};").format(sql.Identifier(self.staging)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def _swap(self) -> int:
+        """replace 模式，单事务内：摘下旧分区 → 挂载暂存表"""
+        conn = self._conn
+        cursor = conn.cursor()
+        staging = sql.Identifier(self.staging)
+        partition = sql.Identifier(self.partition)
+        retired = sql.Identifier(f"bulk_retired_{uuid.uuid4().hex[:12]}")
+        try:
+            exists = self._partition_exists(cursor)
+            cursor.execute(sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} CHECK (collection = {});").format(
+                staging, sql.Identifier(f"{self.staging}_collection_check"), sql.Literal(self.collection)))
+            if exists:
+                cursor.execute(sql.SQL("ALTER TABLE document_chunks DETACH PARTITION {};").format(partition))
+                cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {};").format(partition, retired))
+            cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {};").format(staging, partition))
+            cursor.execute(sql.SQL("ALTER TABLE document_chunks ATTACH PARTITION {} FOR VALUES IN ({});").format(
+                partition, sql.Literal(self.collection)))
+            cursor.execute("""
+                INSERT INTO document_collections (name, partition_name)
+                VALUES (%s, %s)
+                ON CONFLICT (name) DO NOTHING;
+            """, (self.collection, self.partition))
+
+            # 文档版本与新分区同时生效；旧分区整体下线，其文档记录一并删除
+            for document_id, (chunk_count, char_count) in self._documents.items():
+                activate_document(cursor, document_id, chunk_count, char_count)
+            cursor.execute("DELETE FROM documents WHERE collection = %s AND NOT (id = ANY(%s));",
+                           (self.collection, list(self._documents)))
+            refresh_collection_stats(cursor, self.collection)
+            if exists:
+                cursor.execute(sql.SQL("DROP TABLE {};").format(retired))
+            conn.commit()
+            logging.info(f"批量导入完成，集合 {self.collection} 已切换到新分区，共 {self.rows_copied} 行")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        return self.rows_copied
+
+    def _activate_appended(self) -> int:
+        """append 模式：导入的文档在一个事务内切换为 active，被替换的旧版本在后台回收"""
+        conn = self._conn
+        cursor = conn.cursor()
+        try:
+            superseded: List[int] = []
+            for document_id, (chunk_count, char_count) in self._documents.items():
+                superseded.extend(activate_document(cursor, document_id, chunk_count, char_count))
+            cursor.execute("SELECT chunk_count FROM collection_stats WHERE collection = %s;", (self.collection,))
+            row = cursor.fetchone()
+            conn.commit()
+            logging.info(f"批量导入完成，集合 {self.collection} 新增 {self.rows_copied} 行")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        if superseded:
+            from core.vector_store import vector_store
+            vector_store.schedule_gc(superseded)
+        return row[0] if row else self.rows_copied
+
+    def _partition_exists(self, cursor) -> bool:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (self.partition,))
+        return bool(cursor.fetchone()[0])
+
+
+def _batched(rows: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _file_chunks(content: bytes | str, file_name: str, text: Optional[str]) -> Iterator[Tuple[str, Optional[dict]]]:
+    """与入库流水线相同的分块，产出 (文档块, 元数据)：JSON / JSONL 按记录分块并记录 JSON 路径，
+    按页段转换的大 PDF 记录起止页，其它文件对 Docling 导出文本分块"""
+    from core.chunking import iter_export_chunks
+    from core.conversion import conversion_pool
+    from core.document_ingest import is_json_file, iter_text_blocks, _iter_file_blocks
+    from core.json_stream import json_chunker
+    from core.pipeline import page_chunker
+
+    if is_json_file(file_name):
+        blocks = _iter_file_blocks(content) if isinstance(content, str) else [content]
+        lines = not file_name.lower().endswith(".json")
+        return json_chunker(lines=lines)(iter_text_blocks(blocks))
+    segments = [text] if text is not None else conversion_pool.convert_pages(content, file_name)
+    return page_chunker(iter_export_chunks)(segments)
+
+
+def iter_file_rows(importer: BulkImporter, items: Iterable[Tuple[bytes | str, str, str]],
+                   embed_batch_size: int = 64) -> Iterator[ChunkRow]:
+    """把 (内容或路径, 文件名, 文件类型) 转换为待导入的行：解析 → 分块 → 登记文档 → 批量生成向量。
+    Docling 解析在转换进程池中并行进行，与向量生成和 COPY 重叠；JSON 与大 PDF 不整体转换，
+    分块方式与元数据（JSON 路径、起止页）与入库流水线一致。
+    """
+    from core.conversion import conversion_pool
+    from core.document_ingest import is_json_file
+    from core.vector_store import vector_store
+
+    # convert_many 按输入顺序产出结果；pending 按输入顺序记录 (内容, 文件名, 文件类型, 是否不经整体转换)
+    pending: Deque[Tuple[bytes | str, str, str, bool]] = deque()
+
+    def sources() -> Iterator[Tuple[bytes | str, str]]:
+        for content, file_name, file_type in items:
+            direct = is_json_file(file_name) or conversion_pool.should_split(content, file_name)
+            pending.append((content, file_name, file_type, direct))
+            if not direct:
+                yield content, file_name
+
+    def file_rows(content: bytes | str, file_name: str, file_type: str, text: Optional[str]) -> Iterator[ChunkRow]:
+        chunks = list(_file_chunks(content, file_name, text))
+        if not chunks:
+            return
+        if isinstance(content, bytes):
+            document_id = importer.register_document(file_name, file_type,
+                                                     content_hash=hashlib.sha256(content).hexdigest(),
+                                                     byte_size=len(content))
+        else:
+            document_id = importer.register_document(file_name, file_type, byte_size=os.path.getsize(content))
+        for start in range(0, len(chunks), embed_batch_size):
+            batch = chunks[start:start + embed_batch_size]
+            embeddings = vector_store.embed_texts([chunk for chunk, _ in batch])
+            for offset, ((chunk, metadata), embedding) in enumerate(zip(batch, embeddings)):
+                yield document_id, chunk, file_name, start + offset, file_type, metadata, embedding
+
+    def direct_rows() -> Iterator[ChunkRow]:
+        # 排在下一个整体转换的文件之前、不经整体转换的文件
+        while pending and pending[0][3]:
+            content, file_name, file_type, _ = pending.popleft()
+            yield from file_rows(content, file_name, file_type, None)
+
+    for text, error in conversion_pool.convert_many(sources()):
+        yield from direct_rows()
+        content, file_name, file_type, _ = pending.popleft()
+        if error is not None:
+            raise error
+        yield from file_rows(content, file_name, file_type, text)
+    yield from direct_rows()
+
+
+def bulk_import_files(items: Iterable[Tuple[bytes | str, str, str]], collection: str, mode: str = "append",
+                      embed_batch_size: int = 64) -> dict:
+    """批量导入 (内容或路径, 文件名, 文件类型) 列表，返回导入统计"""
+    importer = BulkImporter(collection, mode=mode)
+    importer.begin()
+    try:
+        inserted = importer.copy_rows(iter_file_rows(importer, items, embed_batch_size=embed_batch_size))
+    except Exception:
+        importer.abort()
+        raise
+    total = importer.finish()
+    return {"collection": importer.collection, "mode": mode, "documents": len(importer._documents),
+            "inserted": inserted, "total": total}
@@ -0,0 +1,195 @@
+"""
+流式分块引擎
+chunk_text_from_export 与 normalize_and_chunk_text 的生成器实现，输出与原实现逐字节一致：
+- 输入为文本片段的迭代器（片段可在任意位置切开，包括 \r\n 之间），逐行/逐词处理，不需要整段文本
+- 合并短块、按句子装箱时只累计长度，块内容在输出时一次拼接，整体为线性时间
+- 正则在模块加载时预编译
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Callable, Iterable, Iterator, List
+
+
+_HEADING_RE = re.compile(r"^\s{0,3}#{1,6} \S")
+_FENCE_RE = re.compile(r"^\s*```")
+_CODE_BLOCK_RE = re.compile(r"```[\s\S]*?```")
+_HEADING_MARK_RE = re.compile(r"^\s{0,3}#{1,6}\s+", flags=re.MULTILINE)
+_LIST_MARK_RE = re.compile(r"^\s{0,3}(?:[-*+] |\d+\. )", flags=re.MULTILINE)
+_SPACES_RE = re.compile(r"\s+")
+_EXPORT_SENTENCE_RE = re.compile(r"(?<=[。！？.!?])\s+")
+_SENTENCE_END = (".", "!", "?")
+
+
+def _iter_lines(pieces: Iterable[str]) -> Iterator[str]:
+    """把文本片段还原为行（\r\n 与 \r 视为换行，跨片段的 \r\n 也只算一次），与 text.split("\n") 的结果一致"""
+    partial: List[str] = []
+    held_cr = False
+    for piece in pieces:
+        if not piece:
+            continue
+        if held_cr:
+            piece = "\r" + piece
+            held_cr = False
+        if piece.endswith("\r"):
+            # 可能是跨片段的 \r\n，等下一个片段再判断
+            held_cr = True
+            piece = piece[:-1]
+        parts = piece.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        partial.append(parts[0])
+        if len(parts) > 1:
+            yield "".join(partial)
+            yield from parts[1:-1]
+            partial = [parts[-1]]
+    if held_cr:
+        yield "".join(partial)
+        partial = []
+    yield "".join(partial)
+
+
+def _iter_export_blocks(lines: Iterable[str]) -> Iterator[str]:
+    """按标题、空行、代码围栏把行分组为块（等价于对 strip 后的全文分组）"""
+    buf: List[str] = []
+    in_code = False
+    started = False
+    for ln in lines:
+        if not started:
+            # 全文 strip：跳过开头的空白行，第一行去掉前导空白
+            if not ln.strip():
+                continue
+            ln = ln.lstrip()
+            started = True
+        ln = ln.rstrip()
+        if _FENCE_RE.match(ln):
+            in_code = not in_code
+            buf.append(ln)
+            continue
+        if in_code:
+            buf.append(ln)
+            continue
+        if not ln.strip():
+            if buf:
+                joined = "\n".join(buf).strip()
+                buf.clear()
+                if joined:
+                    yield joined
+            continue
+        if _HEADING_RE.match(ln):
+            if buf:
+                joined = "\n".join(buf).strip()
+                buf.clear()
+                if joined:
+                    yield joined
+            yield ln.strip()
+            continue
+        buf.append(ln)
+    if buf:
+        joined = "\n".join(buf).strip()
+        if joined:
+            yield joined
+
+
+def _clean_block(block: str) -> str:
+    """去掉代码围栏、标题与列表标记，合并空白"""
+    block = _CODE_BLOCK_RE.sub("", block)
+    block = _HEADING_MARK_RE.sub("", block)
+    block = _LIST_MARK_RE.sub("", block)
+    return _SPACES_RE.sub(" ", block).strip()
+
+
+def _pack(sentences: Iterable[str], fits: Callable[[int], bool], step: int) -> Iterator[str]:
+    """把句子依次装入块（句间以空格连接）：放不下时输出当前块；单句放不下时按 step 个字符硬切"""
+    cur: List[str] = []
+    cur_len = 0
+    for s in sentences:
+        cand_len = cur_len + 1 + len(s) if cur else len(s)
+        if fits(cand_len):
+            cur.append(s)
+            cur_len = cand_len
+            continue
+        if cur:
+            yield " ".join(cur)
+        if fits(len(s)):
+            cur = [s]
+            cur_len = len(s)
+        else:
+            for i in range(0, len(s), step):
+                yield s[i:i + step]
+            cur = []
+            cur_len = 0
+    if cur:
+        yield " ".join(cur)
+
+
+def _estimate_tokens(length: int) -> int:
+    # 与 chunk_text_from_export 的估算一致：约 3 个字符一个 token
+    return max(1, int(length / 3))
+
+
+def iter_export_chunks(pieces: Iterable[str], max_tokens: int = 800, min_tokens: int = 120) -> Iterator[str]:
+    """chunk_text_from_export 的流式版本：输入 Docling export_to_text 文本的片段，逐块产出"""
+    carry: List[str] = []
+    carry_len = 0
+
+    def fits(length: int) -> bool:
+        return _estimate_tokens(length) <= max_tokens
+
+    for block in _iter_export_blocks(_iter_lines(pieces)):
+        c = _clean_block(block)
+        if not c:
+            continue
+        cand_len = carry_len + 2 + len(c) if carry else len(c)
+        if _estimate_tokens(cand_len) < min_tokens:
+            # 过短的块与后续块合并
+            carry.append(c)
+            carry_len = cand_len
+            continue
+        carry.append(c)
+        unit = "\n\n".join(carry)
+        carry = []
+        carry_len = 0
+        sentences = (s for s in (s.strip() for s in _EXPORT_SENTENCE_RE.split(unit)) if s)
+        yield from _pack(sentences, fits, max_tokens * 3)
+    if carry:
+        yield "\n\n".join(carry)
+
+
+def _iter_sentences(pieces: Iterable[str]) -> Iterator[str]:
+    """合并空白后按 [.!?] 后的空格切句（与 normalize_and_chunk_text 的切分一致），跨片段的单词与句子会被拼接"""
+    words: List[str] = []
+    partial = ""
+    for piece in pieces:
+        if not piece:
+            continue
+        parts = piece.split()
+        if not parts:
+            # 纯空白片段结束当前单词
+            if partial:
+                words.append(partial)
+                if partial.endswith(_SENTENCE_END):
+                    yield " ".join(words)
+                    words = []
+                partial = ""
+            continue
+        if partial:
+            if piece[0].isspace():
+                parts.insert(0, partial)
+            else:
+                parts[0] = partial + parts[0]
+        # 片段不以空白结尾时最后一个词可能延续到下一个片段
+        partial = "" if piece[-1].isspace() else parts.pop()
+        for word in parts:
+            words.append(word)
+            if word.endswith(_SENTENCE_END):
+                yield " ".join(words)
+                words = []
+    if partial:
+        words.append(partial)
+    if words:
+        yield " ".join(words)
+
+
+def iter_normalized_chunks(pieces: Iterable[str], max_chunk_size: int = 1000) -> Iterator[str]:
+    """normalize_and_chunk_text 的流式版本：规范化空白并按句子边界装箱，每块不超过 max_chunk_size 字符"""
+    yield from _pack(_iter_sentences(pieces), lambda length: length <= max_chunk_size, max_chunk_size)
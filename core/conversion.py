@@ -0,0 +1,477 @@
+"""
+文档转换进程池
+Docling 转换在独立的 worker 进程中执行，不阻塞 API 的事件循环，转换占用的内存随 worker 进程退出归还给系统：
+- 每个 worker 启动时创建 DocumentConverter 并常驻（模型只加载一次）
+- 单个任务超过 CONVERSION_TIMEOUT_SECONDS 时强制结束该 worker 并补充新进程
+- worker 处理满 CONVERSION_MAX_TASKS_PER_WORKER 个文档或 RSS 超过 CONVERSION_MAX_RSS_MB 后回收重建
+- 最多 CONVERSION_WORKERS 个文档同时转换，多文件上传时并行处理
+- 字节内容以内存中的 DocumentStream 交给 Docling，超过 CONVERSION_SPILL_BYTES 时才写入临时文件并只传路径
+- Docling 的转换结果按文件内容写入磁盘缓存（core.conversion_cache），相同文件再次转换时直接读取
+- 纯文本、Markdown、HTML、JSON 由 core.converters 注册的快速转换器在当前进程内转换，不占用 worker
+- 超过 CONVERSION_SPLIT_PAGES 页的 PDF 按 CONVERSION_RANGE_PAGES 页一段拆分，各段在不同 worker 中并行转换，按页序产出
+- /upload/simple 的 PyPDF2 文本提取由 PdfTextExtractor 在独立的轻量进程池中按页段并行执行（不加载 Docling），按页序产出
+本模块在主进程中不导入 Docling。
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from typing import Deque, Iterable, Iterator, List, Optional, Tuple
+
+from core.conversion_cache import cache_entry, conversion_cache
+from core.converters import convert_native, find_converter
+
+
+CONVERSION_WORKERS = int(os.environ.get("CONVERSION_WORKERS", "2"))
+CONVERSION_TIMEOUT_SECONDS = float(os.environ.get("CONVERSION_TIMEOUT_SECONDS", "300"))
+CONVERSION_MAX_TASKS_PER_WORKER = int(os.environ.get("CONVERSION_MAX_TASKS_PER_WORKER", "50"))
+CONVERSION_MAX_RSS_MB = int(os.environ.get("CONVERSION_MAX_RSS_MB", "2048"))
+# 超过该大小（字节）的内容先写入临时文件，worker 从磁盘读取，避免大文件经管道复制
+CONVERSION_SPILL_BYTES = int(os.environ.get("CONVERSION_SPILL_BYTES", str(32 * 1024 * 1024)))
+# 页数超过该值的 PDF 按页段拆分并行转换（0 表示不拆分）/ 每段页数
+CONVERSION_SPLIT_PAGES = int(os.environ.get("CONVERSION_SPLIT_PAGES", "200"))
+CONVERSION_RANGE_PAGES = int(os.environ.get("CONVERSION_RANGE_PAGES", "50"))
+# PyPDF2 文本提取进程数（0 表示在调用线程中逐页提取）/ 每个任务的页数 / 最多提取的页数（0 表示不限制）
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", "2"))
+PDF_EXTRACT_BATCH_PAGES = int(os.environ.get("PDF_EXTRACT_BATCH_PAGES", "16"))
+PDF_EXTRACT_MAX_PAGES = int(os.environ.get("PDF_EXTRACT_MAX_PAGES", "0"))
+# worker 进程启动（加载 Docling 模型）的最长等待时间
+_WORKER_START_TIMEOUT = float(os.environ.get("CONVERSION_WORKER_START_TIMEOUT", "120"))
+
+
+class ConversionTimeout(TimeoutError):
+    """单个文档转换超时"""
+
+
+def _rss_mb() -> float:
+    """当前进程的常驻内存（MB）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        # 非 Linux 平台退化为峰值 RSS（Linux 单位 KB，macOS 单位字节）
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if peak > 1 << 32 else peak / 1024
+
+
+def _spill_to_file(content: bytes, filename: str) -> str:
+    """把字节内容写入临时文件（保留扩展名供 Docling 识别格式），返回路径，由调用方删除"""
+    import tempfile
+    suffix = ""
+    if "." in filename:
+        suffix = "." + filename.split(".")[-1]
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        tmp.write(content)
+        return tmp.name
+
+
+def _docling_convert(content: bytes | str, filename: str):
+    """在当前进程内用 Docling 转换文件内容（字节或路径），返回 DoclingDocument"""
+    from config.docling import document_converter
+
+    if isinstance(content, bytes):
+        # 字节内容包装为内存流，不落盘
+        from io import BytesIO
+        from docling.datamodel.base_models import DocumentStream
+        content = DocumentStream(name=os.path.basename(filename) or "document", stream=BytesIO(content))
+    return document_converter.convert(content).document
+
+
+def _docling_export_text(content: bytes | str, filename: str) -> str:
+    """在当前进程内用 Docling 把文件内容（字节或路径）转换为纯文本"""
+    return _docling_convert(content, filename).export_to_text()
+
+
+def _docling_export_pages(content: bytes | str, filename: str) -> List[Tuple[int, str]]:
+    """转换并按页导出文本，返回 [(页码, 文本)]，页码从 1 开始（相对于传入的文档）"""
+    document = _docling_convert(content, filename)
+    pages = sorted(getattr(document, "pages", None) or {})
+    try:
+        return [(page, document.export_to_text(page_no=page)) for page in pages] or [(1, document.export_to_text())]
+    except TypeError:
+        # 旧版 docling-core 不支持按页导出，整段文本记在第一页
+        return [(1, document.export_to_text())]
+
+
+def pdf_page_count(content: bytes | str) -> int:
+    """PDF（字节或路径）的页数（无法解析时返回 0）"""
+    from io import BytesIO
+    from PyPDF2 import PdfReader
+    try:
+        return len(PdfReader(BytesIO(content) if isinstance(content, bytes) else content).pages)
+    except Exception:
+        return 0
+
+
+def split_pdf(content: bytes | str, range_pages: int = CONVERSION_RANGE_PAGES) -> Iterator[Tuple[int, bytes]]:
+    """把 PDF（字节或路径）按 range_pages 页一段拆成多个子 PDF，依次产出 (首页页码, 子 PDF 内容)"""
+    from io import BytesIO
+    from PyPDF2 import PdfReader, PdfWriter
+
+    reader = PdfReader(BytesIO(content) if isinstance(content, bytes) else content)
+    total = len(reader.pages)
+    range_pages = max(1, range_pages)
+    for start in range(0, total, range_pages):
+        writer = PdfWriter()
+        for index in range(start, min(start + range_pages, total)):
+            writer.add_page(reader.pages[index])
+        buf = BytesIO()
+        writer.write(buf)
+        yield start + 1, buf.getvalue()
+
+
+def _iter_pdf_range(source: bytes | str, start: int, end: int) -> Iterator[Tuple[str, int]]:
+    """逐页提取 PDF（字节或路径）第 start 到 end-1 页（从 0 开始）的文本，产出 (文本, 页码)，跳过空页和无法解析的页"""
+    from io import BytesIO
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(BytesIO(source) if isinstance(source, bytes) else source)
+    for index in range(start, min(end, len(reader.pages))):
+        try:
+            text = reader.pages[index].extract_text() or ""
+        except Exception:
+            text = ""
+        if text:
+            yield text, index + 1
+
+
+def _extract_pdf_range(source: bytes | str, start: int, end: int) -> List[Tuple[str, int]]:
+    """进程池任务：提取一个页段的文本"""
+    return list(_iter_pdf_range(source, start, end))
+
+
+class PdfTextExtractor:
+    """PyPDF2 文本提取进程池：PDF 按页段分给多个进程并行提取，按页序逐页产出；
+    PyPDF2 为纯 Python 实现，放在子进程中不占用主进程（API 事件循环所在进程）的 GIL"""
+
+    def __init__(self, workers: int = PDF_EXTRACT_WORKERS, batch_pages: int = PDF_EXTRACT_BATCH_PAGES,
+                 max_pages: int = PDF_EXTRACT_MAX_PAGES):
+        self.workers = workers
+        self.batch_pages = max(1, batch_pages)
+        self.max_pages = max_pages
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # 与转换进程池一样使用 spawn，子进程不继承数据库连接与线程
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def _reset(self, pool: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is pool:
+                self._executor = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_pages(self, content: bytes | str, filename: str = "",
+                   max_pages: Optional[int] = None) -> Iterator[Tuple[str, int]]:
+        """按页序产出 PDF（字节或路径）的 (文本, 页码)；第一个页段提取完成后即开始产出，后续页段仍在其它进程中提取"""
+        from io import BytesIO
+        from PyPDF2 import PdfReader
+
+        max_pages = self.max_pages if max_pages is None else max_pages
+        # 只解析交叉引用表得到页数（无法解析的 PDF 在此抛出异常）
+        total = len(PdfReader(BytesIO(content) if isinstance(content, bytes) else content).pages)
+        if max_pages > 0 and total > max_pages:
+            logging.warning(f"PDF 共 {total} 页，只提取前 {max_pages} 页: {filename}")
+            total = max_pages
+        if self.workers <= 0 or total <= self.batch_pages:
+            yield from _iter_pdf_range(content, 0, total)
+            return
+
+        # 大文件写入临时文件，各进程从磁盘读取，不经管道重复复制（传入路径时直接使用）
+        spilled = None
+        if isinstance(content, bytes) and len(content) > CONVERSION_SPILL_BYTES:
+            spilled = _spill_to_file(content, filename or "document.pdf")
+        source = spilled or content
+        pool = self._pool()
+        pending: Deque[Future] = deque()
+        ranges = iter(range(0, total, self.batch_pages))
+        try:
+            while True:
+                # 同时在途的页段不超过进程数的两倍
+                while len(pending) < self.workers * 2:
+                    start = next(ranges, None)
+                    if start is None:
+                        break
+                    pending.append(pool.submit(_extract_pdf_range, source, start, min(start + self.batch_pages, total)))
+                if not pending:
+                    return
+                try:
+                    pages = pending.popleft().result()
+                except BrokenProcessPool:
+                    # 子进程异常退出（如内存不足）后进程池不可再用，下次提取时重建
+                    self._reset(pool)
+                    raise RuntimeError(f"PDF 文本提取进程异常退出: {filename}")
+                yield from pages
+        finally:
+            for future in pending:
+                future.cancel()
+            if spilled:
+                try:
+                    os.remove(spilled)
+                except OSError:
+                    pass
+
+
+def _worker_main(conn) -> None:
+    """worker 进程入口：预热转换器后循环处理任务，每个结果附带当前 RSS 供主进程判断是否回收"""
+    try:
+        import config.docling  # noqa: F401  预热：加载转换器与模型
+        conn.send(("ready", None, _rss_mb()))
+    except Exception as e:
+        conn.send(("error", f"转换器初始化失败: {e}", _rss_mb()))
+        return
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        content, filename, by_page = task
+        try:
+            export = _docling_export_pages if by_page else _docling_export_text
+            conn.send(("ok", export(content, filename), _rss_mb()))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}", _rss_mb()))
+
+
+class _Worker:
+    """一个转换 worker 进程及其通信管道"""
+
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), name="docling-worker", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+        self.rss_mb = 0.0
+        self.ready = False
+
+    def wait_ready(self, timeout: float) -> None:
+        if self.ready:
+            return
+        if not self.conn.poll(timeout):
+            self.kill()
+            raise RuntimeError("转换 worker 启动超时")
+        status, detail, self.rss_mb = self.conn.recv()
+        if status != "ready":
+            self.kill()
+            raise RuntimeError(detail)
+        self.ready = True
+
+    @property
+    def exhausted(self) -> bool:
+        return self.tasks >= CONVERSION_MAX_TASKS_PER_WORKER or self.rss_mb >= CONVERSION_MAX_RSS_MB
+
+    def stop(self) -> None:
+        """正常退出（处理完当前任务后）"""
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.kill()
+        self.conn.close()
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+
+
+class ConversionPool:
+    """Docling 转换进程池：固定数量的常驻 worker，按任务数/内存回收，超时强制结束"""
+
+    def __init__(self, size: int = CONVERSION_WORKERS, timeout: float = CONVERSION_TIMEOUT_SECONDS):
+        self.size = max(1, size)
+        self.timeout = timeout
+        # spawn 启动：子进程不继承主进程的数据库连接、线程与 CUDA 状态
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle: "queue.Queue[Optional[_Worker]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+        # 供 convert_many 并发提交任务的线程（每个线程同时占用一个 worker）
+        self._dispatcher = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="conversion")
+
+    def start(self) -> None:
+        """启动并预热全部 worker（首次转换时也会自动调用）"""
+        with self._lock:
+            if self._started or self._closed:
+                return
+            for _ in range(self.size):
+                self._idle.put(_Worker(self._ctx))
+            self._started = True
+        logging.info(f"文档转换进程池已启动: {self.size} 个 worker")
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._closed = True
+            started = self._started
+        self._dispatcher.shutdown(wait=False, cancel_futures=True)
+        if not started:
+            return
+        for _ in range(self.size):
+            try:
+                worker = self._idle.get(timeout=1)
+            except queue.Empty:
+                break
+            if worker is not None:
+                worker.stop()
+
+    def _acquire(self) -> _Worker:
+        self.start()
+        if self._closed:
+            raise RuntimeError("文档转换进程池已关闭")
+        worker = self._idle.get()
+        if worker is None or not worker.process.is_alive():
+            # 占位或意外退出的 worker，补充新进程
+            worker = _Worker(self._ctx)
+        return worker
+
+    def _release(self, worker: Optional[_Worker]) -> None:
+        """归还 worker；传入 None 表示该 worker 已被回收，由下一次领取时重建"""
+        if worker is not None and worker.exhausted:
+            logging.info(f"回收转换 worker（已处理 {worker.tasks} 个文档，RSS {worker.rss_mb:.0f}MB）")
+            worker.stop()
+            worker = None
+        self._idle.put(worker)
+
+    def convert(self, content: bytes | str, filename: str, timeout: Optional[float] = None, by_page: bool = False):
+        """在 worker 进程中把文件内容（字节或路径）转换为纯文本（阻塞调用）；
+        by_page=True 时返回 [(页码, 文本)]
+        """
+        converter = None if by_page else find_converter(filename)
+        if converter is not None:
+            return convert_native(content, filename, converter)
+        # 按页转换的结果由 convert_pages 按整个文档缓存
+        key = None if by_page else conversion_cache.key(content, "text")
+        cached = conversion_cache.get(key)
+        if cached is not None:
+            logging.info(f"命中转换缓存: {filename}")
+            return cached["text"]
+        timeout = self.timeout if timeout is None else timeout
+        spilled = None
+        if isinstance(content, bytes) and len(content) > CONVERSION_SPILL_BYTES:
+            spilled = content = _spill_to_file(content, filename)
+        worker = self._acquire()
+        try:
+            worker.wait_ready(_WORKER_START_TIMEOUT)
+            started = time.monotonic()
+            worker.conn.send((content, filename, by_page))
+            if not worker.conn.poll(timeout):
+                worker.kill()
+                worker = None
+                raise ConversionTimeout(f"文档转换超时（{timeout:.0f} 秒）: {filename}")
+            status, detail, worker.rss_mb = worker.conn.recv()
+            worker.tasks += 1
+            logging.info(f"文档转换完成: {filename}，耗时 {time.monotonic() - started:.1f} 秒")
+            if status != "ok":
+                raise RuntimeError(f"文档转换失败: {detail}")
+            conversion_cache.put(key, cache_entry(filename, text=detail))
+            return detail
+        except ConversionTimeout:
+            raise
+        except (EOFError, OSError) as e:
+            # worker 进程崩溃（如内存不足被系统结束）
+            if worker is not None:
+                worker.kill()
+                worker = None
+            raise RuntimeError(f"转换 worker 异常退出: {filename}") from e
+        except RuntimeError:
+            if worker is not None and not worker.ready:
+                worker = None
+            raise
+        finally:
+            self._release(worker)
+            if spilled:
+                try:
+                    os.remove(spilled)
+                except OSError:
+                    pass
+
+    def convert_many(self, items: Iterable[Tuple[bytes | str, str]],
+                     by_page: bool = False) -> Iterator[Tuple[Optional[str], Optional[Exception]]]:
+        """并行转换多个 (内容或路径, 文件名)，按输入顺序产出 (文本, 异常)。
+        最多预取 2 × worker 数个任务（每个 worker 一个在转换、一个排队），worker 不必等待调用方消费结果；
+        因此同时驻留内存的输入最多为 2 × worker 数个文件内容（传入路径时只占用路径字符串）"""
+        pending: List = []
+        for content, filename in items:
+            pending.append(self._dispatcher.submit(self.convert, content, filename, None, by_page))
+            # 预取上限：2 × worker 数
+            if len(pending) >= self.size * 2:
+                yield self._result(pending.pop(0))
+        for future in pending:
+            yield self._result(future)
+
+    @staticmethod
+    def should_split(content: bytes | str, filename: str) -> bool:
+        """是否按页段拆分转换：页数超过 CONVERSION_SPLIT_PAGES 的 PDF（字节或路径）"""
+        if CONVERSION_SPLIT_PAGES <= 0:
+            return False
+        if not (filename or "").lower().endswith(".pdf"):
+            return False
+        return pdf_page_count(content) > CONVERSION_SPLIT_PAGES
+
+    def convert_pages(self, content: bytes | str, filename: str) -> Iterator[Tuple[str, int]]:
+        """把 PDF（字节或路径）拆成页段在多个 worker 中并行转换，按页序产出 (文本, 页码)（页码为原文档中的页码）"""
+        key = conversion_cache.key(content, "pages")
+        cached = conversion_cache.get(key)
+        if cached is not None:
+            logging.info(f"命中转换缓存: {filename}")
+            for text, page in cached["pages"]:
+                yield text, page
+            return
+
+        starts: Deque[int] = deque()
+        converted: List[Tuple[str, int]] = []
+
+        def ranges() -> Iterator[Tuple[bytes, str]]:
+            for start, part in split_pdf(content, CONVERSION_RANGE_PAGES):
+                starts.append(start)
+                yield part, filename
+
+        for pages, error in self.convert_many(ranges(), by_page=True):
+            start = starts.popleft()
+            if error is not None:
+                raise RuntimeError(f"第 {start} 页起的页段转换失败: {error}") from error
+            for page, text in pages:
+                if text:
+                    converted.append((text, start + page - 1))
+                    yield text, start + page - 1
+        conversion_cache.put(key, cache_entry(filename, pages=converted))
+
+    @staticmethod
+    def _result(future) -> Tuple[Optional[str], Optional[Exception]]:
+        try:
+            return future.result(), None
+        except Exception as e:
+            return None, e
+
+
+# 全局转换进程池（首次使用时启动 worker）
+conversion_pool = ConversionPool()
+# 全局 PDF 文本提取进程池（首次提取多页段 PDF 时启动）
+pdf_text_extractor = PdfTextExtractor()
@@ -0,0 +1,195 @@
+"""
+文档转换结果的磁盘缓存
+按文件内容的 sha256（加上转换方式与 Docling 版本）寻址，同一文件重新上传、向量生成失败后重试、
+调整分块参数重新入库时不再重复 Docling 转换：
+- 每个条目为 zlib 压缩的 JSON：{"text" 或 "pages", "metadata"}
+- 命中时刷新文件修改时间，总大小超过 CONVERSION_CACHE_MAX_MB 时按修改时间淘汰最久未用的条目（LRU）
+- 写入先写临时文件再原子替换，多个进程可共用同一目录
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import zlib
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+
+CONVERSION_CACHE_DIR = os.environ.get("CONVERSION_CACHE_DIR", "conversion_cache")
+# 缓存总大小上限（MB，0 表示关闭缓存）
+CONVERSION_CACHE_MAX_MB = int(os.environ.get("CONVERSION_CACHE_MAX_MB", "1024"))
+# 淘汰时降到上限的比例，避免每次写入都触发淘汰
+_EVICT_TARGET = 0.9
+_SUFFIX = ".json.z"
+
+
+def _converter_version() -> str:
+    """Docling 版本（升级后旧缓存自动失效）；只读取包元数据，不导入 Docling"""
+    try:
+        from importlib.metadata import version
+        return version("docling")
+    except Exception:
+        return "unknown"
+
+
+class ConversionCache:
+    """内容寻址的转换结果缓存"""
+
+    def __init__(self, directory: str = CONVERSION_CACHE_DIR, max_mb: int = CONVERSION_CACHE_MAX_MB):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self._version = _converter_version()
+        self._lock = threading.Lock()
+        self._total: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and self.max_bytes > 0
+
+    def key(self, content: bytes | str, kind: str) -> Optional[str]:
+        """缓存键：文件内容（字节或路径）的 sha256 + 转换方式 + Docling 版本；缓存关闭时返回 None"""
+        if not self.enabled:
+            return None
+        digest = hashlib.sha256()
+        if isinstance(content, bytes):
+            digest.update(content)
+        else:
+            try:
+                with open(content, "rb") as f:
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(block)
+            except OSError:
+                return None
+        return hashlib.sha256(f"{digest.hexdigest()}:{kind}:{self._version}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + _SUFFIX)
+
+    def get(self, key: Optional[str]) -> Optional[Dict[str, Any]]:
+        if key is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, zlib.error) as e:
+            logging.warning(f"读取转换缓存失败，忽略该条目: {e}")
+            return None
+        return entry
+
+    def put(self, key: Optional[str], entry: Dict[str, Any]) -> None:
+        if key is None:
+            return
+        path = self._path(key)
+        data = zlib.compress(json.dumps(entry, ensure_ascii=False).encode("utf-8"), 6)
+        if len(data) > self.max_bytes * _EVICT_TARGET:
+            return
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning(f"写入转换缓存失败: {e}")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan_total()
+            else:
+                self._total += len(data)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _entries(self) -> List[os.DirEntry]:
+        entries: List[os.DirEntry] = []
+        try:
+            shards = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return entries
+        for shard in shards:
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(_SUFFIX):
+                    entries.append(entry)
+        return entries
+
+    def _scan_total(self) -> int:
+        total = 0
+        for entry in self._entries():
+            try:
+                total += entry.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def _evict(self) -> None:
+        """按最近使用时间淘汰，直到总大小降到上限的 90%（其它进程写入的条目也一并统计）"""
+        files = []
+        for entry in self._entries():
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, entry.path))
+        files.sort()
+        total = sum(f[1] for f in files)
+        target = self.max_bytes * _EVICT_TARGET
+        evicted = 0
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                evicted += 1
+            except OSError:
+                pass
+        self._total = total
+        if evicted:
+            logging.info(f"转换缓存淘汰 {evicted} 个条目，当前 {total / (1024 * 1024):.1f}MB")
+
+    def clear(self) -> int:
+        """清空缓存，返回删除的条目数"""
+        removed = 0
+        with self._lock:
+            for entry in self._entries():
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    pass
+            self._total = 0
+        return removed
+
+
+def cache_entry(filename: str, text: Optional[str] = None, pages: Optional[List] = None) -> Dict[str, Any]:
+    """构造缓存条目：导出文本（或按页的 [文本, 页码]）及结构信息"""
+    body = text if text is not None else "\n".join(t for t, _ in pages or [])
+    metadata = {
+        "filename": filename,
+        "chars": len(body),
+        "lines": body.count("\n") + 1 if body else 0,
+        "headings": sum(1 for line in body.split("\n") if line.lstrip().startswith("#")),
+        "cached_at": time.time(),
+    }
+    if pages is not None:
+        metadata["page_count"] = len(pages)
+        return {"pages": pages, "metadata": metadata}
+    return {"text": text, "metadata": metadata}
+
+
+# 全局转换缓存
+conversion_cache = ConversionCache()
@@ -0,0 +1,151 @@
+"""
+文档转换器注册表
+按扩展名选择转换器：纯文本、Markdown、HTML、JSON 在当前进程内直接转换（不启动 Docling 的版面分析），
+其余格式（PDF、Office、图片等）交给 Docling 转换进程池。
+转换结果与 Docling export_to_text 的结构一致：标题行以 "#" 开头，列表项以 "- " 开头，段落之间空一行，
+可直接交给 chunk_text_from_export 分块。
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import json
+import logging
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+# 是否启用快速转换（false 时所有格式都走 Docling）
+CONVERSION_FAST_PATHS = os.environ.get("CONVERSION_FAST_PATHS", "true").lower() == "true"
+
+# 转换函数：(文件内容, 文件名) -> 文本
+Converter = Callable[[bytes, str], str]
+
+_converters: Dict[str, Converter] = {}
+
+
+def register_converter(*extensions: str) -> Callable[[Converter], Converter]:
+    """为扩展名（如 ".md"）注册快速转换函数（装饰器）"""
+    def decorator(func: Converter) -> Converter:
+        for ext in extensions:
+            _converters[ext.lower()] = func
+        return func
+    return decorator
+
+
+def find_converter(filename: str) -> Optional[Converter]:
+    """文件对应的快速转换函数，没有时返回 None（由 Docling 转换）"""
+    if not CONVERSION_FAST_PATHS:
+        return None
+    return _converters.get(os.path.splitext(filename or "")[1].lower())
+
+
+def convert_native(content: bytes | str, filename: str, converter: Converter) -> str:
+    """用快速转换函数转换文件内容（字节或路径）"""
+    if isinstance(content, str):
+        with open(content, "rb") as f:
+            content = f.read()
+    text = converter(content, filename)
+    logging.info(f"文档快速转换完成: {filename}")
+    return text
+
+
+def _decode(content: bytes) -> str:
+    for encoding in ("utf-8-sig", "gb18030"):
+        try:
+            return content.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return content.decode("latin-1", errors="ignore")
+
+
+def _tidy(text: str) -> str:
+    """统一换行、去掉行尾空白，连续空行合并为一个"""
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = "\n".join(line.rstrip() for line in text.split("\n"))
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+@register_converter(".txt", ".text", ".md", ".markdown")
+def convert_plain_text(content: bytes, filename: str) -> str:
+    """纯文本与 Markdown：原样保留（标题、列表、空行即为分块依据）"""
+    return _tidy(_decode(content))
+
+
+_HTML_DROP = ("script", "style", "noscript", "template", "head", "svg", "iframe")
+_HTML_BLOCKS = ("p", "div", "section", "article", "header", "footer", "main", "aside", "nav", "blockquote",
+                "pre", "table", "tr", "ul", "ol", "dl", "dt", "dd", "figure", "figcaption", "caption", "form",
+                "hr", "address")
+
+
+@register_converter(".html", ".htm", ".xhtml")
+def convert_html(content: bytes, filename: str) -> str:
+    """HTML：去掉脚本与样式，h1-h6 转为 "#" 标题，li 转为 "- " 列表项，块级元素之间空行分隔"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, "lxml")
+    for tag in soup(_HTML_DROP):
+        tag.decompose()
+    for br in soup.find_all("br"):
+        br.replace_with("\n")
+    for level in range(1, 7):
+        for tag in soup.find_all(f"h{level}"):
+            title = tag.get_text(" ", strip=True)
+            tag.replace_with(f"\n\n{'#' * level} {title}\n\n" if title else "\n\n")
+    for tag in soup.find_all("li"):
+        tag.insert_before("\n- ")
+        tag.insert_after("\n")
+    for tag in soup.find_all(["td", "th"]):
+        tag.insert_after(" | ")
+    for tag in soup.find_all(_HTML_BLOCKS):
+        tag.insert_before("\n\n")
+        tag.insert_after("\n\n")
+
+    lines: List[str] = []
+    for line in soup.get_text().split("\n"):
+        line = re.sub(r"[ \t\xa0]+", " ", line).strip()
+        # 列表项内的换行合并到同一行
+        if lines and lines[-1] == "-":
+            lines[-1] = f"- {line}" if line else "-"
+            continue
+        lines.append(line.rstrip(" |") if line.endswith("|") else line)
+    return _tidy("\n".join(l for l in lines if l != "-"))
+
+
+def _json_scalar(value: Any) -> str:
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip()
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _json_lines(value: Any, path: str) -> Iterator[str]:
+    """把 JSON 值展开为 "路径: 值" 行（空数组/空对象也输出一行，保留其路径）"""
+    if isinstance(value, (dict, list)) and not value:
+        yield f"{path}: {_json_scalar(value)}" if path else _json_scalar(value)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield from _json_lines(item, f"{path}.{key}" if path else str(key))
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            yield from _json_lines(item, f"{path}[{index}]")
+    else:
+        yield f"{path}: {_json_scalar(value)}" if path else _json_scalar(value)
+
+
+@register_converter(".json")
+def convert_json(content: bytes, filename: str) -> str:
+    """JSON：顶层对象的每个键作为一个标题段，顶层数组的每个元素作为一段，段内为 "路径: 值" 行"""
+    data = json.loads(_decode(content))
+    blocks: List[str] = []
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if isinstance(value, (dict, list)) and value:
+                blocks.append(f"# {key}\n" + "\n".join(_json_lines(value, "")))
+            else:
+                blocks.append(f"{key}: {_json_scalar(value)}")
+    elif isinstance(data, list):
+        for item in data:
+            blocks.append("\n".join(_json_lines(item, "")))
+    else:
+        blocks.append(_json_scalar(data))
+    return _tidy("\n\n".join(b for b in blocks if b))
@@ -1,38 +1,126 @@
 from __future__ import annotations
 
-import re
-from typing import List, Dict, Tuple
-
-from config.docling import document_converter
+import os
+import json
+import codecs
+import hashlib
+import logging
+from typing import List, Dict, Iterable, Iterator, Tuple
+
+from core.chunking import iter_export_chunks, iter_normalized_chunks
+from core.conversion import conversion_pool, pdf_text_extractor
+from core.json_stream import json_chunker
+from core.pipeline import Segment, ingest_stream
 from core.vector_store import vector_store
+from config.database import DEFAULT_COLLECTION
+
+
+# 按记录流式入库的 JSON 格式（.jsonl / .ndjson 为每行一个值）
+JSON_EXTENSIONS = (".json", ".jsonl", ".ndjson")
+
+
+def guess_file_type(filename: str) -> str:
+    """Infer the stored file_type from a filename extension (same mapping as the upload endpoints)."""
+    name_lower = (filename or "").lower()
+    if name_lower.endswith(".pdf"):
+        return "pdf"
+    if name_lower.endswith((".docx", ".doc")):
+        return "docx"
+    if name_lower.endswith((".pptx", ".ppt")):
+        return "pptx"
+    if name_lower.endswith((".png", ".jpg", ".jpeg", ".tiff", ".bmp")):
+        return "image"
+    if name_lower.endswith((".html", ".htm")):
+        return "html"
+    if name_lower.endswith((".md", ".markdown")):
+        return "markdown"
+    if name_lower.endswith((".adoc", ".asciidoc")):
+        return "asciidoc"
+    if name_lower.endswith(JSON_EXTENSIONS):
+        return "json"
+    return "text"
+
+
+def iter_pdf_pages(file_bytes: bytes | str, filename: str = "") -> Iterator[Tuple[str, int]]:
+    """逐页提取PDF（字节或磁盘路径）文本，产出 (文本, 页码)（跳过空页和无法解析的页），供流式入库边解析边分块。
+    多页的 PDF 按页段在 PyPDF2 提取进程池中并行提取（见 core.conversion.PdfTextExtractor），
+    页数上限由 PDF_EXTRACT_MAX_PAGES 配置。
+    """
+    return pdf_text_extractor.iter_pages(file_bytes, filename)
+
+
+def extract_text_from_pdf(file_bytes: bytes, filename: str = "") -> str:
+    """从PDF字节内容中提取所有页面文本并拼接返回"""
+    return "\n".join(text for text, _ in iter_pdf_pages(file_bytes, filename)).strip()
+
+
+def normalize_and_chunk_text(raw_text: str, max_chunk_size: int = 1000) -> List[str]:
+    """规范化空白并按句子边界切分文本，保证每块不超过max_chunk_size字符（见 core.chunking.iter_normalized_chunks）"""
+    return list(iter_normalized_chunks([raw_text or ""], max_chunk_size=max_chunk_size))
+
+
+def extract_simple_text(file_bytes: bytes, filename: str) -> Tuple[str, str]:
+    """/upload/simple 的解析方式：PDF 用 PyPDF2 提取文本，JSON 规范化，其它按 UTF-8（失败时 latin-1）解码。
+    返回 (文本, file_type)。
+    """
+    name_lower = (filename or "").lower()
+    if name_lower.endswith(".pdf"):
+        return extract_text_from_pdf(file_bytes, filename), "pdf"
+    if name_lower.endswith(".json"):
+        try:
+            obj = json.loads(file_bytes.decode("utf-8"))
+            return json.dumps(obj, ensure_ascii=False), "json"
+        except Exception:
+            pass
+    try:
+        return file_bytes.decode("utf-8"), "text"
+    except Exception:
+        return file_bytes.decode("latin-1", errors="ignore"), "text"
+
+
+def is_json_file(filename: str) -> bool:
+    return (filename or "").lower().endswith(JSON_EXTENSIONS)
+
+
+def iter_text_blocks(blocks: Iterable[bytes]) -> Iterator[str]:
+    """把按块读取的 UTF-8 字节增量解码为文本片段（跨块的多字节字符不会被切坏）"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    for block in blocks:
+        text = decoder.decode(block)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def ingest_json_stream(blocks: Iterable[bytes], filename: str, collection: str = DEFAULT_COLLECTION,
+                       content_hash: str | None = None, byte_size: int | None = None,
+                       max_chunk_size: int = 1000) -> int:
+    """流式入库 JSON / JSONL：按块读取、增量解析，每条记录（或多条小记录装箱）为一个文档块，
+    块元数据记录 JSON 路径；内存占用与文件大小无关（见 core.json_stream）"""
+    lines = not filename.lower().endswith(".json")
+    return ingest_stream(iter_text_blocks(blocks), filename, file_type="json", collection=collection,
+                         content_hash=content_hash, byte_size=byte_size,
+                         chunk_stream=json_chunker(max_chunk_size, lines=lines))
 
 
 def export_to_text(content: bytes | str, filename: str) -> str:
     """Convert file content to plain text using Docling export_to_text().
-    Supports bytes (uploaded) or file path string.
+    Supports bytes (uploaded) or file path string. Runs in the conversion process pool
+    so the caller's process never loads Docling; raises ConversionTimeout on timeout.
     """
-    if isinstance(content, bytes):
-        # Save to a temporary pathless buffer via docling's convert API using in-memory bytes
-        # Docling supports path/URL; for bytes, we pass a BytesIO-like path by writing to tmp.
-        import tempfile, os
-        suffix = ""
-        if "." in filename:
-            suffix = "." + filename.split(".")[-1]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            tmp.write(content)
-            tmp_path = tmp.name
-        try:
-            result = document_converter.convert(tmp_path)
-            return result.document.export_to_text()
-        finally:
-            try:
-                os.remove(tmp_path)
-            except Exception:
-                pass
+    return conversion_pool.convert(content, filename)
+
+
+def docling_segments(content: bytes | str, filename: str) -> Iterator[Segment]:
+    """Docling 转换结果按段产出：页数超过 CONVERSION_SPLIT_PAGES 的 PDF 拆成页段并行转换，
+    按页产出 (文本, 页码)；其它文件整体转换为一段。转换在迭代时才开始。
+    """
+    if conversion_pool.should_split(content, filename):
+        yield from conversion_pool.convert_pages(content, filename)
     else:
-        # content is path
-        result = document_converter.convert(content)
-        return result.document.export_to_text()
+        yield export_to_text(content, filename)
 
 
 def chunk_text_from_export(export_text: str, max_tokens: int = 800, min_tokens: int = 120) -> List[str]:
@@ -41,139 +129,51 @@ def chunk_text_from_export(export_text: str, max_tokens: int = 800, min_tokens:
     - Double newlines separate paragraphs
     - List items (-, *, +, 1.) are grouped
     - Very short blocks are merged up to min_tokens, long ones split ~max_tokens by sentences
+    Streaming, linear-time engine: core.chunking.iter_export_chunks (accepts an iterator of text pieces).
     """
-    # Normalize line endings
-    text = export_text.replace("\r\n", "\n").replace("\r", "\n").strip()
-    if not text:
-        return []
-
-    # Split into logical lines
-    lines = [ln.rstrip() for ln in text.split("\n")]
-
-    blocks: List[str] = []
-    buf: List[str] = []
-
-    def flush_buf():
-        if not buf:
-            return
-        # Join consecutive lines, preserving paragraph breaks
-        joined = "\n".join(buf).strip()
-        if joined:
-            blocks.append(joined)
-        buf.clear()
-
-    heading_re = re.compile(r"^\s{0,3}#{1,6} \S")
-    list_re = re.compile(r"^\s{0,3}(?:[-*+] |\d+\. )\S")
-    fence_re = re.compile(r"^\s*```")
-
-    in_code = False
-    for ln in lines:
-        if fence_re.match(ln):
-            in_code = not in_code
-            buf.append(ln)
-            continue
-        if in_code:
-            buf.append(ln)
-            continue
-
-        if not ln.strip():
-            # empty line indicates paragraph break
-            flush_buf()
-            continue
-
-        if heading_re.match(ln):
-            flush_buf()
-            buf.append(ln)
-            flush_buf()
-            continue
-
-        if list_re.match(ln):
-            # keep consecutive list lines together; handled by buffer until empty line
-            buf.append(ln)
-            continue
-
-        buf.append(ln)
-
-    flush_buf()
-
-    # Clean each block: strip markdown markers but keep content
-    def clean_block(block: str) -> str:
-        b = block
-        # Remove fences
-        b = re.sub(r"```[\s\S]*?```", "", b)
-        # Remove heading markers at line start
-        b = re.sub(r"^\s{0,3}#{1,6}\s+", "", b, flags=re.MULTILINE)
-        # Remove list bullets
-        b = re.sub(r"^\s{0,3}(?:[-*+] |\d+\. )", "", b, flags=re.MULTILINE)
-        # Collapse whitespace
-        b = re.sub(r"\s+", " ", b).strip()
-        return b
-
-    cleaned = [clean_block(b) for b in blocks]
-    cleaned = [c for c in cleaned if c]
-
-    # Merge small blocks and split long ones
-    def estimate_tokens(s: str) -> int:
-        # heuristic: ~4 chars per token (English) / ~1.5-2 (CJK). Use conservative 3.
-        return max(1, int(len(s) / 3))
-
-    final_chunks: List[str] = []
-    carry = ""
-    for c in cleaned:
-        if carry:
-            candidate = (carry + "\n\n" + c)
-        else:
-            candidate = c
-        if estimate_tokens(candidate) < min_tokens:
-            carry = candidate
-            continue
-        # candidate big enough; now split by sentences to fit max_tokens
-        unit = candidate
-        carry = ""
-        # sentence split with Chinese and English punctuation
-        sentences = re.split(r"(?<=[。！？.!?])\s+", unit)
-        cur = ""
-        for s in sentences:
-            s = s.strip()
-            if not s:
-                continue
-            cand = (cur + (" " if cur else "") + s)
-            if estimate_tokens(cand) <= max_tokens:
-                cur = cand
-            else:
-                if cur:
-                    final_chunks.append(cur)
-                if estimate_tokens(s) <= max_tokens:
-                    cur = s
-                else:
-                    # hard wrap extremely long sentence
-                    step = max_tokens * 3  # chars approximation
-                    for i in range(0, len(s), step):
-                        final_chunks.append(s[i:i+step])
-                    cur = ""
-        if cur:
-            final_chunks.append(cur)
-
-    if carry:
-        final_chunks.append(carry)
-
-    return final_chunks
-
-
-def ingest_bytes(file_bytes: bytes, filename: str, file_type: str = "unknown") -> int:
-    text = export_to_text(file_bytes, filename)
-    chunks = chunk_text_from_export(text)
-    if not chunks:
+    return list(iter_export_chunks([export_text], max_tokens=max_tokens, min_tokens=min_tokens))
+
+
+def ingest_bytes(file_bytes: bytes, filename: str, file_type: str = "unknown",
+                 collection: str = DEFAULT_COLLECTION, text: str | None = None) -> int:
+    """Chunk and store one uploaded file; pass `text` when it was already converted (e.g. in parallel).
+    Chunking, embedding and COPY run as a streaming pipeline (core.pipeline); large PDFs are
+    converted as parallel page ranges and their chunks record page numbers.
+    A file identical to its active version is skipped (returns 0) without converting."""
+    content_hash = hashlib.sha256(file_bytes).hexdigest()
+    if vector_store.unchanged_document(filename, content_hash, collection=collection) is not None:
+        logging.info(f"文件未变化，跳过入库: {filename}")
         return 0
-    return vector_store.store_chunks(chunks, filename, file_type=file_type)
-
-
-def ingest_file(path: str, file_type: str = "unknown") -> Tuple[str, int]:
-    text = export_to_text(path, path)
-    chunks = chunk_text_from_export(text)
-    if not chunks:
+    segments = [text] if text is not None else docling_segments(file_bytes, filename)
+    return ingest_stream(segments, filename, file_type=file_type, collection=collection,
+                         content_hash=content_hash, byte_size=len(file_bytes))
+
+
+def _iter_file_blocks(path: str, block_size: int = 1 << 20) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        yield from iter(lambda: f.read(block_size), b"")
+
+
+def ingest_file(path: str, file_type: str = "unknown", collection: str = DEFAULT_COLLECTION,
+                name: str | None = None, text: str | None = None,
+                content_hash: str | None = None) -> Tuple[str, int]:
+    """Convert, chunk and store a file from disk under `name` (defaults to the path).
+    Pass `text` when it was already converted and `content_hash` when it is already known.
+    JSON / JSONL files are parsed incrementally record by record (ingest_json_stream).
+    A file identical to its active version is skipped (returns 0)."""
+    name = name or path
+    if content_hash is None:
+        digest = hashlib.sha256()
+        for block in _iter_file_blocks(path):
+            digest.update(block)
+        content_hash = digest.hexdigest()
+    if vector_store.unchanged_document(name, content_hash, collection=collection) is not None:
+        logging.info(f"文件未变化，跳过入库: {name}")
         return path, 0
-    added = vector_store.store_chunks(chunks, path, file_type=file_type)
+    if text is None and is_json_file(path):
+        return path, ingest_json_stream(_iter_file_blocks(path), name, collection=collection,
+                                        content_hash=content_hash, byte_size=os.path.getsize(path))
+    segments = [text] if text is not None else docling_segments(path, path)
+    added = ingest_stream(segments, name, file_type=file_type, collection=collection,
+                          content_hash=content_hash, byte_size=os.path.getsize(path))
     return path, added
-
-
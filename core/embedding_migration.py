@@ -0,0 +1,340 @@
+"""
+向量模型在线迁移
+1. start_embedding_migration：探测新模型的维度，在 document_chunks 上新增 embedding_<模型> 列（只改元数据，不重写表），
+   记为迁移目标并提交后台任务；此后 store_chunks 同时写入新旧两列。
+2. 后台任务按 id 分批为 active/pending 版本的文档块生成新向量（批量调用嵌入接口，批间停顿限流），
+   每批提交后在主库记录进度，中断后从断点继续（重做的批次按 id 重新生成同样的向量）。
+3. 回填完成后逐分区 CREATE INDEX CONCURRENTLY 建 HNSW 索引并挂到父表的分区索引下，不阻塞读写。
+4. 覆盖率达到 100% 时在一个事务内切换 embedding_settings 的 active 列，检索随之改用新列；
+   旧列保留到 finalize_embedding_migration 时删除。
+检索在切换前始终使用旧列，迁移期间无需停机，也不需要重新上传文档。
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import time
+import hashlib
+import logging
+from typing import Any, Dict, List
+
+from psycopg2 import sql
+from psycopg2.extras import execute_batch
+
+from config.database import (
+    get_db_connection, get_embedding_settings, validate_embedding_column, data_shards, use_shard,
+    EMBEDDING_SETTINGS_TTL,
+)
+from core.jobs import Job, enqueue_job, register_job_handler
+
+
+# 每批回填的文档块数（一次嵌入请求）
+EMBED_MIGRATION_BATCH_SIZE = int(os.environ.get("EMBED_MIGRATION_BATCH_SIZE", "64"))
+# 每批之间的停顿（毫秒），避免回填占满嵌入服务影响在线查询
+EMBED_MIGRATION_PAUSE_MS = int(os.environ.get("EMBED_MIGRATION_PAUSE_MS", "200"))
+# pgvector HNSW 索引支持的最大维度
+_HNSW_MAX_DIM = 2000
+
+
+def embedding_column_name(model: str) -> str:
+    """模型对应的向量列名：embedding_<模型名 slug>_<短哈希>（哈希避免不同模型 slug 相同）"""
+    slug = re.sub(r"[^a-z0-9]+", "_", model.lower()).strip("_")[:24] or "model"
+    digest = hashlib.blake2b(model.encode("utf-8"), digest_size=3).hexdigest()
+    return validate_embedding_column(f"embedding_{slug}_{digest}")
+
+
+def _index_name(table: str, column: str) -> str:
+    """索引名（分区名与列名拼接可能超过 63 字符，取哈希）"""
+    return "idx_" + hashlib.blake2b(f"{table}:{column}".encode("utf-8"), digest_size=10).hexdigest()
+
+
+def start_embedding_migration(model: str) -> Dict[str, Any]:
+    """为新模型新增向量列并提交回填任务，返回 {job_id, column, dim}"""
+    from core.vector_store import vector_store
+
+    settings = get_embedding_settings(refresh=True)
+    if model == settings["active_model"]:
+        raise ValueError(f"检索已在使用模型 {model}")
+    if settings["target_model"] and settings["target_model"] != model:
+        raise ValueError(f"已有进行中的迁移: {settings['target_model']}")
+    if settings["previous_column"]:
+        raise ValueError(f"上一次迁移的旧列 {settings['previous_column']} 尚未删除，请先 finalize")
+
+    dim = len(vector_store.embed_texts(["dimension probe"], model=model)[0])
+    if dim > _HNSW_MAX_DIM:
+        raise ValueError(f"模型 {model} 的向量维度 {dim} 超过 HNSW 索引上限 {_HNSW_MAX_DIM}")
+    column = embedding_column_name(model)
+
+    # 新增可为空的列只修改元数据；分片模式下每个分片都要加列
+    for shard in data_shards():
+        with use_shard(shard):
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SET LOCAL lock_timeout = '10s';")
+                cursor.execute(sql.SQL("ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS {} vector({});").format(
+                    sql.Identifier(column), sql.Literal(dim)
+                ))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+                conn.close()
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE embedding_settings
+            SET target_column = %s, target_model = %s, target_dim = %s, updated_at = NOW()
+            WHERE id;
+        """, (column, model, dim))
+        job_id = enqueue_job("embedding_migration", {"column": column, "model": model}, cursor=cursor,
+                             dedupe_key=f"embedding_migration:{column}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+    get_embedding_settings(refresh=True)
+    logging.info(f"开始向量模型迁移: {settings['active_model']} -> {model}（列 {column}，{dim} 维）")
+    return {"job_id": job_id, "column": column, "dim": dim}
+
+
+def embedding_coverage(column: str) -> Dict[str, int]:
+    """active/pending 版本的文档块中已有 column 向量的数量（各分片合计）"""
+    column = validate_embedding_column(column)
+    total = covered = 0
+    for shard in data_shards():
+        with use_shard(shard):
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql.SQL("""
+                    SELECT COUNT(*), COUNT(c.{})
+                    FROM document_chunks c
+                    JOIN documents d ON d.id = c.document_id AND d.status IN ('active', 'pending');
+                """).format(sql.Identifier(column)))
+                shard_total, shard_covered = cursor.fetchone()
+                total += shard_total
+                covered += shard_covered
+            finally:
+                cursor.close()
+                conn.close()
+    return {"total": total, "covered": covered, "missing": total - covered}
+
+
+def get_migration_status() -> Dict[str, Any]:
+    """当前向量设置与迁移覆盖率"""
+    settings = get_embedding_settings(refresh=True)
+    status: Dict[str, Any] = dict(settings)
+    if settings["target_column"]:
+        status["coverage"] = embedding_coverage(settings["target_column"])
+    return status
+
+
+def finalize_embedding_migration() -> Dict[str, Any]:
+    """删除切换前使用的旧向量列及其索引（确认新模型检索正常后调用）"""
+    settings = get_embedding_settings(refresh=True)
+    column = settings["previous_column"]
+    if not column:
+        raise ValueError("没有待删除的旧向量列")
+    if column == settings["active_column"]:
+        raise ValueError("不能删除当前检索使用的向量列")
+
+    for shard in data_shards():
+        with use_shard(shard):
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SET LOCAL lock_timeout = '10s';")
+                # 删除列会一并删除其上的索引；DROP COLUMN 只修改元数据，空间在后续 VACUUM 时回收
+                cursor.execute(sql.SQL("ALTER TABLE document_chunks DROP COLUMN IF EXISTS {};").format(
+                    sql.Identifier(column)
+                ))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+                conn.close()
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE embedding_settings SET previous_column = NULL, updated_at = NOW() WHERE id;")
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    get_embedding_settings(refresh=True)
+    logging.info(f"已删除旧向量列 {column}")
+    return {"dropped_column": column}
+
+
+def _save_progress(job: Job, **updates) -> None:
+    """任务记录在主库的 background_jobs 中，分片上下文内也写到主库"""
+    with use_shard(None):
+        job.save_progress(**updates)
+
+
+def _backfill(job: Job, key: str, column: str, model: str) -> None:
+    """在当前数据库上为缺少 column 向量的文档块分批生成向量；一轮扫描到末尾后从头复查一次，直到没有遗漏"""
+    from core.vector_store import vector_store
+
+    shards_progress = job.progress.setdefault("shards", {})
+    state = shards_progress.setdefault(key, {"last_id": 0, "embedded": 0})
+    select = sql.SQL("""
+        SELECT c.id, c.collection, c.content
+        FROM document_chunks c
+        JOIN documents d ON d.id = c.document_id AND d.status IN ('active', 'pending')
+        WHERE c.{col} IS NULL AND c.id > %s
+        ORDER BY c.id
+        LIMIT %s;
+    """).format(col=sql.Identifier(column))
+    update = sql.SQL("UPDATE document_chunks SET {col} = %s::vector WHERE id = %s AND collection = %s;").format(
+        col=sql.Identifier(column)
+    )
+
+    conn = get_db_connection()
+    try:
+        while True:
+            cursor = conn.cursor()
+            cursor.execute(select, (state["last_id"], EMBED_MIGRATION_BATCH_SIZE))
+            rows = cursor.fetchall()
+            conn.commit()
+            if not rows:
+                cursor.close()
+                if state["last_id"] == 0:
+                    break
+                # 扫描期间新写入的、id 更小的行（如 pending 版本）在复查轮中补齐
+                state["last_id"] = 0
+                continue
+
+            # 嵌入在事务外进行，不长时间持有行锁
+            vectors = vector_store.embed_texts([r[2] for r in rows], model=model)
+            execute_batch(cursor, update, [
+                ('[' + ','.join(map(str, vec)) + ']', row_id, collection)
+                for (row_id, collection, _), vec in zip(rows, vectors)
+            ])
+            conn.commit()
+            cursor.close()
+            # 进度写在主库的任务表中（不能与分片上的批次同一事务）：先提交批次再记录进度，
+            # 两者之间中断时续跑会重做该批，按 id 重新生成同样的向量，结果不变
+            state["last_id"] = rows[-1][0]
+            state["embedded"] += len(rows)
+            _save_progress(job, shards=shards_progress)
+            if EMBED_MIGRATION_PAUSE_MS > 0:
+                time.sleep(EMBED_MIGRATION_PAUSE_MS / 1000)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _build_index(column: str) -> List[str]:
+    """在当前数据库上为 column 建 HNSW 索引：父表先建 ON ONLY 索引，再逐分区并发建索引后挂载"""
+    parent_index = _index_name("document_chunks", column)
+    conn = get_db_connection()
+    # CREATE INDEX CONCURRENTLY 不能在事务块内执行
+    conn.autocommit = True
+    cursor = conn.cursor()
+    built = []
+    try:
+        cursor.execute(sql.SQL(
+            "CREATE INDEX IF NOT EXISTS {} ON ONLY document_chunks USING hnsw ({} vector_cosine_ops);"
+        ).format(sql.Identifier(parent_index), sql.Identifier(column)))
+        cursor.execute("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = 'document_chunks';
+        """)
+        for (partition,) in cursor.fetchall():
+            child_index = _index_name(partition, column)
+            cursor.execute("""
+                SELECT x.indisvalid, EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = x.indexrelid)
+                FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+                WHERE i.relname = %s;
+            """, (child_index,))
+            row = cursor.fetchone()
+            if row and row[1]:
+                continue
+            if row and not row[0]:
+                # 上次并发建索引中断留下的无效索引
+                cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {};").format(sql.Identifier(child_index)))
+            if not row or not row[0]:
+                cursor.execute(sql.SQL(
+                    "CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} USING hnsw ({} vector_cosine_ops);"
+                ).format(sql.Identifier(child_index), sql.Identifier(partition), sql.Identifier(column)))
+            cursor.execute(sql.SQL("ALTER INDEX {} ATTACH PARTITION {};").format(
+                sql.Identifier(parent_index), sql.Identifier(child_index)
+            ))
+            built.append(child_index)
+        return built
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _cutover(column: str) -> None:
+    """覆盖率 100% 时切换检索使用的向量列（主库上单行更新，一个事务内完成）"""
+    coverage = embedding_coverage(column)
+    if coverage["missing"]:
+        raise RuntimeError(f"仍有 {coverage['missing']} 个文档块缺少新向量，暂不切换")
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE embedding_settings
+            SET previous_column = active_column,
+                active_column = target_column, active_model = target_model, active_dim = target_dim,
+                target_column = NULL, target_model = NULL, target_dim = NULL, updated_at = NOW()
+            WHERE id AND target_column = %s;
+        """, (column,))
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    get_embedding_settings(refresh=True)
+
+
+@register_job_handler("embedding_migration")
+def _embedding_migration_job(job: Job) -> Dict[str, Any]:
+    column, model = job.params["column"], job.params["model"]
+    settings = get_embedding_settings(refresh=True)
+    if settings["active_column"] != column and settings["target_column"] != column:
+        return {"skipped": "迁移已不再进行"}
+
+    if job.progress.get("phase") in (None, "backfill", "index"):
+        for shard in data_shards():
+            key = str(shard) if shard is not None else "primary"
+            with use_shard(shard):
+                _save_progress(job, phase="backfill")
+                _backfill(job, key, column, model)
+                _save_progress(job, phase="index")
+                _build_index(column)
+        _cutover(column)
+        job.save_progress(phase="cutover", cutover_at=time.time())
+        logging.info(f"向量模型迁移完成切换，检索改用列 {column}（{model}）")
+
+    if job.progress.get("phase") == "cutover":
+        # 切换前读到旧设置的写入只写了旧列；等各进程缓存过期后再补齐一次
+        wait = job.progress["cutover_at"] + EMBEDDING_SETTINGS_TTL * 2 - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        for shard in data_shards():
+            key = str(shard) if shard is not None else "primary"
+            with use_shard(shard):
+                job.progress.setdefault("shards", {}).setdefault(key, {"last_id": 0, "embedded": 0})["last_id"] = 0
+                _backfill(job, key, column, model)
+        job.save_progress(phase="done")
+    return {"column": column, "model": model}
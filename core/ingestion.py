@@ -0,0 +1,395 @@
+"""
+上传入库的后台任务
+上传接口把文件按块写入 job_blobs / job_blob_parts 并提交 ingest_files 任务后立即返回任务 id
+（批量导入接口同样保存文件并提交 bulk_import 任务，由 core.bulk_import 写入集合）；
+worker（API 进程内或 scripts/job_worker.py 启动的独立进程，可在其它机器上）领取任务后
+按 simple / docling / langgraph 三种方式解析 → 分块 → 生成向量 → 入库，并按阶段记录进度：
+    progress = {"stage", "files", "converted", "chunked", "stored", "chunks_stored", "failed", "skipped",
+                "completed", "results"}
+与同名 active 版本内容相同的文件直接跳过（skipped）；内容变化的文件只为新增或变化的块生成向量。
+每个文件入库后保存进度，任务重试时跳过已完成的文件；任务结束后删除上传的文件内容。
+"""
+
+from __future__ import annotations
+
+import os
+import hashlib
+import logging
+import tempfile
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from typing import Any, BinaryIO, Deque, Dict, Iterator, List, Optional, Tuple, Union
+
+import psycopg2
+
+from config.database import get_db_connection, save_trace_data
+from core.jobs import Job, enqueue_job, register_job_handler
+
+
+INGEST_MODES = ("simple", "docling", "langgraph")
+# 流式读取上传文件时每次读取的字节数
+_BLOB_BLOCK = 1 << 20
+
+
+def _iter_source(source: Union[bytes, BinaryIO], block_size: int = _BLOB_BLOCK) -> Iterator[bytes]:
+    if isinstance(source, bytes):
+        for offset in range(0, len(source), block_size):
+            yield source[offset:offset + block_size]
+    else:
+        yield from iter(lambda: source.read(block_size), b"")
+
+
+def enqueue_ingest(mode: str, collection: str, files: List[Tuple[Union[bytes, BinaryIO], str, str]]) -> int:
+    """保存上传的 (内容或文件对象, 文件名, 文件类型) 并提交入库任务（同一事务），返回任务 id。
+    文件对象（如上传接口的 SpooledTemporaryFile）按 _BLOB_BLOCK 逐块写入 job_blob_parts，
+    同时计算 sha256 与大小，内存中只有一个块。
+    """
+    if mode not in INGEST_MODES:
+        raise ValueError(f"不支持的入库方式: {mode}")
+    return _enqueue_with_blobs("ingest_files", {"mode": mode, "collection": collection, "files": len(files)}, files)
+
+
+def enqueue_bulk_import(collection: str, mode: str, files: List[Tuple[Union[bytes, BinaryIO], str, str]]) -> int:
+    """保存上传的文件并提交 bulk_import 任务，返回任务 id（文件保存方式同 enqueue_ingest）"""
+    from core.bulk_import import BULK_MODES
+
+    if mode not in BULK_MODES:
+        raise ValueError(f"不支持的导入模式: {mode}")
+    return _enqueue_with_blobs("bulk_import", {"mode": mode, "collection": collection, "files": len(files)}, files)
+
+
+def _enqueue_with_blobs(kind: str, params: Dict[str, Any],
+                        files: List[Tuple[Union[bytes, BinaryIO], str, str]]) -> int:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        job_id = enqueue_job(kind, params, cursor=cursor)
+        for source, file_name, file_type in files:
+            cursor.execute("""
+                INSERT INTO job_blobs (job_id, file_name, file_type, byte_size)
+                VALUES (%s, %s, %s, 0)
+                RETURNING id;
+            """, (job_id, file_name, file_type))
+            blob_id = cursor.fetchone()[0]
+            digest = hashlib.sha256()
+            byte_size = 0
+            for part, block in enumerate(_iter_source(source)):
+                digest.update(block)
+                byte_size += len(block)
+                cursor.execute("INSERT INTO job_blob_parts (blob_id, part, data) VALUES (%s, %s, %s);",
+                               (blob_id, part, psycopg2.Binary(block)))
+            cursor.execute("UPDATE job_blobs SET byte_size = %s, content_hash = %s WHERE id = %s;",
+                           (byte_size, digest.hexdigest(), blob_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+    from core.jobs import job_worker
+    job_worker.notify()
+    return job_id
+
+
+def _list_blobs(job_id: int) -> List[Tuple[int, str, str]]:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id, file_name, file_type FROM job_blobs WHERE job_id = %s ORDER BY id;", (job_id,))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _blob_digest(blob_id: int) -> Tuple[str, int]:
+    """上传文件内容的 sha256 与大小（上传时已计算，不读取内容）"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT content_hash, byte_size FROM job_blobs WHERE id = %s;", (blob_id,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _iter_blob(blob_id: int) -> Iterator[bytes]:
+    """按块读取上传文件内容，每次只取一个块"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        part = 0
+        while True:
+            cursor.execute("SELECT data FROM job_blob_parts WHERE blob_id = %s AND part = %s;", (blob_id, part))
+            row = cursor.fetchone()
+            if row is None:
+                return
+            yield bytes(row[0])
+            part += 1
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@contextmanager
+def _blob_file(blob_id: int, file_name: str) -> Iterator[str]:
+    """把上传文件按块写入临时文件（保留扩展名供格式识别），上下文结束时删除；
+    需要随机访问的解析（PDF、Docling）从磁盘读取，而不是把整个文件读入内存"""
+    suffix = os.path.splitext(file_name)[1]
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        for block in _iter_blob(blob_id):
+            tmp.write(block)
+    try:
+        yield tmp.name
+    finally:
+        try:
+            os.remove(tmp.name)
+        except OSError:
+            pass
+
+
+def delete_job_blobs(job_id: Optional[int] = None) -> int:
+    """删除任务的上传文件；不指定任务时删除所有已结束任务遗留的文件，返回删除数量"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        if job_id is not None:
+            cursor.execute("DELETE FROM job_blobs WHERE job_id = %s;", (job_id,))
+        else:
+            cursor.execute("""
+                DELETE FROM job_blobs b USING background_jobs j
+                WHERE j.id = b.job_id AND j.status IN ('done', 'failed');
+            """)
+        deleted = cursor.rowcount
+        conn.commit()
+        return deleted
+    finally:
+        cursor.close()
+        conn.close()
+
+
+class _IngestRun:
+    """一次入库任务的执行状态，进度按阶段计数"""
+
+    def __init__(self, job: Job):
+        self.job = job
+        self.collection = job.params["collection"]
+        self.mode = job.params["mode"]
+        progress = job.progress
+        for key in ("converted", "chunked", "stored", "chunks_stored"):
+            progress.setdefault(key, 0)
+        progress.setdefault("failed", 0)
+        progress.setdefault("skipped", 0)
+        progress.setdefault("completed", [])
+        progress.setdefault("results", [])
+
+    def pending_blobs(self) -> List[Tuple[int, str, str]]:
+        # 上传的文件在任务结束时才删除，重试时仍能列出全部文件
+        blobs = _list_blobs(self.job.id)
+        self.job.progress["files"] = len(blobs)
+        done = set(self.job.progress["completed"])
+        return [b for b in blobs if b[0] not in done]
+
+    def stage(self, stage: str, file_name: str, **counts: int) -> None:
+        progress = self.job.progress
+        for key, delta in counts.items():
+            progress[key] += delta
+        self.job.save_progress(stage=stage, current=file_name)
+
+    def skip_unchanged(self, blob_id: int, file_name: str, content_hash: str) -> bool:
+        """文件与同名 active 版本内容相同时直接记为完成（不解析、不生成向量），返回是否跳过"""
+        from core.vector_store import vector_store
+
+        chunks = vector_store.unchanged_document(file_name, content_hash, collection=self.collection)
+        if chunks is None:
+            return False
+        logging.info(f"文件未变化，跳过入库: {file_name}")
+        self.job.progress["skipped"] += 1
+        self.finish_file(blob_id, file_name, extra={"skipped": True, "chunks": chunks})
+        return True
+
+    def finish_file(self, blob_id: int, file_name: str, added: int = 0, error: Optional[str] = None,
+                    extra: Optional[Dict[str, Any]] = None) -> None:
+        progress = self.job.progress
+        progress["completed"].append(blob_id)
+        result = {"filename": file_name, "success": error is None, "added": added}
+        if error:
+            progress["failed"] += 1
+            result["error"] = error
+            logging.error(f"入库失败: {file_name}: {error}")
+        elif not (extra and extra.get("skipped")):
+            progress["stored"] += 1
+            progress["chunks_stored"] += added
+        if extra:
+            result.update(extra)
+        progress["results"].append(result)
+        self.job.save_progress(stage="stored", current=file_name)
+
+
+def _ingest_simple(run: _IngestRun, blobs: List[Tuple[int, str, str]]) -> None:
+    from core.document_ingest import is_json_file, ingest_json_stream, iter_pdf_pages, iter_text_blocks
+    from core.pipeline import ingest_stream, page_chunker
+    from core.chunking import iter_normalized_chunks
+
+    def chunk_engine(pieces):
+        return iter_normalized_chunks(pieces, max_chunk_size=1000)
+
+    for blob_id, file_name, _ in blobs:
+        try:
+            content_hash, byte_size = _blob_digest(blob_id)
+            if run.skip_unchanged(blob_id, file_name, content_hash):
+                continue
+            run.stage("converting", file_name)
+            if is_json_file(file_name):
+                # JSON / JSONL 按块从数据库读取并按记录增量解析
+                added = ingest_json_stream(_iter_blob(blob_id), file_name, collection=run.collection,
+                                           content_hash=content_hash, byte_size=byte_size)
+            elif file_name.lower().endswith(".pdf"):
+                # PDF 写入临时文件后逐页解析，解析、分块、生成向量与入库在流水线中重叠执行
+                with _blob_file(blob_id, file_name) as path:
+                    added = ingest_stream(iter_pdf_pages(path, file_name), file_name, "pdf",
+                                          collection=run.collection, chunk_engine=chunk_engine,
+                                          content_hash=content_hash, byte_size=byte_size)
+            else:
+                # 文本按块增量解码，相邻的块直接相连（不插入分隔符）
+                added = ingest_stream(iter_text_blocks(_iter_blob(blob_id)), file_name, "text",
+                                      collection=run.collection,
+                                      chunk_stream=page_chunker(chunk_engine, joiner=""),
+                                      content_hash=content_hash, byte_size=byte_size)
+            run.job.progress["converted"] += 1
+            run.job.progress["chunked"] += 1
+            run.finish_file(blob_id, file_name, added)
+        except Exception as e:
+            run.finish_file(blob_id, file_name, error=str(e))
+
+
+def _ingest_docling(run: _IngestRun, blobs: List[Tuple[int, str, str]]) -> None:
+    from core.conversion import conversion_pool
+    from core.document_ingest import ingest_file
+
+    with ExitStack() as files:
+        converting: Deque[Tuple[int, str, str, str, str]] = deque()
+        # 大 PDF 按页段在整个进程池中并行转换，放在其它文件之后单独处理
+        split: List[Tuple[int, str, str, str, str]] = []
+
+        def sources() -> Iterator[Tuple[str, str]]:
+            for blob_id, file_name, file_type in blobs:
+                content_hash, _ = _blob_digest(blob_id)
+                if run.skip_unchanged(blob_id, file_name, content_hash):
+                    continue
+                # 转换进程从临时文件读取；同时存在的临时文件不超过 convert_many 的预取数
+                path = files.enter_context(_blob_file(blob_id, file_name))
+                if conversion_pool.should_split(path, file_name):
+                    split.append((blob_id, file_name, file_type, path, content_hash))
+                    continue
+                converting.append((blob_id, file_name, file_type, path, content_hash))
+                yield path, file_name
+
+        # 多个文件在转换进程池中并行解析，按上传顺序依次入库
+        run.stage("converting", blobs[0][1] if blobs else "")
+        for text, error in conversion_pool.convert_many(sources()):
+            blob_id, file_name, file_type, path, content_hash = converting.popleft()
+            try:
+                if error is not None:
+                    run.finish_file(blob_id, file_name, error=f"Docling 解析失败: {error}")
+                    continue
+                run.stage("embedding", file_name, converted=1, chunked=1)
+                added = ingest_file(path, file_type=file_type, collection=run.collection, name=file_name,
+                                    text=text, content_hash=content_hash)[1]
+                run.finish_file(blob_id, file_name, added)
+            except Exception as e:
+                run.finish_file(blob_id, file_name, error=str(e))
+            finally:
+                # 入库后立即删除，不等到全部文件处理完（ExitStack 兜底清理异常退出时剩余的文件）
+                _remove_file(path)
+
+        for blob_id, file_name, file_type, path, content_hash in split:
+            try:
+                run.stage("converting", file_name)
+                added = ingest_file(path, file_type=file_type, collection=run.collection, name=file_name,
+                                    content_hash=content_hash)[1]
+                run.job.progress["converted"] += 1
+                run.job.progress["chunked"] += 1
+                run.finish_file(blob_id, file_name, added)
+            except Exception as e:
+                run.finish_file(blob_id, file_name, error=str(e))
+            finally:
+                _remove_file(path)
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _ingest_langgraph(run: _IngestRun, blobs: List[Tuple[int, str, str]]) -> None:
+    from core.langgraph_document_flow import process_document_with_trace
+
+    for blob_id, file_name, file_type in blobs:
+        try:
+            content_hash, byte_size = _blob_digest(blob_id)
+            if run.skip_unchanged(blob_id, file_name, content_hash):
+                continue
+            run.stage("converting", file_name)
+            with _blob_file(blob_id, file_name) as path:
+                result = process_document_with_trace(file_bytes=path, filename=file_name, file_type=file_type,
+                                                     collection=run.collection, content_hash=content_hash,
+                                                     byte_size=byte_size)
+            trace = result["execution_trace"]
+            if trace:
+                try:
+                    save_trace_data(file_name, file_type, trace)
+                except Exception as e:
+                    logging.error(f"保存轨迹数据到数据库失败: {e}")
+            steps = {step["step"] for step in trace.get("steps", []) if step.get("status") == "success"}
+            run.job.progress["converted"] += int("convert_document" in steps)
+            run.job.progress["chunked"] += int("chunk_text" in steps)
+            final = result["result"] or {}
+            error = None if result["success"] else "; ".join(trace.get("errors", [])) or "处理失败"
+            run.finish_file(blob_id, file_name, final.get("chunks_stored", 0), error=error,
+                            extra={"total_steps": trace.get("total_steps", 0)})
+        except Exception as e:
+            run.finish_file(blob_id, file_name, error=str(e))
+
+
+_PIPELINES = {
+    "simple": _ingest_simple,
+    "docling": _ingest_docling,
+    "langgraph": _ingest_langgraph,
+}
+
+
+@register_job_handler("ingest_files")
+def _ingest_files_job(job: Job) -> Dict[str, Any]:
+    run = _IngestRun(job)
+    blobs = run.pending_blobs()
+    if blobs:
+        _PIPELINES[run.mode](run, blobs)
+    job.save_progress(stage="done", current=None)
+    delete_job_blobs(job.id)
+    progress = job.progress
+    logging.info(f"入库任务 #{job.id} 完成: {progress['stored']} 个文件成功，{progress['skipped']} 个未变化跳过，"
+                 f"{progress['failed']} 个失败，共 {progress['chunks_stored']} 个文档块")
+    return {"added": progress["chunks_stored"]}
+
+
+@register_job_handler("bulk_import")
+def _bulk_import_job(job: Job) -> Dict[str, Any]:
+    from core.bulk_import import bulk_import_files
+
+    with ExitStack() as files:
+        def items() -> Iterator[Tuple[str, str, str]]:
+            # 按转换进度逐个写出临时文件，任务结束时统一删除
+            for blob_id, file_name, file_type in _list_blobs(job.id):
+                yield files.enter_context(_blob_file(blob_id, file_name)), file_name, file_type
+
+        job.save_progress(stage="importing", current=None)
+        result = bulk_import_files(items(), job.params["collection"], job.params["mode"])
+    delete_job_blobs(job.id)
+    logging.info(f"批量导入任务 #{job.id} 完成: {result['documents']} 个文档，新增 {result['inserted']} 行")
+    return result
@@ -0,0 +1,375 @@
+"""
+后台任务队列
+任务持久化在 background_jobs 表中，进程内的 worker 线程以 FOR UPDATE SKIP LOCKED 领取任务；
+任务处理函数通过 progress 记录进度，进程崩溃后心跳超时的任务会被重新领取并从上次进度继续。
+分片模式下每个分片有自己的任务表（任务与分片数据在同一事务内提交），worker 依次轮询主库和各分片，
+并在任务所在分片的上下文内执行处理函数。
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import contextvars
+from typing import Any, Callable, Dict, List, Optional
+
+from psycopg2.extras import RealDictCursor
+
+from config.database import get_db_connection, use_shard, SHARD_DSNS
+
+
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "2"))
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get("JOB_HEARTBEAT_INTERVAL", "10"))
+# 超过该秒数未更新心跳的 running 任务视为 worker 已崩溃，可被重新领取
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BACKOFF_SECONDS = int(os.environ.get("JOB_RETRY_BACKOFF_SECONDS", "30"))
+# API 进程内是否运行 worker；设为 false 时由 scripts/job_worker.py 启动的独立进程（可在其它机器上）执行任务
+JOB_WORKER_ENABLED = os.environ.get("JOB_WORKER_ENABLED", "true").lower() in ("1", "true", "yes")
+
+JobHandler = Callable[["Job"], Optional[Dict[str, Any]]]
+_handlers: Dict[str, JobHandler] = {}
+
+
+# 周期任务：kind -> 间隔（秒）
+_periodic: Dict[str, int] = {}
+
+
+def register_periodic_job(kind: str, interval: int) -> None:
+    """登记由 worker 定期提交的任务（在主库上执行，interval <= 0 表示不定期提交）"""
+    if interval > 0:
+        _periodic[kind] = interval
+
+
+def enqueue_periodic_job(kind: str, interval: int) -> Optional[int]:
+    """提交本周期的任务：dedupe_key 为 "kind@周期序号"，同一周期内无论任务是否已执行完都只提交一次，
+    多个 worker 进程同时检查也只会有一个任务；本周期已提交过时返回 None"""
+    dedupe_key = f"{kind}@{int(time.time() // interval)}"
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO background_jobs (kind, params, dedupe_key)
+            SELECT %s, '{}', %s
+            WHERE NOT EXISTS (SELECT 1 FROM background_jobs WHERE dedupe_key = %s)
+            ON CONFLICT (dedupe_key) WHERE status = 'queued' AND dedupe_key IS NOT NULL DO NOTHING
+            RETURNING id;
+        """, (kind, dedupe_key, dedupe_key))
+        row = cursor.fetchone()
+        conn.commit()
+        if row:
+            logging.info(f"已提交周期任务 {kind}#{row[0]}")
+        return row[0] if row else None
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def register_job_handler(kind: str) -> Callable[[JobHandler], JobHandler]:
+    """注册任务处理函数（装饰器）。处理函数返回的 dict 会合并进任务的最终 progress"""
+    def decorator(func: JobHandler) -> JobHandler:
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue_job(kind: str, params: Optional[Dict[str, Any]] = None, cursor=None,
+                dedupe_key: Optional[str] = None) -> Optional[int]:
+    """提交任务，返回任务 id。
+    传入 cursor 时在调用方事务内插入（与业务修改一同提交）；
+    指定 dedupe_key 且已有同 key 的排队任务时不重复提交，返回已有任务的 id。
+    """
+    own = cursor is None
+    conn = get_db_connection() if own else None
+    cursor = conn.cursor() if own else cursor
+    try:
+        cursor.execute("""
+            INSERT INTO background_jobs (kind, params, dedupe_key)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (dedupe_key) WHERE status = 'queued' AND dedupe_key IS NOT NULL DO NOTHING
+            RETURNING id;
+        """, (kind, json.dumps(params or {}, ensure_ascii=False), dedupe_key))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute("SELECT id FROM background_jobs WHERE dedupe_key = %s AND status = 'queued';",
+                           (dedupe_key,))
+            row = cursor.fetchone()
+        if own:
+            conn.commit()
+        job_id = row[0] if row else None
+        logging.info(f"已提交后台任务 {kind}#{job_id}")
+        if own:
+            job_worker.notify()
+        return job_id
+    except Exception:
+        if own:
+            conn.rollback()
+        raise
+    finally:
+        if own:
+            cursor.close()
+            conn.close()
+
+
+def _format_job(row: Dict[str, Any]) -> Dict[str, Any]:
+    item = dict(row)
+    for key in ("created_at", "started_at", "updated_at", "finished_at"):
+        item[key] = item[key].isoformat() if item.get(key) else None
+    return item
+
+
+def job_databases() -> List[Optional[int]]:
+    """存放任务表的数据库：主库（None）及各分片"""
+    return [None] + list(range(len(SHARD_DSNS)))
+
+
+def get_job(job_id: int, shard: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """查询任务状态与进度（分片上的任务需指定 shard）"""
+    with use_shard(shard):
+        return _get_job(job_id)
+
+
+def _get_job(job_id: int) -> Optional[Dict[str, Any]]:
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute("""
+            SELECT id, kind, params, status, progress, error, attempts,
+                   created_at, started_at, updated_at, finished_at
+            FROM background_jobs WHERE id = %s;
+        """, (job_id,))
+        row = cursor.fetchone()
+        return _format_job(row) if row else None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def list_jobs(status: Optional[str] = None, limit: int = 50, shard: Optional[int] = None) -> List[Dict[str, Any]]:
+    """按提交时间倒序列出任务（默认主库，指定 shard 时列出该分片的任务）"""
+    with use_shard(shard):
+        return _list_jobs(status, limit)
+
+
+def _list_jobs(status: Optional[str], limit: int) -> List[Dict[str, Any]]:
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute("""
+            SELECT id, kind, params, status, progress, error, attempts,
+                   created_at, started_at, updated_at, finished_at
+            FROM background_jobs
+            WHERE %s IS NULL OR status = %s
+            ORDER BY id DESC
+            LIMIT %s;
+        """, (status, status, limit))
+        return [_format_job(r) for r in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+class Job:
+    """worker 领取到的任务；处理函数通过 save_progress 持久化进度"""
+
+    def __init__(self, job_id: int, kind: str, params: Dict[str, Any], progress: Dict[str, Any], attempts: int):
+        self.id = job_id
+        self.kind = kind
+        self.params = params or {}
+        self.progress = progress or {}
+        self.attempts = attempts
+
+    def save_progress(self, cursor=None, **updates) -> None:
+        """更新进度并刷新心跳。传入 cursor 时与该批业务修改在同一事务内提交，保证断点续跑的一致性"""
+        self.progress.update(updates)
+        own = cursor is None
+        conn = get_db_connection() if own else None
+        cursor = conn.cursor() if own else cursor
+        try:
+            cursor.execute("UPDATE background_jobs SET progress = %s, updated_at = NOW() WHERE id = %s;",
+                           (json.dumps(self.progress, ensure_ascii=False), self.id))
+            if own:
+                conn.commit()
+        finally:
+            if own:
+                cursor.close()
+                conn.close()
+
+
+class JobWorker:
+    """进程内的后台任务 worker（单线程依次执行任务，多个进程可同时运行）"""
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # kind -> 下次检查周期任务的时间（monotonic）
+        self._periodic_due: Dict[str, float] = {}
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="job-worker", daemon=True)
+        self._thread.start()
+        logging.info(f"后台任务 worker 已启动: {self.worker_id}")
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def notify(self) -> None:
+        """有新任务提交时唤醒 worker，避免等待下一次轮询"""
+        self._wakeup.set()
+
+    def run_pending(self) -> int:
+        """在当前线程执行所有可领取的任务（脚本或测试中使用），返回执行的任务数"""
+        count = 0
+        for shard in job_databases():
+            with use_shard(shard):
+                while not self._stop.is_set():
+                    job = self._claim()
+                    if job is None:
+                        break
+                    self._execute(job)
+                    count += 1
+        return count
+
+    def run(self) -> None:
+        """持续轮询并执行任务，直到 stop() 被调用（独立 worker 进程在主线程中调用）"""
+        while not self._stop.is_set():
+            try:
+                self._enqueue_periodic()
+                self.run_pending()
+            except Exception as e:
+                logging.error(f"后台任务 worker 异常: {e}")
+            self._wakeup.wait(JOB_POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def _enqueue_periodic(self) -> None:
+        """到期的周期任务提交到主库（长时间运行的 API 进程和独立 worker 都会定期提交）"""
+        now = time.monotonic()
+        for kind, interval in _periodic.items():
+            if now < self._periodic_due.get(kind, 0):
+                continue
+            # 每个周期内检查若干次即可，提交由 dedupe_key 去重
+            self._periodic_due[kind] = now + max(interval / 10, JOB_POLL_INTERVAL)
+            try:
+                enqueue_periodic_job(kind, interval)
+            except Exception as e:
+                logging.warning(f"提交周期任务 {kind} 失败: {e}")
+
+    def _claim(self) -> Optional[Job]:
+        """领取一个排队中的任务，或心跳超时（worker 崩溃）的运行中任务。
+        心跳超时且已达到 JOB_MAX_ATTEMPTS 次的任务（如每次都使 worker 进程崩溃）在同一语句中标记为失败，不再领取"""
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            cursor.execute("""
+                WITH exhausted AS (
+                    UPDATE background_jobs
+                    SET status = 'failed', updated_at = NOW(), finished_at = NOW(),
+                        error = format('worker 心跳超时（进程可能已崩溃），已尝试 %%s 次', attempts)
+                    WHERE id IN (
+                        SELECT id FROM background_jobs
+                        WHERE status = 'running' AND updated_at < NOW() - make_interval(secs => %s)
+                          AND attempts >= %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id
+                )
+                UPDATE background_jobs
+                SET status = 'running', attempts = attempts + 1, worker = %s,
+                    started_at = COALESCE(started_at, NOW()), updated_at = NOW()
+                WHERE id = (
+                    SELECT id FROM background_jobs
+                    WHERE (status = 'queued' AND (run_after IS NULL OR run_after <= NOW()))
+                       OR (status = 'running' AND updated_at < NOW() - make_interval(secs => %s)
+                           AND attempts < %s)
+                    ORDER BY id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING id, kind, params, progress, attempts;
+            """, (JOB_STALE_SECONDS, JOB_MAX_ATTEMPTS, self.worker_id, JOB_STALE_SECONDS, JOB_MAX_ATTEMPTS))
+            row = cursor.fetchone()
+            conn.commit()
+            if not row:
+                return None
+            return Job(row["id"], row["kind"], row["params"], row["progress"], row["attempts"])
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None) -> None:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                UPDATE background_jobs
+                SET status = %s, error = %s, progress = %s, updated_at = NOW(),
+                    finished_at = CASE WHEN %s = 'queued' THEN NULL ELSE NOW() END,
+                    -- 失败重试按次数退避
+                    run_after = CASE WHEN %s = 'queued' THEN NOW() + make_interval(secs => attempts * %s) END,
+                    -- 重新排队的任务不参与去重，避免与后来提交的同 key 任务冲突
+                    dedupe_key = CASE WHEN %s = 'queued' THEN NULL ELSE dedupe_key END
+                WHERE id = %s;
+            """, (status, error, json.dumps(job.progress, ensure_ascii=False), status, status,
+                  JOB_RETRY_BACKOFF_SECONDS, status, job.id))
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _heartbeat(self, job: Job, done: threading.Event) -> None:
+        """长时间运行的步骤（如 VACUUM）期间定期刷新心跳，避免被其它 worker 误判为崩溃"""
+        while not done.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                conn = get_db_connection()
+                cursor = conn.cursor()
+                cursor.execute("UPDATE background_jobs SET updated_at = NOW() WHERE id = %s AND status = 'running';",
+                               (job.id,))
+                conn.commit()
+                cursor.close()
+                conn.close()
+            except Exception as e:
+                logging.warning(f"刷新任务 {job.id} 心跳失败: {e}")
+
+    def _execute(self, job: Job) -> None:
+        handler = _handlers.get(job.kind)
+        if handler is None:
+            self._finish(job, "failed", f"未注册的任务类型: {job.kind}")
+            return
+
+        done = threading.Event()
+        # 心跳线程沿用当前的分片上下文
+        heartbeat = threading.Thread(target=contextvars.copy_context().run, args=(self._heartbeat, job, done),
+                                     daemon=True)
+        heartbeat.start()
+        try:
+            result = handler(job)
+            if result:
+                job.progress.update(result)
+            self._finish(job, "done")
+            logging.info(f"后台任务 {job.kind}#{job.id} 完成")
+        except Exception as e:
+            logging.error(f"后台任务 {job.kind}#{job.id} 失败（第 {job.attempts} 次）: {e}")
+            # 未超过重试次数时重新排队，从已保存的进度继续
+            status = "failed" if job.attempts >= JOB_MAX_ATTEMPTS else "queued"
+            self._finish(job, status, str(e))
+        finally:
+            done.set()
+
+
+# 全局任务 worker 实例
+job_worker = JobWorker()
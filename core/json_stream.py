@@ -0,0 +1,216 @@
+"""
+JSON / JSONL 流式分块
+按文本片段增量扫描 JSON，不构造整个文档对象：
+- 能放进一个文档块的值作为一条记录；更大的数组/对象逐层展开为其元素/成员
+- 记录渲染为 "路径: 紧凑 JSON"（路径格式与 core.converters.convert_json 一致，如 items[3].name），
+  相邻记录按 max_chunk_size 装箱，块元数据记录首尾记录的路径 {"json_path": [首, 尾]}
+- 缓冲区只保存当前记录（最多约 max_chunk_size 字符加一个片段），内存占用与文件大小无关
+- JSONL（每行一个值，也允许换行分隔的多行 JSON）的第 i 个值路径为 [i]
+"""
+
+from __future__ import annotations
+
+import re
+import json
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+
+_NON_WS_RE = re.compile(r"\S")
+# 完整（或到缓冲区末尾仍未结束）的字符串，或一个括号
+_TOKEN_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*("?)|[\[\]{}]', re.S)
+# 字符串的剩余部分，group(1) 为结束引号
+_STRING_REST_RE = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*("?)', re.S)
+_SCALAR_END_RE = re.compile(r"[\s,\]}]")
+
+
+class _Reader:
+    """文本片段上的扫描缓冲区"""
+
+    def __init__(self, pieces: Iterable[str]):
+        self._pieces = iter(pieces)
+        self.buf = ""
+        self.pos = 0
+        # buf[0] 在整个文本中的位置（用于错误信息）
+        self.offset = 0
+
+    def fill(self) -> Optional[int]:
+        """读入下一个片段并丢弃 pos 之前已消费的文本，返回丢弃的字符数；没有更多片段时返回 None"""
+        for piece in self._pieces:
+            if piece:
+                shift = self.pos
+                self.buf = self.buf[shift:] + piece
+                self.offset += shift
+                self.pos = 0
+                return shift
+        return None
+
+    def error(self, message: str, at: Optional[int] = None) -> ValueError:
+        return ValueError(f"JSON 格式错误（第 {self.offset + (self.pos if at is None else at)} 个字符）: {message}")
+
+    def peek(self) -> Optional[str]:
+        """跳过空白，返回下一个字符（不消费）；文本结束时返回 None"""
+        while True:
+            m = _NON_WS_RE.search(self.buf, self.pos)
+            if m:
+                self.pos = m.start()
+                return self.buf[self.pos]
+            self.pos = len(self.buf)
+            if self.fill() is None:
+                return None
+
+    def scan(self, limit: Optional[int] = None) -> Optional[int]:
+        """从 pos 开始的值的结束位置（按需读入片段）；值超过 limit 个字符时返回 None（不消费）"""
+        start = i = self.pos
+        first = self.buf[start]
+        if first not in '"[{':
+            while True:
+                m = _SCALAR_END_RE.search(self.buf, i)
+                if m:
+                    return m.start()
+                i = len(self.buf)
+                shift = self.fill()
+                if shift is None:
+                    return i
+                start -= shift
+                i -= shift
+        depth = 0
+        in_string = first == '"'
+        if in_string:
+            i += 1
+        while True:
+            if in_string:
+                m = _STRING_REST_RE.match(self.buf, i)
+                i = m.end()
+                if m.group(1):
+                    in_string = False
+                    if depth == 0:
+                        end = i
+                        break
+                    continue
+            else:
+                # 整个字符串作为一个记号跳过，括号计数
+                m = _TOKEN_RE.search(self.buf, i)
+                if m:
+                    i = m.end()
+                    if m.group(1) is not None:
+                        # 字符串在缓冲区末尾未结束时，读入下一个片段后继续
+                        in_string = not m.group(1)
+                        if not in_string:
+                            continue
+                    elif m.group() in "[{":
+                        depth += 1
+                        continue
+                    else:
+                        depth -= 1
+                        if depth == 0:
+                            end = i
+                            break
+                        continue
+                else:
+                    i = len(self.buf)
+            if limit is not None and i - start > limit:
+                return None
+            shift = self.fill()
+            if shift is None:
+                raise self.error("文本意外结束", start)
+            start -= shift
+            i -= shift
+        if limit is not None and end - start > limit:
+            return None
+        return end
+
+    def take(self, end: int) -> Any:
+        """解析 pos 到 end 之间的值并消费"""
+        try:
+            value = json.loads(self.buf[self.pos:end])
+        except json.JSONDecodeError as e:
+            raise self.error(e.msg, self.pos + e.pos)
+        self.pos = end
+        return value
+
+    def expect(self, chars: str) -> str:
+        c = self.peek()
+        if c is None or c not in chars:
+            raise self.error(f"应为 {' 或 '.join(chars)}，实际为 {c!r}" if c else f"应为 {' 或 '.join(chars)}，文本已结束")
+        self.pos += 1
+        return c
+
+
+def _walk(reader: _Reader, path: str, limit: int) -> Iterator[Tuple[str, Any]]:
+    """产出 (路径, 值)：渲染后（"路径: 值"）放得下的值整体产出，过大的数组/对象逐个展开"""
+    c = reader.peek()
+    if c is None:
+        raise reader.error("文本意外结束")
+    end = reader.scan(max(limit - len(path) - 2, 0) if path else limit)
+    if end is not None or c not in "[{":
+        yield path, reader.take(end if end is not None else reader.scan())
+        return
+    reader.pos += 1
+    if c == "[":
+        index = 0
+        if reader.peek() == "]":
+            reader.pos += 1
+            yield path, []
+            return
+        while True:
+            yield from _walk(reader, f"{path}[{index}]", limit)
+            index += 1
+            if reader.expect(",]") == "]":
+                return
+    if reader.peek() == "}":
+        reader.pos += 1
+        yield path, {}
+        return
+    while True:
+        if reader.peek() != '"':
+            raise reader.error("对象的键必须是字符串")
+        key = reader.take(reader.scan())
+        reader.expect(":")
+        yield from _walk(reader, f"{path}.{key}" if path else str(key), limit)
+        if reader.expect(",}") == "}":
+            return
+
+
+def iter_json_records(pieces: Iterable[str], lines: bool = False, limit: int = 1000) -> Iterator[Tuple[str, Any]]:
+    """流式解析 JSON（lines=True 时为 JSONL），产出 (路径, 记录值)；不超过 limit 个字符的值作为一条记录"""
+    reader = _Reader(pieces)
+    index = 0
+    while reader.peek() is not None:
+        if index and not lines:
+            raise reader.error("顶层值之后存在多余内容（JSONL 文件请使用 .jsonl 扩展名）")
+        yield from _walk(reader, f"[{index}]" if lines else "", limit)
+        index += 1
+
+
+def _render(path: str, value: Any) -> str:
+    text = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    return f"{path}: {text}" if path else text
+
+
+def json_chunker(max_chunk_size: int = 1000,
+                 lines: bool = False) -> Callable[[Iterable[str]], Iterator[Tuple[str, Optional[dict]]]]:
+    """JSON 文本片段 → (文档块, {"json_path": [首, 尾]})，可作为 IngestPipeline 的 chunk_stream"""
+    def chunk_stream(pieces: Iterable[str]) -> Iterator[Tuple[str, Optional[dict]]]:
+        buf: List[str] = []
+        buf_len = 0
+        first = last = ""
+        for path, value in iter_json_records(pieces, lines=lines, limit=max_chunk_size):
+            text = _render(path, value)
+            if buf and buf_len + 1 + len(text) > max_chunk_size:
+                yield "\n".join(buf), {"json_path": [first, last]}
+                buf = []
+            if len(text) > max_chunk_size:
+                # 单条记录（如很长的字符串）超过上限时按字符切分
+                for i in range(0, len(text), max_chunk_size):
+                    yield text[i:i + max_chunk_size], {"json_path": [path, path]}
+                continue
+            if not buf:
+                first = path
+                buf_len = len(text)
+            else:
+                buf_len += 1 + len(text)
+            buf.append(text)
+            last = path
+        if buf:
+            yield "\n".join(buf), {"json_path": [first, last]}
+    return chunk_stream
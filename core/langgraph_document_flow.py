@@ -1,28 +1,90 @@
 """
 LangGraph 文档处理流程
 展示流程可控和步骤溯源的核心价值
+
+精简模式（LANGGRAPH_LEAN_STATE=true，默认）：
+- 文件内容、转换文本、分块与向量等大对象放在 payload_store 中，图状态只保存句柄
+- 文件内容在转换后、转换文本在分块后、向量在入库后立即释放，流程结束时释放全部对象
+- 不使用检查点（MemorySaver 会把每一步的完整状态保存在内存中），编译后的图在进程内复用
+完整模式（false）保持原行为：大对象随状态传递，每次处理创建新图并用 MemorySaver 记录检查点。
 """
 
-from typing import TypedDict, List, Dict, Any, Optional
+from typing import TypedDict, List, Dict, Any, Optional, Tuple, Union
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode
 from langgraph.checkpoint.memory import MemorySaver
+import os
+import uuid
 import logging
+import hashlib
+import threading
 from datetime import datetime
 
+from config.database import DEFAULT_COLLECTION
+
+
+# 是否使用精简模式（大对象不进入图状态与检查点）
+LANGGRAPH_LEAN_STATE = os.environ.get("LANGGRAPH_LEAN_STATE", "true").lower() == "true"
+
+
+class PayloadStore:
+    """图状态之外的大对象存储：每次处理对应一个句柄，状态中只保存句柄"""
+
+    def __init__(self):
+        self._items: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def create(self, **values: Any) -> str:
+        handle = uuid.uuid4().hex
+        with self._lock:
+            self._items[handle] = dict(values)
+        return handle
+
+    def get(self, handle: str, key: str, default: Any = None) -> Any:
+        with self._lock:
+            return self._items.get(handle, {}).get(key, default)
+
+    def set(self, handle: str, key: str, value: Any) -> None:
+        with self._lock:
+            self._items.setdefault(handle, {})[key] = value
+
+    def discard(self, handle: str, *keys: str) -> None:
+        """释放句柄下的部分对象；不指定 keys 时释放整个句柄"""
+        with self._lock:
+            if not keys:
+                self._items.pop(handle, None)
+                return
+            values = self._items.get(handle, {})
+            for key in keys:
+                values.pop(key, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+
+# 全局大对象存储
+payload_store = PayloadStore()
+
 # 定义状态结构
 class DocumentProcessingState(TypedDict):
     """文档处理流程的状态"""
-    # 输入
-    file_bytes: bytes
+    # 输入（文件内容，或后台任务写出的临时文件路径）
+    file_bytes: Union[bytes, str]
     filename: str
     file_type: str
+    collection: str
+    content_hash: str
+    byte_size: int
+    # 精简模式下大对象（file_bytes/raw_text/chunks/embeddings）在 payload_store 中的句柄
+    payload_handle: Optional[str]
     
     # 中间状态
     raw_text: Optional[str]
     chunks: List[str]
     embeddings: List[List[float]]
+    embedding_model: Optional[str]
     chunk_count: int
     
     # 流程控制
@@ -35,6 +97,31 @@ class DocumentProcessingState(TypedDict):
     final_result: Optional[Dict[str, Any]]
 
 
+def _payload(state: DocumentProcessingState, key: str) -> Any:
+    """读取大对象：精简模式从 payload_store 读取，否则从状态读取"""
+    handle = state.get("payload_handle")
+    if handle:
+        return payload_store.get(handle, key)
+    return state.get(key)
+
+
+def _keep(state: DocumentProcessingState, **values: Any) -> Dict[str, Any]:
+    """保存大对象，返回需要合并到状态中的部分（精简模式下为空）"""
+    handle = state.get("payload_handle")
+    if not handle:
+        return values
+    for key, value in values.items():
+        payload_store.set(handle, key, value)
+    return {}
+
+
+def _release(state: DocumentProcessingState, *keys: str) -> None:
+    """精简模式下释放后续步骤不再需要的大对象"""
+    handle = state.get("payload_handle")
+    if handle:
+        payload_store.discard(handle, *keys)
+
+
 def convert_document_node(state: DocumentProcessingState) -> DocumentProcessingState:
     """节点1: 文档转换"""
     step_info = {
@@ -45,13 +132,21 @@ def convert_document_node(state: DocumentProcessingState) -> DocumentProcessingS
     
     try:
         # 根据文件类型选择处理方式
+        file_bytes = _payload(state, "file_bytes")
         if state["file_type"] == "text":
-            # 对于文本文件，直接解码字节内容
-            raw_text = state["file_bytes"].decode("utf-8")
+            # 对于文本文件，直接解码字节内容（或读取磁盘路径）
+            if isinstance(file_bytes, str):
+                with open(file_bytes, encoding="utf-8", newline="") as f:
+                    raw_text = f.read()
+            else:
+                raw_text = file_bytes.decode("utf-8")
         else:
             # 对于其他文件类型，使用docling处理
             from core.document_ingest import export_to_text
-            raw_text = export_to_text(state["file_bytes"], state["filename"])
+            raw_text = export_to_text(file_bytes, state["filename"])
+        # 入库只需要内容哈希与大小（已在状态中），文件内容不再保留
+        del file_bytes
+        _release(state, "file_bytes")
         
         step_info.update({
             "status": "success",
@@ -59,8 +154,7 @@ def convert_document_node(state: DocumentProcessingState) -> DocumentProcessingS
         })
         
         return {
-            **state,
-            "raw_text": raw_text,
+            **_keep(state, raw_text=raw_text),
             "current_step": "convert_document",
             "step_history": state["step_history"] + [step_info]
         }
@@ -72,7 +166,6 @@ def convert_document_node(state: DocumentProcessingState) -> DocumentProcessingS
         })
         
         return {
-            **state,
             "current_step": "convert_document",
             "step_history": state["step_history"] + [step_info],
             "errors": state["errors"] + [f"文档转换失败: {str(e)}"],
@@ -85,7 +178,7 @@ def chunk_text_node(state: DocumentProcessingState) -> DocumentProcessingState:
     step_info = {
         "step": "chunk_text",
         "timestamp": datetime.now().isoformat(),
-        "input": {"text_length": len(state["raw_text"]) if state["raw_text"] else 0}
+        "input": {"text_length": len(_payload(state, "raw_text") or "")}
     }
     
     try:
@@ -93,10 +186,11 @@ def chunk_text_node(state: DocumentProcessingState) -> DocumentProcessingState:
         
         # 执行文本分块
         chunks = chunk_text_from_export(
-            state["raw_text"], 
+            _payload(state, "raw_text"), 
             max_tokens=800, 
             min_tokens=120  # 使用默认的最小token数
         )
+        _release(state, "raw_text")
         
         step_info.update({
             "status": "success",
@@ -107,8 +201,7 @@ def chunk_text_node(state: DocumentProcessingState) -> DocumentProcessingState:
         })
         
         return {
-            **state,
-            "chunks": chunks,
+            **_keep(state, chunks=chunks),
             "chunk_count": len(chunks),
             "current_step": "chunk_text",
             "step_history": state["step_history"] + [step_info]
@@ -121,7 +214,6 @@ def chunk_text_node(state: DocumentProcessingState) -> DocumentProcessingState:
         })
         
         return {
-            **state,
             "current_step": "chunk_text",
             "step_history": state["step_history"] + [step_info],
             "errors": state["errors"] + [f"文本分块失败: {str(e)}"],
@@ -138,26 +230,28 @@ def generate_embeddings_node(state: DocumentProcessingState) -> DocumentProcessi
     }
     
     try:
-        from core.model_client import get_global_model_client
+        from core.pipeline import PIPELINE_EMBED_BATCH
+        from core.vector_store import vector_store
         
-        # 生成向量嵌入
+        # 用当前检索模型分批生成向量嵌入，入库时直接使用，不再重复生成
+        chunks = _payload(state, "chunks")
+        model = vector_store.embedding_model
         embeddings = []
-        for i, chunk in enumerate(state["chunks"]):
-            embedding = get_global_model_client().embeddings(chunk)
-            embeddings.append(embedding)
+        for i in range(0, len(chunks), PIPELINE_EMBED_BATCH):
+            embeddings.extend(vector_store.embed_texts(chunks[i:i + PIPELINE_EMBED_BATCH], model=model))
             
             # 记录进度
-            if i % 10 == 0:
-                logging.info(f"生成嵌入进度: {i+1}/{len(state['chunks'])}")
+            logging.info(f"生成嵌入进度: {len(embeddings)}/{len(chunks)}")
         
         step_info.update({
             "status": "success",
-            "output": {"embedding_count": len(embeddings), "embedding_dim": len(embeddings[0]) if embeddings else 0}
+            "output": {"embedding_count": len(embeddings), "embedding_dim": len(embeddings[0]) if embeddings else 0,
+                       "embedding_model": model}
         })
         
         return {
-            **state,
-            "embeddings": embeddings,
+            **_keep(state, embeddings=embeddings),
+            "embedding_model": model,
             "current_step": "generate_embeddings",
             "step_history": state["step_history"] + [step_info]
         }
@@ -169,7 +263,6 @@ def generate_embeddings_node(state: DocumentProcessingState) -> DocumentProcessi
         })
         
         return {
-            **state,
             "current_step": "generate_embeddings",
             "step_history": state["step_history"] + [step_info],
             "errors": state["errors"] + [f"生成嵌入失败: {str(e)}"],
@@ -190,10 +283,16 @@ def store_chunks_node(state: DocumentProcessingState) -> DocumentProcessingState
         
         # 存储到向量数据库
         stored_count = vector_store.store_chunks(
-            state["chunks"], 
+            _payload(state, "chunks"), 
             state["filename"], 
-            file_type=state["file_type"]
+            file_type=state["file_type"],
+            collection=state["collection"],
+            content_hash=state["content_hash"],
+            byte_size=state["byte_size"],
+            embeddings=_payload(state, "embeddings"),
+            embedding_model=state["embedding_model"]
         )
+        _release(state, "chunks", "embeddings")
         
         step_info.update({
             "status": "success",
@@ -201,7 +300,6 @@ def store_chunks_node(state: DocumentProcessingState) -> DocumentProcessingState
         })
         
         return {
-            **state,
             "current_step": "store_chunks",
             "step_history": state["step_history"] + [step_info],
             "success": True,
@@ -220,7 +318,6 @@ def store_chunks_node(state: DocumentProcessingState) -> DocumentProcessingState
         })
         
         return {
-            **state,
             "current_step": "store_chunks",
             "step_history": state["step_history"] + [step_info],
             "errors": state["errors"] + [f"存储失败: {str(e)}"],
@@ -242,8 +339,8 @@ def should_continue(state: DocumentProcessingState) -> str:
         return END
 
 
-def create_document_processing_graph():
-    """创建文档处理流程图"""
+def create_document_processing_graph(checkpoint: bool = True):
+    """创建文档处理流程图；checkpoint=False 时不使用检查点"""
     
     # 创建状态图
     workflow = StateGraph(DocumentProcessingState)
@@ -288,26 +385,64 @@ def create_document_processing_graph():
     workflow.add_edge("store_chunks", END)
     
     # 编译图
+    if not checkpoint:
+        return workflow.compile()
     memory = MemorySaver()
     app = workflow.compile(checkpointer=memory)
     
     return app
 
 
-def process_document_with_trace(file_bytes: bytes, filename: str, file_type: str = "unknown") -> Dict[str, Any]:
-    """使用 LangGraph 处理文档，返回完整的执行轨迹"""
+_lean_graph = None
+_lean_graph_lock = threading.Lock()
+
+
+def _get_lean_graph():
+    """精简模式的图不保存任何状态，编译一次后复用"""
+    global _lean_graph
+    with _lean_graph_lock:
+        if _lean_graph is None:
+            _lean_graph = create_document_processing_graph(checkpoint=False)
+        return _lean_graph
+
+
+def _content_digest(content: Union[bytes, str]) -> Tuple[str, int]:
+    """内容（字节或路径）的 sha256 与大小"""
+    if isinstance(content, bytes):
+        return hashlib.sha256(content).hexdigest(), len(content)
+    digest = hashlib.sha256()
+    with open(content, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest(), os.path.getsize(content)
+
+
+def process_document_with_trace(file_bytes: Union[bytes, str], filename: str, file_type: str = "unknown",
+                                collection: str = DEFAULT_COLLECTION, lean: Optional[bool] = None,
+                                content_hash: Optional[str] = None, byte_size: Optional[int] = None) -> Dict[str, Any]:
+    """使用 LangGraph 处理文档，返回完整的执行轨迹；lean 默认取 LANGGRAPH_LEAN_STATE。
+    file_bytes 也可以是磁盘路径（转换节点从磁盘读取）；content_hash / byte_size 未给出时按内容计算"""
+    lean = LANGGRAPH_LEAN_STATE if lean is None else lean
+    if content_hash is None or byte_size is None:
+        content_hash, byte_size = _content_digest(file_bytes)
     
     # 创建图
-    app = create_document_processing_graph()
+    app = _get_lean_graph() if lean else create_document_processing_graph()
+    handle = payload_store.create(file_bytes=file_bytes) if lean else None
     
     # 初始状态
     initial_state = DocumentProcessingState(
-        file_bytes=file_bytes,
+        file_bytes=b"" if lean else file_bytes,
         filename=filename,
         file_type=file_type,
+        collection=collection,
+        content_hash=content_hash,
+        byte_size=byte_size,
+        payload_handle=handle,
         raw_text=None,
         chunks=[],
         embeddings=[],
+        embedding_model=None,
         chunk_count=0,
         current_step="",
         step_history=[],
@@ -318,6 +453,8 @@ def process_document_with_trace(file_bytes: bytes, filename: str, file_type: str
     
     # 执行流程
     config = {"configurable": {"thread_id": f"doc_{filename}_{datetime.now().timestamp()}"}}
+    # 本函数不再引用文件内容（精简模式下由 payload_store 持有，转换后释放）
+    del file_bytes
     
     try:
         # 运行流程
@@ -346,6 +483,9 @@ def process_document_with_trace(file_bytes: bytes, filename: str, file_type: str
                 "execution_time": datetime.now().isoformat()
             }
         }
+    finally:
+        if handle:
+            payload_store.discard(handle)
 
 
 # 使用示例
@@ -8,12 +8,15 @@ from langgraph.graph import StateGraph, END
 import logging
 from datetime import datetime
 
+from config.database import DEFAULT_COLLECTION
+
 # 定义查询处理状态
 class QueryProcessingState(TypedDict):
     """查询处理流程的状态"""
     # 输入
     user_query: str
     chat_history: List[Dict[str, str]]
+    collection: str
     
     # 中间状态
     rewritten_query: Optional[str]
@@ -91,10 +94,9 @@ def hybrid_retrieve_node(state: QueryProcessingState) -> QueryProcessingState:
     
     try:
         from core.vector_store import vector_store
-        from core.model_client import get_global_model_client
         
-        # 生成查询嵌入
-        query_embedding = get_global_model_client().embeddings(state["rewritten_query"])
+        # 生成查询嵌入（使用与检索列一致的向量模型）
+        query_embedding = vector_store.embed_query(state["rewritten_query"])
         
         # 执行混合检索
         fused_results, has_strong_vec = vector_store.hybrid_search(
@@ -102,7 +104,8 @@ def hybrid_retrieve_node(state: QueryProcessingState) -> QueryProcessingState:
             query_embedding,
             top_k=10,
             alpha=0.6,
-            relevance_threshold=0.4
+            relevance_threshold=0.4,
+            collection=state["collection"]
         )
         
         step_info.update({
@@ -323,7 +326,8 @@ def create_query_processing_graph():
     return app
 
 
-def process_query_with_trace(user_query: str, chat_history: List[Dict[str, str]] = None) -> Dict[str, Any]:
+def process_query_with_trace(user_query: str, chat_history: List[Dict[str, str]] = None,
+                             collection: str = DEFAULT_COLLECTION) -> Dict[str, Any]:
     """使用 LangGraph 处理查询，返回完整的执行轨迹"""
     
     if chat_history is None:
@@ -336,6 +340,7 @@ def process_query_with_trace(user_query: str, chat_history: List[Dict[str, str]]
     initial_state = QueryProcessingState(
         user_query=user_query,
         chat_history=chat_history,
+        collection=collection,
         rewritten_query=None,
         retrieved_chunks=[],
         filtered_chunks=[],
@@ -0,0 +1,218 @@
+"""
+文档删除与存储维护的后台任务
+- delete_documents：按 id 区间分批删除文档块，每批单独提交并记录进度，崩溃后从断点继续
+- purge_chunks：以 TRUNCATE 清空集合或全部数据
+- vacuum_collection：删除完成后对分区 VACUUM (ANALYZE)，死元组比例过高时并发重建 HNSW/GIN 索引
+- gc_sweep（启动时及每 GC_SWEEP_INTERVAL_SECONDS 秒提交）：回收被替换的旧版本、超时未完成的 pending 版本、丢失了删除任务的 deleting 版本，以及已结束入库任务遗留的上传文件和超过保留期的 LangGraph 执行轨迹
+分片模式下 delete_documents / vacuum_collection 提交在数据所在分片上执行，purge_chunks / gc_sweep 在主库上提交并遍历各分片。
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+from psycopg2 import sql
+
+from config.database import (
+    get_db_connection, collection_partition_name, retire_documents, delete_documents, clear_all_chunks,
+    data_shards, use_shard, purge_expired_traces,
+)
+from core.jobs import Job, enqueue_job, register_job_handler, register_periodic_job
+
+
+DELETE_BATCH_SIZE = int(os.environ.get("DELETE_BATCH_SIZE", "5000"))
+# 每批删除之间的停顿（毫秒），给在线查询与 WAL 复制让出资源
+DELETE_BATCH_PAUSE_MS = int(os.environ.get("DELETE_BATCH_PAUSE_MS", "50"))
+# VACUUM 前死元组占比超过该值时并发重建分区上的 HNSW/GIN 索引
+REINDEX_DEAD_RATIO = float(os.environ.get("REINDEX_DEAD_RATIO", "0.2"))
+# 超过该小时数仍未完成的 pending 版本视为写入失败的残留
+GC_STALE_PENDING_HOURS = int(os.environ.get("GC_STALE_PENDING_HOURS", "24"))
+# gc_sweep 由 worker 定期提交的间隔（秒，0 表示只在启动时提交一次）
+GC_SWEEP_INTERVAL_SECONDS = int(os.environ.get("GC_SWEEP_INTERVAL_SECONDS", "3600"))
+
+
+def schedule_document_deletion(cursor, document_ids: List[int]) -> List[int]:
+    """在调用方事务内把文档版本标记为 deleting 并按集合提交后台删除任务，返回任务 id 列表"""
+    if not document_ids:
+        return []
+    cursor.execute("""
+        SELECT collection, array_agg(id ORDER BY id), COALESCE(SUM(chunk_count), 0)
+        FROM documents WHERE id = ANY(%s)
+        GROUP BY collection;
+    """, (list(document_ids),))
+    job_ids = []
+    for collection, ids, chunk_total in cursor.fetchall():
+        retired = retire_documents(cursor, ids)
+        if not retired:
+            continue
+        job_ids.append(enqueue_job("delete_documents", {
+            "collection": collection,
+            "document_ids": retired,
+            "estimated_chunks": int(chunk_total),
+        }, cursor=cursor))
+    return job_ids
+
+
+def schedule_purge(collection: Optional[str] = None) -> int:
+    """提交清空任务（指定 collection 时只清空该集合）"""
+    key = f"purge:{collection or '*'}"
+    return enqueue_job("purge_chunks", {"collection": collection}, dedupe_key=key)
+
+
+def schedule_vacuum(collection: str, cursor=None) -> Optional[int]:
+    """提交分区 VACUUM 任务；同一集合已有排队中的 VACUUM 时不重复提交"""
+    return enqueue_job("vacuum_collection", {"collection": collection}, cursor=cursor,
+                       dedupe_key=f"vacuum:{collection}")
+
+
+@register_job_handler("delete_documents")
+def _delete_documents_job(job: Job) -> Dict[str, Any]:
+    collection = job.params["collection"]
+    document_ids = job.params["document_ids"]
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    try:
+        if "max_id" not in job.progress:
+            # 首次执行：确定待删除 chunk 的 id 区间
+            cursor.execute("""
+                SELECT MIN(id), MAX(id) FROM document_chunks
+                WHERE collection = %s AND document_id = ANY(%s);
+            """, (collection, document_ids))
+            min_id, max_id = cursor.fetchone()
+            job.save_progress(cursor, next_id=min_id or 0, max_id=max_id if max_id is not None else -1,
+                              deleted=0, total=job.params.get("estimated_chunks"))
+            conn.commit()
+
+        # 按 id 区间分批删除，删除与进度在同一事务提交，重试时从 next_id 继续
+        while job.progress["next_id"] <= job.progress["max_id"]:
+            low = job.progress["next_id"]
+            high = low + DELETE_BATCH_SIZE
+            cursor.execute("""
+                DELETE FROM document_chunks
+                WHERE collection = %s AND id >= %s AND id < %s AND document_id = ANY(%s);
+            """, (collection, low, high, document_ids))
+            job.save_progress(cursor, next_id=high, deleted=job.progress["deleted"] + cursor.rowcount)
+            conn.commit()
+            if DELETE_BATCH_PAUSE_MS > 0:
+                time.sleep(DELETE_BATCH_PAUSE_MS / 1000)
+
+        # 清理残留 chunk 与文档记录
+        job.progress["deleted"] += delete_documents(cursor, document_ids, collection=collection)
+        schedule_vacuum(collection, cursor=cursor)
+        job.save_progress(cursor, phase="done")
+        conn.commit()
+        logging.info(f"集合 {collection} 删除 {len(document_ids)} 个文档版本，共 {job.progress['deleted']} 个文档块")
+        return {"deleted": job.progress["deleted"]}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@register_job_handler("purge_chunks")
+def _purge_chunks_job(job: Job) -> Dict[str, Any]:
+    collection = job.params.get("collection")
+    clear_all_chunks(collection)
+    return {"purged": collection or "*"}
+
+
+@register_job_handler("vacuum_collection")
+def _vacuum_collection_job(job: Job) -> Dict[str, Any]:
+    collection = job.params["collection"]
+    partition = collection_partition_name(collection)
+    conn = get_db_connection()
+    # VACUUM 与 REINDEX CONCURRENTLY 不能在事务块内执行
+    conn.autocommit = True
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("""
+            SELECT n_live_tup, n_dead_tup FROM pg_stat_user_tables WHERE relname = %s;
+        """, (partition,))
+        row = cursor.fetchone()
+        if row is None:
+            return {"skipped": "分区不存在"}
+        live, dead = row
+        dead_ratio = dead / max(live + dead, 1)
+
+        cursor.execute(sql.SQL("VACUUM (ANALYZE) {};").format(sql.Identifier(partition)))
+
+        reindexed = []
+        if dead_ratio >= REINDEX_DEAD_RATIO:
+            # 图索引与倒排索引不会因 VACUUM 收缩，删除比例较高时并发重建，期间读写不受阻塞
+            cursor.execute("""
+                SELECT i.relname
+                FROM pg_index x
+                JOIN pg_class t ON t.oid = x.indrelid
+                JOIN pg_class i ON i.oid = x.indexrelid
+                JOIN pg_am am ON am.oid = i.relam
+                WHERE t.relname = %s AND am.amname IN ('hnsw', 'gin');
+            """, (partition,))
+            for (index_name,) in cursor.fetchall():
+                cursor.execute(sql.SQL("REINDEX INDEX CONCURRENTLY {};").format(sql.Identifier(index_name)))
+                reindexed.append(index_name)
+        logging.info(f"分区 {partition} VACUUM 完成，死元组比例 {dead_ratio:.1%}，重建索引: {reindexed or '无'}")
+        return {"dead_ratio": round(dead_ratio, 4), "reindexed": reindexed}
+    finally:
+        cursor.close()
+        conn.close()
+
+
+register_periodic_job("gc_sweep", GC_SWEEP_INTERVAL_SECONDS)
+
+
+@register_job_handler("gc_sweep")
+def _gc_sweep_job(job: Job) -> Dict[str, Any]:
+    from core.ingestion import delete_job_blobs
+
+    scheduled: Dict[str, List[int]] = {}
+    for shard in data_shards():
+        with use_shard(shard):
+            scheduled[str(shard) if shard is not None else "primary"] = _sweep_current_database()
+    # 重试耗尽而失败的入库任务遗留的上传文件；执行轨迹保存在主库
+    return {"scheduled_jobs": scheduled, "deleted_blobs": delete_job_blobs(),
+            "deleted_traces": purge_expired_traces()}
+
+
+def _sweep_current_database() -> List[int]:
+    """在当前数据库（主库或分片）上提交旧版本的删除任务，返回任务 id"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("""
+            SELECT id FROM documents
+            WHERE status = 'superseded'
+               OR (status = 'pending' AND created_at < NOW() - make_interval(hours => %s));
+        """, (GC_STALE_PENDING_HOURS,))
+        ids = [r[0] for r in cursor.fetchall()]
+        job_ids = schedule_document_deletion(cursor, ids)
+
+        # deleting 状态但没有进行中删除任务的版本（任务重试耗尽等），重新提交删除
+        cursor.execute("""
+            SELECT collection, array_agg(id ORDER BY id) FROM documents d
+            WHERE status = 'deleting' AND NOT EXISTS (
+                SELECT 1 FROM background_jobs j
+                WHERE j.kind = 'delete_documents' AND j.status IN ('queued', 'running')
+                  AND j.params->'document_ids' @> to_jsonb(d.id)
+            )
+            GROUP BY collection;
+        """)
+        for collection, orphaned in cursor.fetchall():
+            job_ids.append(enqueue_job("delete_documents", {
+                "collection": collection, "document_ids": orphaned,
+            }, cursor=cursor))
+        conn.commit()
+        return job_ids
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
@@ -0,0 +1,55 @@
+"""
+游标分页工具：把排序键编码为不透明字符串，供 keyset 分页使用
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """把排序键（如 (chunk_index, id) 或 (updated_at, id)）编码为 URL 安全的游标"""
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    """解码游标，返回排序键列表；格式不合法时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise ValueError("游标格式不合法")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("游标格式不合法")
+    return values
+
+
+def decode_int_cursor(cursor: Optional[str], size: int = 2) -> Optional[tuple]:
+    """解码全部由整数组成的游标（如 (chunk_index, id)），cursor 为空时返回 None"""
+    if not cursor:
+        return None
+    values = decode_cursor(cursor, size)
+    if not all(isinstance(v, int) for v in values):
+        raise ValueError("游标格式不合法")
+    return tuple(values)
+
+
+def decode_time_cursor(cursor: Optional[str]) -> Optional[tuple]:
+    """解码 (时间, id) 形式的游标，cursor 为空时返回 None"""
+    if not cursor:
+        return None
+    ts, key = decode_cursor(cursor, 2)
+    try:
+        return datetime.fromisoformat(ts), key
+    except (TypeError, ValueError):
+        raise ValueError("游标格式不合法")
+
+
+def next_cursor(items: List[dict], limit: int, *keys: str) -> Optional[str]:
+    """当前页已满时，用最后一条记录的排序键生成下一页游标"""
+    if len(items) < limit or not items:
+        return None
+    last = items[-1]
+    return encode_cursor([last[k] for k in keys])
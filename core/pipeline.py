@@ -0,0 +1,315 @@
+"""
+流式入库流水线
+解析 → 分块 → 生成向量 → COPY 四个阶段各自在独立线程中运行，阶段之间用有界队列衔接：
+- 解析按段（如 PDF 的页）产出文本，分块阶段在后续页面仍在解析时就开始切块
+- 分块按 PIPELINE_EMBED_BATCH 个一批送去生成向量，上一批向量 COPY 入库的同时下一批在生成
+- 队列容量有限，任一阶段变慢时上游自动等待，内存占用与文档大小无关，总耗时趋近最慢的阶段
+文档块写入 pending 版本并按批提交，全部写完后在一个事务内切换为 active（与 store_chunks 的版本语义一致）。
+与上一版本内容相同的块不重新生成向量，在数据库内直接复制。
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import json
+import queue
+import logging
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from psycopg2 import sql
+
+from config.database import (
+    get_db_connection, ensure_collection, create_document_version, activate_document, get_embedding_settings,
+    use_shard, validate_collection_name, chunk_hash, copy_document_chunks, DEFAULT_COLLECTION,
+)
+from core.bulk_import import _copy_escape
+from core.chunking import iter_export_chunks
+
+
+# 每批生成向量（也是每次 COPY）的文档块数
+PIPELINE_EMBED_BATCH = int(os.environ.get("PIPELINE_EMBED_BATCH", "32"))
+# 阶段之间队列的容量（段数/批数）
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "4"))
+
+# 流式分块引擎：输入文本片段，逐块产出（如 core.chunking.iter_export_chunks）
+ChunkEngine = Callable[[Iterable[str]], Iterable[str]]
+# 文本段：纯文本，或 (文本, 页码)（按页产出时文档块会记录页码范围）
+Segment = Union[str, Tuple[str, int]]
+# 分块结果：(文档块, 元数据)
+Chunk = Tuple[str, Optional[dict]]
+
+_END = object()
+
+
+class _Aborted(Exception):
+    """其它阶段失败，本阶段提前退出"""
+
+
+def _page_metadata(first: Optional[int], last: Optional[int]) -> Optional[dict]:
+    if first is None:
+        return None
+    return {"pages": [first, last]}
+
+
+class _PageLocator:
+    """在已读入的原文中依次定位文档块，估算其起止页：文档块的各个词按顺序在原文中查找
+    （分块只会合并空白、去掉标记，词本身都是原文的子串）。
+    只记录当前段内的偏移，已完全定位过的段随即丢弃，不复制剩余文本"""
+
+    def __init__(self):
+        # [(段文本, 页码)]，第一个为当前段
+        self._segments: Deque[Tuple[str, Optional[int]]] = deque()
+        self._pos = 0
+
+    def feed(self, text: str, page: Optional[int]) -> None:
+        self._segments.append((text, page))
+
+    def _find(self, word: str) -> int:
+        """从当前位置起查找 word，找到时丢弃之前的段并返回其在当前段中的位置，找不到返回 -1（不移动）"""
+        for k, (text, _) in enumerate(self._segments):
+            i = text.find(word, self._pos if k == 0 else 0)
+            if i >= 0:
+                for _ in range(k):
+                    self._segments.popleft()
+                return i
+        return -1
+
+    def locate(self, chunk: str) -> Optional[dict]:
+        first = last = None
+        for word in chunk.split():
+            i = self._find(word)
+            if i < 0:
+                continue
+            self._pos = i + len(word)
+            last = self._segments[0][1]
+            if first is None:
+                first = last
+        if first is None:
+            return None
+        return _page_metadata(first, last)
+
+
+def page_chunker(engine: ChunkEngine, joiner: str = "\n") -> Callable[[Iterable[Segment]], Iterator[Chunk]]:
+    """把流式分块引擎（core.chunking 中接受文本片段迭代器的生成器）包装为按段分块：
+    各段以 joiner 连接后直接送入引擎，结果与 engine([joiner.join(各段文本)]) 完全相同。
+    段带页码时（由第一段决定），按文档块在原文中的位置记录其起止页；不带页码时不做定位。
+    """
+    def chunk_stream(segments: Iterable[Segment]) -> Iterator[Chunk]:
+        locator = _PageLocator()
+        paged = False
+
+        def pieces() -> Iterator[str]:
+            nonlocal paged
+            for i, segment in enumerate(segments):
+                text, page = segment if isinstance(segment, tuple) else (segment, None)
+                if i == 0:
+                    paged = page is not None
+                if i:
+                    yield joiner
+                if paged:
+                    locator.feed(text, page)
+                yield text
+
+        for chunk in engine(pieces()):
+            yield chunk, locator.locate(chunk) if paged else None
+    return chunk_stream
+
+
+class IngestPipeline:
+    """单个文档的流式入库"""
+
+    def __init__(self, file_name: str, file_type: str = "unknown", collection: str = DEFAULT_COLLECTION,
+                 chunk_stream: Optional[Callable[[Iterable[Segment]], Iterator[Chunk]]] = None,
+                 embed_batch: int = PIPELINE_EMBED_BATCH, queue_size: int = PIPELINE_QUEUE_SIZE):
+        self.file_name = file_name
+        self.file_type = file_type
+        self.collection = collection
+        self.chunk_stream = chunk_stream or page_chunker(iter_export_chunks)
+        self.embed_batch = max(1, embed_batch)
+        self.queue_size = max(1, queue_size)
+        self._failed = threading.Event()
+        self._errors: List[BaseException] = []
+
+    # ---- 队列操作（其它阶段失败时不会永久阻塞） ----
+
+    def _put(self, q: queue.Queue, item) -> None:
+        while True:
+            if self._failed.is_set():
+                raise _Aborted()
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q: queue.Queue):
+        while True:
+            if self._failed.is_set():
+                raise _Aborted()
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+    def _iter(self, q: queue.Queue) -> Iterator:
+        while True:
+            item = self._get(q)
+            if item is _END:
+                return
+            yield item
+
+    def _stage(self, target: Callable[[], None], name: str) -> threading.Thread:
+        def run():
+            try:
+                target()
+            except _Aborted:
+                pass
+            except BaseException as e:
+                self._errors.append(e)
+                self._failed.set()
+        thread = threading.Thread(target=run, name=f"ingest-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    # ---- 执行 ----
+
+    def run(self, segments: Iterable[Segment], content_hash: Optional[str] = None,
+            byte_size: Optional[int] = None) -> int:
+        """消费文本段并入库，返回写入的文档块数"""
+        from core.vector_store import vector_store
+
+        self.collection = validate_collection_name(self.collection)
+        settings = get_embedding_settings()
+        columns = [settings["active_column"]]
+        models = [settings["active_model"]]
+        if settings["target_column"]:
+            # 向量模型迁移期间同时生成目标列的向量
+            columns.append(settings["target_column"])
+            models.append(settings["target_model"])
+        texts: queue.Queue = queue.Queue(self.queue_size)
+        batches: queue.Queue = queue.Queue(self.queue_size)
+        embedded: queue.Queue = queue.Queue(self.queue_size)
+
+        def convert():
+            for segment in segments:
+                if segment:
+                    self._put(texts, segment)
+            self._put(texts, _END)
+
+        def chunk():
+            batch: List[Chunk] = []
+            for piece in self.chunk_stream(self._iter(texts)):
+                batch.append(piece)
+                if len(batch) >= self.embed_batch:
+                    self._put(batches, batch)
+                    batch = []
+            if batch:
+                self._put(batches, batch)
+            self._put(batches, _END)
+
+        def embed():
+            for batch in self._iter(batches):
+                hashes = [chunk_hash(c) for c, _ in batch]
+                fresh = [c for (c, _), h in zip(batch, hashes) if h not in previous]
+                vectors = [vector_store.embed_texts(fresh, model=model) for model in models]
+                self._put(embedded, (batch, hashes, vectors))
+            self._put(embedded, _END)
+
+        # 数据库操作在调用线程中执行，沿用调用方的分片上下文
+        with use_shard(vector_store.shard_for(self.collection, self.file_name)):
+            ensure_collection(self.collection)
+            # 上一版本的块哈希在生成向量前读取，命中的块不再生成向量
+            previous = vector_store.previous_chunk_ids(self.file_name, self.collection, columns)
+            threads = [self._stage(convert, "convert"), self._stage(chunk, "chunk"), self._stage(embed, "embed")]
+            try:
+                return self._store(embedded, columns, previous, content_hash, byte_size)
+            except _Aborted:
+                raise self._errors[0]
+            except BaseException:
+                self._failed.set()
+                raise
+            finally:
+                for thread in threads:
+                    thread.join()
+
+    def _store(self, embedded: queue.Queue, columns: List[str], previous: Dict[str, int],
+               content_hash: Optional[str], byte_size: Optional[int]) -> int:
+        from core.vector_store import vector_store
+
+        copy_sql = sql.SQL("COPY document_chunks ({}) FROM STDIN").format(sql.SQL(", ").join(map(sql.Identifier, [
+            "collection", "document_id", "content", "file_name", "chunk_index", "file_type", "chunk_hash", "metadata",
+            *columns
+        ])))
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        document_id = None
+        chunk_count = char_count = reused_count = 0
+        try:
+            document_id = create_document_version(cursor, self.collection, self.file_name, self.file_type,
+                                                  content_hash=content_hash, byte_size=byte_size)
+            conn.commit()
+
+            # pending 版本对检索不可见，每批单独提交，不持有长事务
+            for batch, hashes, vectors in self._iter(embedded):
+                buf = io.StringIO()
+                reused: List[Tuple[int, int, Optional[dict]]] = []
+                fresh = 0
+                for offset, ((content, metadata), digest) in enumerate(zip(batch, hashes)):
+                    if digest in previous:
+                        reused.append((previous[digest], chunk_count + offset, metadata))
+                        continue
+                    fields = [self.collection, document_id, content, self.file_name, chunk_count + offset,
+                              self.file_type, digest, json.dumps(metadata, ensure_ascii=False) if metadata else None]
+                    fields += ["[" + ",".join(map(str, vecs[fresh])) + "]" for vecs in vectors]
+                    buf.write("\t".join(_copy_escape(v) for v in fields) + "\n")
+                    fresh += 1
+                if fresh:
+                    buf.seek(0)
+                    cursor.copy_expert(copy_sql.as_string(conn), buf)
+                if copy_document_chunks(cursor, self.collection, document_id, self.file_type, reused,
+                                        columns) != len(reused):
+                    raise RuntimeError(f"文件 {self.file_name} 的上一版本在入库期间被替换，请重试")
+                conn.commit()
+                reused_count += len(reused)
+                chunk_count += len(batch)
+                char_count += sum(len(c) for c, _ in batch)
+
+            if chunk_count == 0:
+                cursor.execute("DELETE FROM documents WHERE id = %s AND status = 'pending';", (document_id,))
+                conn.commit()
+                return 0
+            superseded = activate_document(cursor, document_id, chunk_count, char_count)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            if document_id is not None and chunk_count:
+                # 已提交的部分文档块随未生效的版本一起回收
+                vector_store.schedule_gc([document_id])
+            elif document_id is not None:
+                cursor.execute("DELETE FROM documents WHERE id = %s AND status = 'pending';", (document_id,))
+                conn.commit()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+        logging.info(f"流式入库 {chunk_count} 个文档块（复用 {reused_count} 个未变化的块），文件: {self.file_name}，"
+                     f"集合: {self.collection}，document_id: {document_id}")
+        vector_store.schedule_gc(superseded)
+        return chunk_count
+
+
+def ingest_stream(segments: Iterable[Segment], file_name: str, file_type: str = "unknown",
+                  collection: str = DEFAULT_COLLECTION, chunk_engine: Optional[ChunkEngine] = None,
+                  content_hash: Optional[str] = None, byte_size: Optional[int] = None,
+                  chunk_stream: Optional[Callable[[Iterable[Segment]], Iterator[Chunk]]] = None) -> int:
+    """流式入库一个文档：segments 为按顺序产出的文本段（或 (文本, 页码)），chunk_engine 为流式分块引擎（默认 Docling 导出文本的分块）；
+    chunk_stream 直接消费文本段并产出 (文档块, 元数据)（如 core.json_stream.json_chunker），优先于 chunk_engine"""
+    if chunk_stream is None and chunk_engine:
+        chunk_stream = page_chunker(chunk_engine)
+    pipeline = IngestPipeline(file_name, file_type, collection, chunk_stream=chunk_stream)
+    return pipeline.run(segments, content_hash=content_hash, byte_size=byte_size)
@@ -0,0 +1,147 @@
+"""
+分片存储模式
+文档按 (collection, 文件名) 的稳定哈希分配到 SHARD_DSNS 中的某个分片，同一文件的所有版本与文档块都在同一分片，
+版本切换、删除等写事务因此只涉及单个分片。检索并发扇出到全部分片，各分片的 top-k 合并后复用 VectorStore 的融合逻辑；
+单个分片超时或失败时返回其余分片的部分结果。
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import hashlib
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Dict, List, Optional
+
+from config.database import SHARD_DSNS, DEFAULT_COLLECTION, use_shard
+from core.vector_store import VectorStore
+
+
+# 扇出查询等待各分片结果的总时长（毫秒），超过后舍弃未返回的分片
+SHARD_QUERY_TIMEOUT_MS = int(os.environ.get("SHARD_QUERY_TIMEOUT_MS", "2000"))
+
+
+class ShardedVectorStore(VectorStore):
+    """按文件路由写入、扇出检索的向量存储"""
+
+    def __init__(self, shard_count: Optional[int] = None):
+        super().__init__()
+        self.shard_count = shard_count or len(SHARD_DSNS)
+        if self.shard_count <= 0:
+            raise ValueError("分片模式需要配置 SHARD_DSNS")
+        # 每个分片同时可能有向量与词法两路查询
+        self._executor = ThreadPoolExecutor(max_workers=self.shard_count * 4, thread_name_prefix="shard-query")
+
+    def shard_for(self, collection: str, file_name: str) -> int:
+        """文件所在的分片：对 (collection, 文件名) 做稳定哈希（不依赖进程的 hash 随机化）"""
+        digest = hashlib.blake2b(f"{collection}/{file_name}".encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") % self.shard_count
+
+    # ---- 单分片路由 ----
+
+    def store_chunks(self, chunks: List[str], file_name: str, file_type: str = "unknown",
+                     collection: str = DEFAULT_COLLECTION, content_hash: Optional[str] = None,
+                     byte_size: Optional[int] = None, embeddings: Optional[List[List[float]]] = None,
+                     embedding_model: Optional[str] = None) -> int:
+        with use_shard(self.shard_for(collection, file_name)):
+            return super().store_chunks(chunks, file_name, file_type, collection=collection,
+                                        content_hash=content_hash, byte_size=byte_size,
+                                        embeddings=embeddings, embedding_model=embedding_model)
+
+    def unchanged_document(self, file_name: str, content_hash: str,
+                           collection: str = DEFAULT_COLLECTION) -> Optional[int]:
+        with use_shard(self.shard_for(collection, file_name)):
+            return super().unchanged_document(file_name, content_hash, collection=collection)
+
+    def delete_file_chunks(self, file_name: str, collection: str = DEFAULT_COLLECTION) -> Optional[int]:
+        with use_shard(self.shard_for(collection, file_name)):
+            return super().delete_file_chunks(file_name, collection=collection)
+
+    def _list_file_chunks(self, file_name: str, collection: str, *args, **kwargs) -> List[Dict]:
+        with use_shard(self.shard_for(collection, file_name)):
+            return super()._list_file_chunks(file_name, collection, *args, **kwargs)
+
+    def get_chunk_count_by_file(self, file_name: str, collection: str = DEFAULT_COLLECTION) -> int:
+        with use_shard(self.shard_for(collection, file_name)):
+            return super().get_chunk_count_by_file(file_name, collection=collection)
+
+    # ---- 扇出查询 ----
+
+    def _run_on_shard(self, shard: int, func: Callable, *args, **kwargs) -> List[Dict]:
+        with use_shard(shard):
+            rows = func(self, *args, **kwargs)
+        for row in rows:
+            row["shard"] = shard
+        return rows
+
+    def _submit(self, func: Callable, *args, **kwargs) -> Dict[int, Future]:
+        """把 VectorStore 的单库查询方法提交到每个分片并发执行"""
+        return {
+            shard: self._executor.submit(self._run_on_shard, shard, func, *args, **kwargs)
+            for shard in range(self.shard_count)
+        }
+
+    def _collect(self, futures: Dict[int, Future], label: str, deadline: float) -> List[Dict]:
+        """在截止时间前收集各分片结果；超时或失败的分片被跳过，全部失败时抛出异常"""
+        rows: List[Dict] = []
+        failed: List[int] = []
+        for shard, future in futures.items():
+            try:
+                rows.extend(future.result(timeout=max(0.0, deadline - time.monotonic())))
+            except FutureTimeout:
+                future.cancel()
+                failed.append(shard)
+            except Exception as e:
+                logging.error(f"{label}: 分片 {shard} 查询失败: {e}")
+                failed.append(shard)
+        if failed:
+            if len(failed) == len(futures):
+                raise RuntimeError(f"{label}: 所有分片均超时或失败")
+            logging.warning(f"{label}: 分片 {failed} 超时或失败，返回其余 {len(futures) - len(failed)} 个分片的部分结果")
+        return rows
+
+    def _deadline(self) -> float:
+        return time.monotonic() + SHARD_QUERY_TIMEOUT_MS / 1000
+
+    @staticmethod
+    def _top_vector(rows: List[Dict], k: int) -> List[Dict]:
+        return sorted(rows, key=lambda r: float(r.get("distance") if r.get("distance") is not None else 2.0))[:k]
+
+    @staticmethod
+    def _top_lexical(rows: List[Dict], k: int) -> List[Dict]:
+        if rows and "sim" in rows[0]:
+            rows = sorted(rows, key=lambda r: float(r.get("sim") or 0.0), reverse=True)
+        return rows[:k]
+
+    def search_similar(self, query_embedding: List[float], top_k: int = 3,
+                       collection: str = DEFAULT_COLLECTION) -> List[Dict]:
+        futures = self._submit(VectorStore.search_similar, query_embedding, top_k, collection=collection)
+        return self._top_vector(self._collect(futures, "向量检索", self._deadline()), top_k)
+
+    def search_lexical_trgm(self, query: str, limit: int = 50,
+                            collection: str = DEFAULT_COLLECTION) -> List[Dict]:
+        futures = self._submit(VectorStore.search_lexical_trgm, query, limit, collection=collection)
+        return self._top_lexical(self._collect(futures, "词法检索", self._deadline()), limit)
+
+    def hybrid_search(self, query: str, query_embedding: List[float], top_k: int = 3,
+                      alpha: float = 0.6, relevance_threshold: float | None = None,
+                      collection: str = DEFAULT_COLLECTION) -> tuple[List[Dict], bool]:
+        """向量与词法两路查询同时扇出到全部分片，合并各分片 top-k 后融合"""
+        vec_k, lex_k = max(10, top_k), max(20, top_k * 3)
+        deadline = self._deadline()
+        vec_futures = self._submit(VectorStore.search_similar, query_embedding, vec_k, collection=collection)
+        lex_futures = self._submit(VectorStore.search_lexical_trgm, query, lex_k, collection=collection)
+        vec = self._top_vector(self._collect(vec_futures, "向量检索", deadline), vec_k)
+        lex = self._top_lexical(self._collect(lex_futures, "词法检索", deadline), lex_k)
+        return self._fuse(vec, lex, alpha, relevance_threshold)
+
+    def get_all_chunks(self, collection: Optional[str] = None) -> List[Dict]:
+        futures = self._submit(VectorStore.get_all_chunks, collection=collection)
+        return self._collect(futures, "获取全部文档块", self._deadline())
+
+    def get_file_list(self, collection: str = DEFAULT_COLLECTION) -> List[Dict]:
+        futures = self._submit(VectorStore.get_file_list, collection=collection)
+        files = self._collect(futures, "获取文件列表", self._deadline())
+        files.sort(key=lambda f: f.get("last_upload") or f.get("first_upload"), reverse=True)
+        return files
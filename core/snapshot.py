@@ -0,0 +1,345 @@
+"""
+语料快照导出 / 导入
+快照是一个目录，包含 manifest.json 与若干分片文件（part），每个 part 只属于一个集合，按列存储：
+    part-00000.embeddings.npy   float16 [rows, dim]   向量（np.load(mmap_mode="r") 可直接内存映射）
+    part-00000.doc_index.npy    int32   [rows]        行所属文档在 manifest["documents"] 中的下标
+    part-00000.chunk_index.npy  int32   [rows]        chunk 序号
+    part-00000.text_offsets.npy int64   [rows + 1]    text.bin 中每行的字节区间
+    part-00000.text.bin         UTF-8 拼接的 chunk 文本
+    part-00000.metadata.jsonl   每行一个 chunk 的元数据（JSON，如页码 / JSON 路径；无元数据为 null）
+导入走 BulkImporter：COPY 到无索引暂存表 → 一次性建索引 → 原子替换集合分区，全程不需要重新生成向量。
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import json
+import mmap
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+from config.database import (
+    get_db_connection, data_shards, use_shard, validate_collection_name, get_embedding_settings,
+)
+from core.bulk_import import BulkImporter, ChunkRow
+from core.jobs import Job, register_job_handler
+
+
+SNAPSHOT_FORMAT = "fast-rag-snapshot"
+SNAPSHOT_VERSION = 2
+# 可读取的快照版本（版本 1 的 part 没有 metadata.jsonl，导入时元数据为空）
+_READABLE_VERSIONS = (1, 2)
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_PART_ROWS = int(os.environ.get("SNAPSHOT_PART_ROWS", "50000"))
+# 导出时服务端游标每次拉取的行数
+_FETCH_ROWS = 2000
+_PART_COLUMNS = ("embeddings.npy", "doc_index.npy", "chunk_index.npy", "text_offsets.npy", "text.bin",
+                 "metadata.jsonl")
+
+
+def resolve_snapshot_path(name: str) -> str:
+    """把快照名称解析为 SNAPSHOT_DIR 下的目录（接口只接受名称，不接受任意路径）"""
+    if not name or os.path.basename(name) != name or name.startswith("."):
+        raise ValueError(f"非法的快照名称: {name!r}")
+    return os.path.join(SNAPSHOT_DIR, name)
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _parse_vector(value) -> np.ndarray:
+    """pgvector 文本表示 '[0.1,0.2,...]' → float32 数组"""
+    if isinstance(value, np.ndarray):
+        return value
+    return np.array(value.strip("[]").split(","), dtype=np.float32)
+
+
+class _PartWriter:
+    """按列写出一个 part；向量先写入预分配的 float16 缓冲区"""
+
+    def __init__(self, directory: str, index: int, collection: str, capacity: int, dim: int):
+        self.directory = directory
+        self.prefix = f"part-{index:05d}"
+        self.collection = collection
+        self.rows = 0
+        self.embeddings = np.empty((capacity, dim), dtype=np.float16)
+        self.doc_index = np.empty(capacity, dtype=np.int32)
+        self.chunk_index = np.empty(capacity, dtype=np.int32)
+        self.offsets = [0]
+        self._text = open(self._path("text.bin"), "wb")
+        self._metadata = open(self._path("metadata.jsonl"), "w", encoding="utf-8")
+
+    def _path(self, column: str) -> str:
+        return os.path.join(self.directory, f"{self.prefix}.{column}")
+
+    @property
+    def full(self) -> bool:
+        return self.rows >= len(self.doc_index)
+
+    def add(self, doc_index: int, chunk_index: int, content: str, metadata: Optional[str],
+            embedding: np.ndarray) -> None:
+        data = content.encode("utf-8")
+        self._text.write(data)
+        self._metadata.write((metadata or "null") + "\n")
+        self.offsets.append(self.offsets[-1] + len(data))
+        self.embeddings[self.rows] = embedding
+        self.doc_index[self.rows] = doc_index
+        self.chunk_index[self.rows] = chunk_index
+        self.rows += 1
+
+    def close(self) -> dict:
+        self._text.close()
+        self._metadata.close()
+        np.save(self._path("embeddings.npy"), self.embeddings[:self.rows])
+        np.save(self._path("doc_index.npy"), self.doc_index[:self.rows])
+        np.save(self._path("chunk_index.npy"), self.chunk_index[:self.rows])
+        np.save(self._path("text_offsets.npy"), np.asarray(self.offsets, dtype=np.int64))
+        return {
+            "prefix": self.prefix,
+            "collection": self.collection,
+            "rows": self.rows,
+            "sha256": {column: _sha256_file(self._path(column)) for column in _PART_COLUMNS},
+        }
+
+
+def export_snapshot(directory: str, collections: Optional[Iterable[str]] = None,
+                    part_rows: int = SNAPSHOT_PART_ROWS) -> dict:
+    """导出 active 版本的文档与文档块（当前检索列的向量）到快照目录，返回 manifest"""
+    if os.path.exists(os.path.join(directory, "manifest.json")):
+        raise FileExistsError(f"快照已存在: {directory}")
+    os.makedirs(directory, exist_ok=True)
+    wanted = {validate_collection_name(c) for c in collections} if collections else None
+
+    settings = get_embedding_settings(refresh=True)
+    documents: List[dict] = []
+    parts: List[dict] = []
+    dim: Optional[int] = None
+    for shard in data_shards():
+        with use_shard(shard):
+            conn = get_db_connection(readonly=True)
+            # 整个导出在同一个快照内读取，文档与文档块保持一致
+            conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT name FROM document_collections ORDER BY name;")
+                names = [r[0] for r in cursor.fetchall() if wanted is None or r[0] in wanted]
+                cursor.close()
+                for collection in names:
+                    dim = _export_collection(conn, directory, collection, settings["active_column"],
+                                             documents, parts, part_rows, dim)
+                conn.commit()
+            finally:
+                conn.close()
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "created_at": datetime.now().isoformat(),
+        "embedding_model": settings["active_model"],
+        "dim": dim,
+        "rows": sum(p["rows"] for p in parts),
+        "documents": documents,
+        "parts": parts,
+    }
+    with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    logging.info(f"快照导出完成: {directory}，{len(documents)} 个文档，{manifest['rows']} 个文档块")
+    return manifest
+
+
+def _export_collection(conn, directory: str, collection: str, column: str, documents: List[dict],
+                       parts: List[dict], part_rows: int, dim: Optional[int]) -> Optional[int]:
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute("""
+        SELECT id, name, file_type, content_hash, byte_size, version, first_uploaded_at
+        FROM documents WHERE collection = %s AND status = 'active'
+        ORDER BY id;
+    """, (collection,))
+    doc_index: Dict[int, int] = {}
+    for row in cursor.fetchall():
+        doc_index[row["id"]] = len(documents)
+        documents.append({
+            "collection": collection,
+            "name": row["name"],
+            "file_type": row["file_type"],
+            "content_hash": row["content_hash"],
+            "byte_size": row["byte_size"],
+            "version": row["version"],
+            "first_uploaded_at": row["first_uploaded_at"].isoformat() if row["first_uploaded_at"] else None,
+        })
+    cursor.close()
+
+    # 服务端游标流式读取，避免一次性加载整个集合
+    stream = conn.cursor(name=f"snapshot_{collection}")
+    stream.itersize = _FETCH_ROWS
+    stream.execute(sql.SQL("""
+        SELECT c.document_id, c.chunk_index, c.content, c.metadata::text, c.{}::text
+        FROM document_chunks c
+        JOIN documents d ON d.id = c.document_id AND d.status = 'active'
+        WHERE c.collection = %s
+        ORDER BY c.document_id, c.chunk_index;
+    """).format(sql.Identifier(column)), (collection,))
+    writer: Optional[_PartWriter] = None
+    try:
+        for document_id, chunk_index, content, metadata, embedding in stream:
+            vector = _parse_vector(embedding)
+            if dim is None:
+                dim = len(vector)
+            elif len(vector) != dim:
+                raise ValueError(f"向量维度不一致: {len(vector)} != {dim}")
+            if writer is None or writer.full:
+                if writer is not None:
+                    parts.append(writer.close())
+                writer = _PartWriter(directory, len(parts), collection, part_rows, dim)
+            writer.add(doc_index[document_id], chunk_index, content, metadata, vector)
+    finally:
+        stream.close()
+    if writer is not None:
+        parts.append(writer.close())
+    return dim
+
+
+def load_manifest(directory: str) -> dict:
+    with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT or manifest.get("version") not in _READABLE_VERSIONS:
+        raise ValueError("不支持的快照格式")
+    return manifest
+
+
+def verify_snapshot(directory: str, manifest: Optional[dict] = None) -> None:
+    """校验每个 part 文件的 sha256，不一致时抛出 ValueError"""
+    manifest = manifest or load_manifest(directory)
+    for part in manifest["parts"]:
+        for column, expected in part["sha256"].items():
+            path = os.path.join(directory, f"{part['prefix']}.{column}")
+            if _sha256_file(path) != expected:
+                raise ValueError(f"快照文件校验失败: {path}")
+
+
+def _format_embeddings(matrix: np.ndarray) -> List[str]:
+    """批量把向量格式化为 pgvector 文本；%.5g 足以无损表示 float16"""
+    buf = io.StringIO()
+    np.savetxt(buf, matrix, fmt="%.5g", delimiter=",")
+    return ["[" + line + "]" for line in buf.getvalue().splitlines()]
+
+
+def _iter_part_rows(directory: str, part: dict, documents: List[dict], id_map: Dict[int, int],
+                    batch_rows: int = 1000) -> Iterator[ChunkRow]:
+    """以内存映射方式读取一个 part，逐行产出待 COPY 的数据"""
+    def column(name: str) -> np.ndarray:
+        return np.load(os.path.join(directory, f"{part['prefix']}.{name}"), mmap_mode="r")
+
+    embeddings = column("embeddings.npy")
+    doc_index = column("doc_index.npy")
+    chunk_index = column("chunk_index.npy")
+    offsets = column("text_offsets.npy")
+    metadata_path = os.path.join(directory, f"{part['prefix']}.metadata.jsonl")
+    with open(os.path.join(directory, f"{part['prefix']}.text.bin"), "rb") as f, \
+            (open(metadata_path, encoding="utf-8") if os.path.exists(metadata_path) else io.StringIO()) as meta:
+        text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if offsets[-1] > 0 else b""
+        try:
+            for start in range(0, part["rows"], batch_rows):
+                end = min(start + batch_rows, part["rows"])
+                vectors = _format_embeddings(embeddings[start:end])
+                for i in range(start, end):
+                    doc = documents[int(doc_index[i])]
+                    content = text[int(offsets[i]):int(offsets[i + 1])].decode("utf-8")
+                    # 元数据保持 JSON 文本直接 COPY；旧版本快照没有元数据文件
+                    metadata = meta.readline().rstrip("\n")
+                    yield (id_map[int(doc_index[i])], content, doc["name"], int(chunk_index[i]),
+                           doc["file_type"], None if metadata in ("", "null") else metadata, vectors[i - start])
+        finally:
+            if isinstance(text, mmap.mmap):
+                text.close()
+
+
+def import_snapshot(directory: str, mode: str = "replace", collections: Optional[Iterable[str]] = None,
+                    verify: bool = True, allow_model_mismatch: bool = False) -> dict:
+    """把快照导入数据库（按集合走批量导入：COPY → 建索引 → 分区替换），返回导入统计"""
+    from core.vector_store import vector_store
+
+    manifest = load_manifest(directory)
+    if manifest["embedding_model"] != vector_store.embedding_model and not allow_model_mismatch:
+        raise ValueError(f"快照的向量模型 {manifest['embedding_model']} 与当前模型 "
+                         f"{vector_store.embedding_model} 不一致")
+    if verify:
+        verify_snapshot(directory, manifest)
+
+    documents = manifest["documents"]
+    wanted = {validate_collection_name(c) for c in collections} if collections else None
+    names = sorted({d["collection"] for d in documents if wanted is None or d["collection"] in wanted})
+    stats = {"collections": {}, "documents": 0, "rows": 0}
+    for collection in names:
+        importer = BulkImporter(collection, mode=mode)
+        importer.begin()
+        try:
+            id_map = {
+                i: importer.register_document(doc["name"], doc["file_type"], content_hash=doc["content_hash"],
+                                              byte_size=doc["byte_size"],
+                                              first_uploaded_at=doc.get("first_uploaded_at"))
+                for i, doc in enumerate(documents) if doc["collection"] == collection
+            }
+            inserted = 0
+            for part in manifest["parts"]:
+                if part["collection"] == collection:
+                    inserted += importer.copy_rows(_iter_part_rows(directory, part, documents, id_map))
+        except Exception:
+            importer.abort()
+            raise
+        total = importer.finish()
+        stats["collections"][collection] = {"documents": len(id_map), "inserted": inserted, "total": total}
+        stats["documents"] += len(id_map)
+        stats["rows"] += inserted
+        logging.info(f"快照导入集合 {collection}: {len(id_map)} 个文档，{inserted} 个文档块")
+    return stats
+
+
+def list_snapshots() -> List[dict]:
+    """列出 SNAPSHOT_DIR 下的快照摘要"""
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    results = []
+    for name in sorted(os.listdir(SNAPSHOT_DIR)):
+        path = os.path.join(SNAPSHOT_DIR, name)
+        if not os.path.isfile(os.path.join(path, "manifest.json")):
+            continue
+        try:
+            manifest = load_manifest(path)
+        except Exception as e:
+            logging.warning(f"读取快照 {name} 失败: {e}")
+            continue
+        results.append({
+            "name": name,
+            "created_at": manifest["created_at"],
+            "embedding_model": manifest["embedding_model"],
+            "dim": manifest["dim"],
+            "documents": len(manifest["documents"]),
+            "rows": manifest["rows"],
+            "collections": sorted({d["collection"] for d in manifest["documents"]}),
+        })
+    return results
+
+
+@register_job_handler("snapshot_export")
+def _snapshot_export_job(job: Job) -> dict:
+    manifest = export_snapshot(resolve_snapshot_path(job.params["name"]), job.params.get("collections"))
+    return {"documents": len(manifest["documents"]), "rows": manifest["rows"], "parts": len(manifest["parts"])}
+
+
+@register_job_handler("snapshot_import")
+def _snapshot_import_job(job: Job) -> dict:
+    return import_snapshot(resolve_snapshot_path(job.params["name"]), mode=job.params.get("mode", "replace"),
+                           collections=job.params.get("collections"), verify=job.params.get("verify", True))
@@ -1,7 +1,7 @@
 import logging
 import os
 import io
-from typing import List, Dict, Optional, Iterator, Any
+from typing import List, Dict, Optional, Iterator, Any, Tuple
 
 import torch
 import ollama
@@ -9,8 +9,9 @@ from PyPDF2 import PdfReader
 from openai import OpenAI
 
 from core.vector_store import vector_store
+from core.jobs import job_worker, JOB_WORKER_ENABLED
 from core.model_client import get_global_model_client, ModelClientFactory
-from config.database import init_database, get_chunk_count
+from config.database import init_database, get_chunk_count, DEFAULT_COLLECTION
 from config.models import model_config
 
 
@@ -19,7 +20,7 @@ DEFAULT_MODEL = model_config.ollama.model if model_config.current_model_type ==
 
 
 # vector_store
-def get_relevant_context(rewritten_input: str, top_k: int = 3) -> List[str]:
+def get_relevant_context(rewritten_input: str, top_k: int = 3, collection: str = DEFAULT_COLLECTION) -> List[str]:
     import time
     
     print(f"开始检索相关上下文")
@@ -27,14 +28,15 @@ def get_relevant_context(rewritten_input: str, top_k: int = 3) -> List[str]:
     # 测量向量嵌入生成时间
     embedding_start = time.time()
     
-    # 检查缓存
-    if rewritten_input in app_state.query_embedding_cache:
-        input_embedding = app_state.query_embedding_cache[rewritten_input]
+    # 检查缓存（按模型区分，向量模型迁移切换后不会复用旧模型的查询向量）
+    cache_key = (vector_store.embedding_model, rewritten_input)
+    if cache_key in app_state.query_embedding_cache:
+        input_embedding = app_state.query_embedding_cache[cache_key]
         print(f"📊 使用缓存的向量嵌入")
     else:
-        # 使用模型客户端生成嵌入
-        input_embedding = get_global_model_client().embeddings(rewritten_input)
-        app_state.query_embedding_cache[rewritten_input] = input_embedding
+        # 使用与检索列一致的向量模型生成嵌入
+        input_embedding = vector_store.embed_query(rewritten_input)
+        app_state.query_embedding_cache[cache_key] = input_embedding
         print(f"📊 生成新的向量嵌入并缓存")
     
     embedding_time = time.time() - embedding_start
@@ -43,7 +45,8 @@ def get_relevant_context(rewritten_input: str, top_k: int = 3) -> List[str]:
     # 混合检索由 vector_store 统一实现与维护（包含阈值兜底判定）
     fused, has_strong_vec = vector_store.hybrid_search(
         rewritten_input, input_embedding, top_k=max(10, top_k), alpha=0.6,
-        relevance_threshold=model_config.max_context_distance
+        relevance_threshold=model_config.max_context_distance,
+        collection=collection
     )
     if not has_strong_vec:
         print("未通过向量距离阈值，跳过私域上下文注入")
@@ -152,7 +155,7 @@ def rewrite_query_stream(user_input: str, conversation_history: List[Dict[str, s
 #
 
 def rag_chat_stream(user_input: str, system_message: str, conversation_history: List[Dict[str, str]],
-                     model: str) -> Iterator[str]:
+                     model: str, collection: str = DEFAULT_COLLECTION) -> Iterator[str]:
     """Yield assistant content chunks as they stream in, and update history when done."""
     import time
     start_time = time.time()
@@ -212,7 +215,7 @@ def rag_chat_stream(user_input: str, system_message: str, conversation_history:
     # 检索相关上下文
     yield "<think>正在检索相关上下文信息...</think>"
     retrieval_start = time.time()
-    relevant_context = get_relevant_context(rewritten_query)
+    relevant_context = get_relevant_context(rewritten_query, collection=collection)
     retrieval_time = time.time() - retrieval_start
     print(f"🔍 向量检索耗时: {retrieval_time:.2f}秒")
     # 合并上下文并做硬阈值裁剪，避免不同查询因为上下文长度大幅度放大推理时延
@@ -278,7 +281,7 @@ def rag_chat_stream(user_input: str, system_message: str, conversation_history:
 class AppState:
     def __init__(self) -> None:
         self.histories: Dict[str, List[Dict[str, str]]] = {}
-        self.query_embedding_cache: Dict[str, List[float]] = {}  # 缓存查询向量嵌入
+        self.query_embedding_cache: Dict[Tuple[str, str], List[float]] = {}  # 缓存查询向量嵌入
         self.model_loaded: bool = False  # 标记模型是否已加载
         self.system_message: str = model_config.system_message
         self.model_client = get_global_model_client()  # 使用模型客户端
@@ -335,6 +338,13 @@ def initialize_state_on_startup() -> None:
             print("   请检查 DeepSeek API 配置和 Ollama 备选服务")
         raise
     
+    # 启动后台任务 worker（入库、删除、清空、VACUUM 等），并回收上次运行遗留的旧文档版本
+    if JOB_WORKER_ENABLED:
+        job_worker.start()
+    else:
+        print("ℹ️  API 进程内不运行后台任务 worker，请通过 scripts/job_worker.py 启动独立 worker")
+    vector_store.schedule_gc_sweep()
+
     # 检查向量数据库状态
     print("\n📚 检查向量数据库状态...")
     try:
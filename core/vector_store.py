@@ -1,27 +1,49 @@
 import logging
 from typing import List, Dict, Optional, Tuple
 import psycopg2
+from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
 import ollama
 import torch
 
-from config.database import get_db_connection
+from config.database import (
+    get_db_connection, ensure_collection, create_document_version, activate_document, DEFAULT_COLLECTION,
+    SHARD_DSNS, get_embedding_settings, validate_collection_name, chunk_hash, find_active_document,
+    document_chunk_ids, copy_document_chunks,
+)
 from config.models import model_config
+from core.jobs import enqueue_job, job_worker
+from core.maintenance import schedule_document_deletion
 
 
 class VectorStore:
-    def __init__(self):
-        self.embedding_model = 'nomic-embed-text'
-    
-    def embed_texts(self, texts: List[str]) -> List[List[float]]:
-        """生成文本向量嵌入"""
+    """文档块的写入与检索。
+    检索只返回 active 版本文档的 chunk，写入中（pending）和被替换（superseded）的版本对检索不可见。
+    """
+    @property
+    def embedding_model(self) -> str:
+        """检索当前使用的向量模型（向量模型迁移切换后随之变化）"""
+        return get_embedding_settings()["active_model"]
+
+    def embed_texts(self, texts: List[str], model: Optional[str] = None) -> List[List[float]]:
+        """生成文本向量嵌入（默认使用当前模型），优先一次请求批量生成"""
         if not texts:
             return []
-        
+        model = model or self.embedding_model
+
+        if hasattr(ollama, "embed"):
+            try:
+                resp = ollama.embed(model=model, input=texts)
+                return [[float(x) for x in vec] for vec in resp["embeddings"]]
+            except Exception as e:
+                logging.error(f"生成向量嵌入失败: {e}")
+                raise
+
+        # 旧版 ollama 客户端没有批量接口，逐条生成
         vectors: List[List[float]] = []
         for content in texts:
             try:
-                resp = ollama.embeddings(model=self.embedding_model, prompt=content)
+                resp = ollama.embeddings(model=model, prompt=content)
                 # 确保向量是浮点数列表
                 embedding = [float(x) for x in resp["embedding"]]
                 vectors.append(embedding)
@@ -30,38 +52,92 @@ class VectorStore:
                 raise
         
         return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """用当前检索列对应的模型生成查询向量"""
+        return self.embed_texts([text])[0]
     
-    def store_chunks(self, chunks: List[str], file_name: str, file_type: str = "unknown") -> int:
-        """存储文档块到数据库"""
+    def store_chunks(self, chunks: List[str], file_name: str, file_type: str = "unknown",
+                     collection: str = DEFAULT_COLLECTION, content_hash: Optional[str] = None,
+                     byte_size: Optional[int] = None, embeddings: Optional[List[List[float]]] = None,
+                     embedding_model: Optional[str] = None) -> int:
+        """存储文档块到数据库（写入 collection 对应的分区，不存在时自动创建）。
+        每次写入生成该文件的一个新版本，插入完成后在同一事务内切换为 active，旧版本在后台回收。
+        与上一版本内容相同的块直接复制已有向量，只为新增或变化的块生成向量。
+        embeddings 为调用方已生成的向量（与 chunks 一一对应，由 embedding_model 生成），
+        模型与当前检索模型不一致（如迁移刚切换）时忽略并重新生成；采用时数量或维度不符抛出 ValueError。
+        """
         if not chunks:
             return 0
-        
-        # 生成向量嵌入
-        embeddings = self.embed_texts(chunks)
-        
+        collection = ensure_collection(collection)
+
+        # 模型迁移期间同时生成新模型的向量写入目标列
+        settings = get_embedding_settings()
+        columns = [settings["active_column"]]
+        models = [settings["active_model"]]
+        if settings["target_column"]:
+            columns.append(settings["target_column"])
+            models.append(settings["target_model"])
+
+        if embeddings is not None:
+            if len(embeddings) != len(chunks):
+                raise ValueError(f"向量数量 {len(embeddings)} 与文档块数量 {len(chunks)} 不一致")
+            # 先判断模型：迁移切换到不同维度的模型后，旧模型的向量应被丢弃重新生成，而不是因维度不符而失败
+            if embedding_model and embedding_model != settings["active_model"]:
+                logging.warning(f"预先生成的向量来自 {embedding_model}，当前检索模型为 {settings['active_model']}，重新生成")
+                embeddings = None
+        if embeddings is not None:
+            bad = next((i for i, vec in enumerate(embeddings) if len(vec) != settings["active_dim"]), None)
+            if bad is not None:
+                raise ValueError(f"第 {bad} 个向量的维度 {len(embeddings[bad])} 与 {settings['active_column']} "
+                                 f"列的维度 {settings['active_dim']} 不一致")
+
+        hashes = [chunk_hash(c) for c in chunks]
+        previous = self.previous_chunk_ids(file_name, collection, columns)
+        reused = [(previous[h], i, None) for i, h in enumerate(hashes) if h in previous]
+        fresh = [i for i, h in enumerate(hashes) if h not in previous]
+
+        # 生成向量嵌入（已提供检索列向量时只为迁移目标列生成）
+        embedding_sets = [
+            [embeddings[i] for i in fresh] if n == 0 and embeddings is not None
+            else self.embed_texts([chunks[i] for i in fresh], model=model)
+            for n, model in enumerate(models)
+        ]
+
         # 批量插入数据库
         conn = get_db_connection()
         cursor = conn.cursor()
-        
+
         try:
+            document_id = create_document_version(cursor, collection, file_name, file_type,
+                                                  content_hash=content_hash, byte_size=byte_size)
             # 准备批量插入数据
             data_to_insert = []
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+            for n, i in enumerate(fresh):
                 # 将向量转换为PostgreSQL的vector类型
-                embedding_str = '[' + ','.join(map(str, embedding)) + ']'
-                data_to_insert.append((chunk, file_name, i, file_type, embedding_str))
-            
+                embedding_strs = ['[' + ','.join(map(str, vectors[n])) + ']' for vectors in embedding_sets]
+                data_to_insert.append((collection, document_id, chunks[i], file_name, i, file_type, hashes[i],
+                                       *embedding_strs))
+
             # 批量插入
-            cursor.executemany("""
-                INSERT INTO document_chunks (content, file_name, chunk_index, file_type, embedding)
-                VALUES (%s, %s, %s, %s, %s::vector)
-            """, data_to_insert)
-            
+            cursor.executemany(sql.SQL("""
+                INSERT INTO document_chunks (collection, document_id, content, file_name, chunk_index, file_type, chunk_hash, {})
+                VALUES (%s, %s, %s, %s, %s, %s, %s, {})
+            """).format(
+                sql.SQL(", ").join(map(sql.Identifier, columns)),
+                sql.SQL(", ").join(sql.SQL("%s::vector") for _ in columns),
+            ), data_to_insert)
+            if copy_document_chunks(cursor, collection, document_id, file_type, reused, columns) != len(reused):
+                raise RuntimeError(f"文件 {file_name} 的上一版本在入库期间被替换，请重试")
+
+            superseded = activate_document(cursor, document_id, len(chunks), sum(len(c) for c in chunks))
             conn.commit()
             inserted_count = len(chunks)
-            logging.info(f"成功存储 {inserted_count} 个文档块，文件: {file_name}")
+            logging.info(f"成功存储 {inserted_count} 个文档块（复用 {len(reused)} 个未变化的块），文件: {file_name}，"
+                         f"集合: {collection}，document_id: {document_id}")
+            self.schedule_gc(superseded)
             return inserted_count
-            
+
         except Exception as e:
             conn.rollback()
             logging.error(f"存储文档块失败: {e}")
@@ -69,10 +145,65 @@ class VectorStore:
         finally:
             cursor.close()
             conn.close()
-    
-    def search_similar(self, query_embedding: List[float], top_k: int = 3) -> List[Dict]:
-        """搜索相似文档块"""
+
+    def previous_chunk_ids(self, file_name: str, collection: str, columns: List[str]) -> Dict[str, int]:
+        """同名文件当前 active 版本中 块内容哈希 → 文档块 id（重新入库时复用这些块的向量）"""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            active = find_active_document(cursor, collection, file_name)
+            if not active:
+                return {}
+            return document_chunk_ids(cursor, collection, active[0], columns)
+        finally:
+            cursor.close()
+            conn.close()
+
+    def unchanged_document(self, file_name: str, content_hash: str,
+                           collection: str = DEFAULT_COLLECTION) -> Optional[int]:
+        """同名文件的 active 版本与 content_hash 相同时返回其文档块数（重复上传可整体跳过），否则返回 None"""
+        collection = validate_collection_name(collection)
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            active = find_active_document(cursor, collection, file_name)
+            if active and active[1] == content_hash:
+                return active[2]
+            return None
+        finally:
+            cursor.close()
+            conn.close()
+
+    def shard_for(self, collection: str, file_name: str) -> Optional[int]:
+        """文件所在的分片（非分片模式返回 None）"""
+        return None
+
+    def schedule_gc(self, document_ids: List[int]) -> None:
+        """提交后台任务回收被替换版本的文档块"""
+        if not document_ids:
+            return
         conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            schedule_document_deletion(cursor, document_ids)
+            conn.commit()
+            job_worker.notify()
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"提交旧版本回收任务失败: {e}")
+        finally:
+            cursor.close()
+            conn.close()
+
+    def schedule_gc_sweep(self) -> None:
+        """提交一次全量回收：superseded 版本、超时 pending 版本及遗留的 deleting 版本（启动时调用）"""
+        enqueue_job("gc_sweep", dedupe_key="gc_sweep")
+
+    def search_similar(self, query_embedding: List[float], top_k: int = 3,
+                       collection: str = DEFAULT_COLLECTION) -> List[Dict]:
+        """搜索相似文档块（按 collection 分区裁剪，只扫描该集合的向量索引）"""
+        column = sql.Identifier(get_embedding_settings()["active_column"])
+        conn = get_db_connection(readonly=True)
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
         try:
@@ -80,13 +211,15 @@ class VectorStore:
             query_vector_str = '[' + ','.join(map(str, query_embedding)) + ']'
             
             # 使用余弦相似度搜索
-            cursor.execute("""
-                SELECT id, content, file_name, chunk_index, file_type,
-                       embedding <=> %s::vector as distance
-                FROM document_chunks
-                ORDER BY embedding <=> %s::vector
+            cursor.execute(sql.SQL("""
+                SELECT c.id, c.collection, c.document_id, c.content, c.file_name, c.chunk_index, c.file_type, c.metadata,
+                       c.{column} <=> %s::vector as distance
+                FROM document_chunks c
+                JOIN documents d ON d.id = c.document_id AND d.status = 'active'
+                WHERE c.collection = %s
+                ORDER BY c.{column} <=> %s::vector
                 LIMIT %s
-            """, (query_vector_str, query_vector_str, top_k))
+            """).format(column=column), (query_vector_str, collection, query_vector_str, top_k))
             
             results = cursor.fetchall()
             return [dict(row) for row in results]
@@ -98,39 +231,43 @@ class VectorStore:
             cursor.close()
             conn.close()
 
-    def search_lexical_trgm(self, query: str, limit: int = 50) -> List[Dict]:
+    def search_lexical_trgm(self, query: str, limit: int = 50,
+                            collection: str = DEFAULT_COLLECTION) -> List[Dict]:
         """使用 trigram 相似度做词法检索（需要 pg_trgm 扩展）。
         如扩展不可用，可回退到 ILIKE。
         """
-        conn = get_db_connection()
+        conn = get_db_connection(readonly=True)
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         try:
             try:
                 cursor.execute(
                     """
-                    SELECT id, content, file_name, chunk_index, file_type,
-                           similarity(content, %s) AS sim
-                    FROM document_chunks
-                    WHERE content % %s
+                    SELECT c.id, c.collection, c.document_id, c.content, c.file_name, c.chunk_index, c.file_type,
+                           c.metadata, similarity(c.content, %s) AS sim
+                    FROM document_chunks c
+                    JOIN documents d ON d.id = c.document_id AND d.status = 'active'
+                    WHERE c.collection = %s AND c.content %% %s
                     ORDER BY sim DESC
                     LIMIT %s
                     """,
-                    (query, query, limit),
+                    (query, collection, query, limit),
                 )
                 rows = cursor.fetchall()
                 return [dict(r) for r in rows]
             except Exception:
-                # fallback to ILIKE
+                # fallback to ILIKE（先回滚已中止的事务）
+                conn.rollback()
                 pattern = f"%{query}%"
                 cursor.execute(
                     """
-                    SELECT id, content, file_name, chunk_index, file_type
-                    FROM document_chunks
-                    WHERE content ILIKE %s
-                    ORDER BY chunk_index
+                    SELECT c.id, c.collection, c.document_id, c.content, c.file_name, c.chunk_index, c.file_type, c.metadata
+                    FROM document_chunks c
+                    JOIN documents d ON d.id = c.document_id AND d.status = 'active'
+                    WHERE c.collection = %s AND c.content ILIKE %s
+                    ORDER BY c.chunk_index
                     LIMIT %s
                     """,
-                    (pattern, limit),
+                    (collection, pattern, limit),
                 )
                 rows = cursor.fetchall()
                 return [dict(r) for r in rows]
@@ -139,13 +276,19 @@ class VectorStore:
             conn.close()
 
     def hybrid_search(self, query: str, query_embedding: List[float], top_k: int = 3,
-                       alpha: float = 0.6, relevance_threshold: float | None = None) -> tuple[List[Dict], bool]:
+                       alpha: float = 0.6, relevance_threshold: float | None = None,
+                       collection: str = DEFAULT_COLLECTION) -> tuple[List[Dict], bool]:
         """混合检索：融合向量与词法相似度，返回 (候选列表, has_strong_vec)。
         - has_strong_vec: 是否存在距离<=阈值的向量候选，用于兜底判定。
+        - collection: 只在该集合的分区内检索。
         """
-        vec = self.search_similar(query_embedding, max(10, top_k))
-        lex = self.search_lexical_trgm(query, max(20, top_k * 3))
+        vec = self.search_similar(query_embedding, max(10, top_k), collection=collection)
+        lex = self.search_lexical_trgm(query, max(20, top_k * 3), collection=collection)
+        return self._fuse(vec, lex, alpha, relevance_threshold)
 
+    def _fuse(self, vec: List[Dict], lex: List[Dict], alpha: float,
+              relevance_threshold: float | None) -> tuple[List[Dict], bool]:
+        """按归一化后的向量/词法相似度加权融合候选（分片结果以 (shard, id) 区分同 id 的chunk）"""
         def normalize(vals: List[float]) -> List[float]:
             if not vals:
                 return []
@@ -154,11 +297,11 @@ class VectorStore:
                 return [1.0 for _ in vals]
             return [(v - vmin) / (vmax - vmin) for v in vals]
 
-        vec_ids = [c.get('id') for c in vec]
+        vec_ids = [(c.get('shard'), c.get('id')) for c in vec]
         vec_sims = normalize([max(0.0, 1.0 - float(c.get('distance') or 1.0)) for c in vec])
         vec_map = { cid: (sim, c) for cid, sim, c in zip(vec_ids, vec_sims, vec) }
 
-        lex_ids = [c.get('id') for c in lex]
+        lex_ids = [(c.get('shard'), c.get('id')) for c in lex]
         lex_sims = normalize([float(c.get('sim') or 0.0) for c in lex]) if lex and 'sim' in lex[0] else [1.0 for _ in lex]
         lex_map = { cid: (sim, c) for cid, sim, c in zip(lex_ids, lex_sims, lex) }
 
@@ -182,17 +325,19 @@ class VectorStore:
         has_strong_vec = any((c.get('distance') is not None and float(c['distance']) <= thr) for c in vec)
         return fused, has_strong_vec
     
-    def get_all_chunks(self) -> List[Dict]:
-        """获取所有文档块（用于兼容性）"""
-        conn = get_db_connection()
+    def get_all_chunks(self, collection: Optional[str] = None) -> List[Dict]:
+        """获取所有文档块（用于兼容性，指定 collection 时只返回该集合）"""
+        conn = get_db_connection(readonly=True)
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
         try:
             cursor.execute("""
-                SELECT id, content, file_name, chunk_index, file_type, created_at
-                FROM document_chunks
-                ORDER BY file_name, chunk_index
-            """)
+                SELECT c.id, c.collection, c.document_id, c.content, c.file_name, c.chunk_index, c.file_type, c.created_at
+                FROM document_chunks c
+                JOIN documents d ON d.id = c.document_id AND d.status = 'active'
+                WHERE %s IS NULL OR c.collection = %s
+                ORDER BY c.collection, c.file_name, c.chunk_index
+            """, (collection, collection))
             
             results = cursor.fetchall()
             return [dict(row) for row in results]
@@ -204,39 +349,43 @@ class VectorStore:
             cursor.close()
             conn.close()
     
-    def delete_file_chunks(self, file_name: str) -> int:
-        """删除指定文件的所有文档块"""
+    def delete_file_chunks(self, file_name: str, collection: str = DEFAULT_COLLECTION) -> Optional[int]:
+        """删除指定集合内某文件（所有版本）：文件立即对检索与文件列表不可见，
+        文档块由后台任务分批删除。返回删除任务 id，文件不存在时返回 None
+        """
         conn = get_db_connection()
         cursor = conn.cursor()
         
         try:
-            cursor.execute("DELETE FROM document_chunks WHERE file_name = %s", (file_name,))
-            deleted_count = cursor.rowcount
+            cursor.execute("SELECT id FROM documents WHERE collection = %s AND name = %s", (collection, file_name))
+            document_ids = [r[0] for r in cursor.fetchall()]
+            job_ids = schedule_document_deletion(cursor, document_ids)
             conn.commit()
-            logging.info(f"删除文件 {file_name} 的 {deleted_count} 个文档块")
-            return deleted_count
+            job_worker.notify()
+            logging.info(f"已提交文件 {file_name} 的删除任务: {job_ids}")
+            return job_ids[0] if job_ids else None
             
         except Exception as e:
             conn.rollback()
-            logging.error(f"删除文件文档块失败: {e}")
+            logging.error(f"提交文件删除任务失败: {e}")
             raise
         finally:
             cursor.close()
             conn.close()
     
-    def get_file_list(self) -> List[Dict]:
-        """获取已上传文件列表"""
-        conn = get_db_connection()
+    def get_file_list(self, collection: str = DEFAULT_COLLECTION) -> List[Dict]:
+        """获取集合内已上传文件列表（读取 documents 表的 active 版本，不扫描文档块）"""
+        conn = get_db_connection(readonly=True)
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
         try:
             cursor.execute("""
-                SELECT file_name, file_type, COUNT(*) as chunk_count, 
-                       MIN(created_at) as first_upload, MAX(created_at) as last_upload
-                FROM document_chunks
-                GROUP BY file_name, file_type
-                ORDER BY last_upload DESC
-            """)
+                SELECT collection, name AS file_name, file_type, chunk_count, byte_size, char_count, version,
+                       COALESCE(first_uploaded_at, created_at) AS first_upload, activated_at AS last_upload
+                FROM documents
+                WHERE collection = %s AND status = 'active'
+                ORDER BY activated_at DESC
+            """, (collection,))
             
             results = cursor.fetchall()
             return [dict(row) for row in results]
@@ -248,52 +397,73 @@ class VectorStore:
             cursor.close()
             conn.close()
 
-    def get_chunks_by_file(self, file_name: str, limit: int = 100, offset: int = 0, preview_length: int = 200) -> List[Dict]:
-        """按文件名获取文档块，支持分页与预览长度（preview_length>0 时返回预览字段）"""
-        conn = get_db_connection()
+    def _list_file_chunks(self, file_name: str, collection: str, limit: int, offset: int, preview_length: int,
+                          after: Optional[Tuple[int, int]] = None, keyword: Optional[str] = None) -> List[Dict]:
+        """按 (chunk_index, id) 顺序列出文件的 active 版本chunk。
+        传入 after=(chunk_index, id) 时走 keyset 分页（命中 (document_id, chunk_index, id) 索引），否则使用 OFFSET。
+        """
+        conn = get_db_connection(readonly=True)
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         try:
+            cursor.execute("""
+                SELECT id FROM documents WHERE collection = %s AND name = %s AND status = 'active'
+            """, (collection, file_name))
+            row = cursor.fetchone()
+            if not row:
+                return []
+
             if preview_length and preview_length > 0:
-                cursor.execute(
-                    """
-                    SELECT id, file_name, file_type, chunk_index, created_at,
-                           LENGTH(content) AS content_length,
-                           LEFT(content, %s) AS content_preview
-                    FROM document_chunks
-                    WHERE file_name = %s
-                    ORDER BY chunk_index
-                    LIMIT %s OFFSET %s
-                    """,
-                    (preview_length, file_name, limit, offset),
-                )
+                columns = "LENGTH(c.content) AS content_length, LEFT(c.content, %s) AS content_preview"
+                params: List = [preview_length]
             else:
-                cursor.execute(
-                    """
-                    SELECT id, file_name, file_type, chunk_index, created_at, content,
-                           LENGTH(content) AS content_length
-                    FROM document_chunks
-                    WHERE file_name = %s
-                    ORDER BY chunk_index
-                    LIMIT %s OFFSET %s
-                    """,
-                    (file_name, limit, offset),
-                )
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
-        except Exception as e:
-            logging.error(f"获取文件 {file_name} 的chunk失败: {e}")
-            raise
+                columns = "c.content, LENGTH(c.content) AS content_length"
+                params = []
+            conditions = ["c.collection = %s", "c.document_id = %s"]
+            params += [collection, row["id"]]
+            if keyword:
+                conditions.append("c.content ILIKE %s")
+                params.append(f"%{keyword}%")
+            if after:
+                conditions.append("(c.chunk_index, c.id) > (%s, %s)")
+                params += list(after)
+                offset = 0
+            params += [limit, offset]
+
+            cursor.execute(
+                f"""
+                SELECT c.id, c.document_id, c.file_name, c.file_type, c.chunk_index, c.metadata, c.created_at, {columns}
+                FROM document_chunks c
+                WHERE {' AND '.join(conditions)}
+                ORDER BY c.chunk_index, c.id
+                LIMIT %s OFFSET %s
+                """,
+                params,
+            )
+            return [dict(r) for r in cursor.fetchall()]
         finally:
             cursor.close()
             conn.close()
 
-    def get_chunk_count_by_file(self, file_name: str) -> int:
+    def get_chunks_by_file(self, file_name: str, limit: int = 100, offset: int = 0, preview_length: int = 200,
+                           collection: str = DEFAULT_COLLECTION, after: Optional[Tuple[int, int]] = None) -> List[Dict]:
+        """按文件名获取文档块，支持分页（offset 或 after 游标）与预览长度（preview_length>0 时返回预览字段）"""
+        try:
+            return self._list_file_chunks(file_name, collection, limit, offset, preview_length, after=after)
+        except Exception as e:
+            logging.error(f"获取文件 {file_name} 的chunk失败: {e}")
+            raise
+
+    def get_chunk_count_by_file(self, file_name: str, collection: str = DEFAULT_COLLECTION) -> int:
         """获取某个文件的chunk总数"""
-        conn = get_db_connection()
+        conn = get_db_connection(readonly=True)
         cursor = conn.cursor()
         try:
-            cursor.execute("SELECT COUNT(*) FROM document_chunks WHERE file_name = %s", (file_name,))
-            return int(cursor.fetchone()[0])
+            cursor.execute("""
+                SELECT chunk_count FROM documents
+                WHERE collection = %s AND name = %s AND status = 'active'
+            """, (collection, file_name))
+            row = cursor.fetchone()
+            return int(row[0]) if row else 0
         except Exception as e:
             logging.error(f"统计文件 {file_name} 的chunk数量失败: {e}")
             raise
@@ -301,46 +471,20 @@ class VectorStore:
             cursor.close()
             conn.close()
 
-    def search_chunks_in_file(self, file_name: str, keyword: str, limit: int = 50, offset: int = 0, preview_length: int = 200) -> List[Dict]:
-        """在指定文件内按关键字搜索content，ILIKE模糊匹配，支持分页与预览长度"""
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+    def search_chunks_in_file(self, file_name: str, keyword: str, limit: int = 50, offset: int = 0, preview_length: int = 200,
+                              collection: str = DEFAULT_COLLECTION, after: Optional[Tuple[int, int]] = None) -> List[Dict]:
+        """在指定文件内按关键字搜索content，ILIKE模糊匹配，支持分页（offset 或 after 游标）与预览长度"""
         try:
-            pattern = f"%{keyword}%"
-            if preview_length and preview_length > 0:
-                cursor.execute(
-                    """
-                    SELECT id, file_name, file_type, chunk_index, created_at,
-                           LENGTH(content) AS content_length,
-                           LEFT(content, %s) AS content_preview
-                    FROM document_chunks
-                    WHERE file_name = %s AND content ILIKE %s
-                    ORDER BY chunk_index
-                    LIMIT %s OFFSET %s
-                    """,
-                    (preview_length, file_name, pattern, limit, offset),
-                )
-            else:
-                cursor.execute(
-                    """
-                    SELECT id, file_name, file_type, chunk_index, created_at, content,
-                           LENGTH(content) AS content_length
-                    FROM document_chunks
-                    WHERE file_name = %s AND content ILIKE %s
-                    ORDER BY chunk_index
-                    LIMIT %s OFFSET %s
-                    """,
-                    (file_name, pattern, limit, offset),
-                )
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+            return self._list_file_chunks(file_name, collection, limit, offset, preview_length,
+                                          after=after, keyword=keyword)
         except Exception as e:
             logging.error(f"文件内关键字搜索失败: {e}")
             raise
-        finally:
-            cursor.close()
-            conn.close()
 
 
-# 全局向量存储实例
-vector_store = VectorStore()
+# 全局向量存储实例（配置了 SHARD_DSNS 时使用分片存储）
+if SHARD_DSNS:
+    from core.sharding import ShardedVectorStore
+    vector_store = ShardedVectorStore()
+else:
+    vector_store = VectorStore()
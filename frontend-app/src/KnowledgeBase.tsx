@@ -175,13 +175,33 @@ export default function KnowledgeBase({ onLanggraphTrace, onViewTrace, traceStor
     setMenuTimeout(timeout)
   }
 
+  // 上传接口只提交后台入库任务，通过 SSE 等待任务结束，返回任务的最终状态
+  function waitForJob(eventsUrl: string, onProgress?: (job: any) => void): Promise<any> {
+    return new Promise((resolve, reject) => {
+      const source = new EventSource(`${API_BASE}${eventsUrl}`)
+      source.addEventListener('progress', (e) => onProgress?.(JSON.parse((e as MessageEvent).data)))
+      source.addEventListener('end', (e) => {
+        source.close()
+        resolve(JSON.parse((e as MessageEvent).data))
+      })
+      source.onerror = () => {
+        source.close()
+        reject(new Error('任务进度连接中断'))
+      }
+    })
+  }
+
   // upload simple
   async function uploadSimple(files: FileList | null) {
     if (!API_BASE || !files || files.length === 0) return
     const form = new FormData()
     Array.from(files).forEach(f => form.append('files', f))
     const resp = await fetch(`${API_BASE}/upload/simple`, { method: 'POST', body: form })
-    if (resp.ok) fetchFiles()
+    if (resp.ok) {
+      const { events_url } = await resp.json()
+      await waitForJob(events_url).catch(error => console.error('入库任务失败:', error))
+      fetchFiles()
+    }
   }
 
   // upload docling
@@ -190,7 +210,11 @@ export default function KnowledgeBase({ onLanggraphTrace, onViewTrace, traceStor
     const form = new FormData()
     Array.from(files).forEach(f => form.append('files', f))
     const resp = await fetch(`${API_BASE}/upload/docling`, { method: 'POST', body: form })
-    if (resp.ok) fetchFiles()
+    if (resp.ok) {
+      const { events_url } = await resp.json()
+      await waitForJob(events_url).catch(error => console.error('入库任务失败:', error))
+      fetchFiles()
+    }
   }
 
   // upload with LangGraph
@@ -215,24 +239,31 @@ export default function KnowledgeBase({ onLanggraphTrace, onViewTrace, traceStor
       if (resp.ok) {
         const data = await resp.json()
         console.log('响应数据:', data)
+        const job = await waitForJob(data.events_url, (progress) => {
+          onLanggraphTrace?.({ loading: true, message: `正在处理文件 ${progress.progress?.stored ?? 0}/${progress.progress?.files ?? files.length}...` })
+        })
         fetchFiles()
+        fetchTraces()
         
-        // 将轨迹数据传递给父组件
-        if (onLanggraphTrace && data.results && data.results.length > 0) {
+        // 轨迹数据由后台任务保存，按文件名读取后传递给父组件
+        const results: any[] = job.progress?.results || []
+        if (onLanggraphTrace && results.length > 0) {
+          const traces = await Promise.all(results.map((result: any) => getTraceData(result.filename)))
           // 保存所有文件的轨迹数据
-          data.results.forEach((result: any) => {
-            if (result.execution_trace && result.filename) {
+          results.forEach((result: any, i: number) => {
+            if (traces[i] && result.filename) {
               setTraceStorage?.((prev: Record<string, any>) => ({
                 ...prev,
-                [result.filename]: result.execution_trace
+                [result.filename]: traces[i]
               }))
             }
           })
           
           // 使用第一个文件的轨迹数据
-          const firstResult = data.results[0]
-          if (firstResult.execution_trace) {
-            onLanggraphTrace(firstResult.execution_trace)
+          if (traces[0]) {
+            onLanggraphTrace(traces[0])
+          } else {
+            onLanggraphTrace({ error: true, message: `处理失败: ${results[0].error || job.error || '未知错误'}` })
           }
         }
       } else {
@@ -7,12 +7,21 @@ from api.upload import router as upload_router
 from api.chat import router as chat_router
 from api.manage import router as manage_router
 from api.history import router as history_router
+from api.jobs import router as jobs_router
+from core.jobs import job_worker, JOB_WORKER_ENABLED
+from core.conversion import conversion_pool, pdf_text_extractor
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     initialize_state_on_startup()
+    # 预热文档转换 worker（各自加载 Docling 模型），只有在进程内执行入库任务时需要
+    if JOB_WORKER_ENABLED:
+        conversion_pool.start()
     yield
     print("正在关闭rag服务...")
+    job_worker.stop(timeout=5)
+    conversion_pool.shutdown()
+    pdf_text_extractor.shutdown()
 
 
 app = FastAPI(title="Easy Local RAG API", lifespan=lifespan)
@@ -24,12 +33,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(upload_router)
 app.include_router(chat_router)
 app.include_router(manage_router)
 app.include_router(history_router)
+app.include_router(jobs_router)
 
 
 @app.get("/health")
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+分块引擎基准测试
+用 test/ 目录下的样例文件（按倍数重复以放大规模）对比原分块实现与 core.chunking 的流式实现：
+校验输出逐字节一致（整段输入与随机切成片段输入都要一致），并输出各自耗时。
+
+用法:
+    python scripts/bench_chunker.py                    # 默认 1/10/50 倍规模
+    python scripts/bench_chunker.py --scales 1 100 --repeat 5
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+from typing import Callable, List, Tuple
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.chunking import iter_export_chunks, iter_normalized_chunks
+
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test")
+
+
+# ---- 原实现（core/document_ingest.py 中被替换前的版本），作为一致性基准 ----
+
+def reference_chunk_text_from_export(export_text: str, max_tokens: int = 800, min_tokens: int = 120) -> List[str]:
+    """Chunk the docling export_to_text output using its structure signals.
+    - Headings (#...) start new blocks
+    - Double newlines separate paragraphs
+    - List items (-, *, +, 1.) are grouped
+    - Very short blocks are merged up to min_tokens, long ones split ~max_tokens by sentences
+    """
+    # Normalize line endings
+    text = export_text.replace("\r\n", "\n").replace("\r", "\n").strip()
+    if not text:
+        return []
+
+    # Split into logical lines
+    lines = [ln.rstrip() for ln in text.split("\n")]
+
+    blocks: List[str] = []
+    buf: List[str] = []
+
+    def flush_buf():
+        if not buf:
+            return
+        # Join consecutive lines, preserving paragraph breaks
+        joined = "\n".join(buf).strip()
+        if joined:
+            blocks.append(joined)
+        buf.clear()
+
+    heading_re = re.compile(r"^\s{0,3}#{1,6} \S")
+    list_re = re.compile(r"^\s{0,3}(?:[-*+] |\d+\. )\S")
+    fence_re = re.compile(r"^\s*```")
+
+    in_code = False
+    for ln in lines:
+        if fence_re.match(ln):
+            in_code = not in_code
+            buf.append(ln)
+            continue
+        if in_code:
+            buf.append(ln)
+            continue
+
+        if not ln.strip():
+            # empty line indicates paragraph break
+            flush_buf()
+            continue
+
+        if heading_re.match(ln):
+            flush_buf()
+            buf.append(ln)
+            flush_buf()
+            continue
+
+        if list_re.match(ln):
+            # keep consecutive list lines together; handled by buffer until empty line
+            buf.append(ln)
+            continue
+
+        buf.append(ln)
+
+    flush_buf()
+
+    # Clean each block: strip markdown markers but keep content
+    def clean_block(block: str) -> str:
+        b = block
+        # Remove fences
+        b = re.sub(r"```[\s\S]*?```", "", b)
+        # Remove heading markers at line start
+        b = re.sub(r"^\s{0,3}#{1,6}\s+", "", b, flags=re.MULTILINE)
+        # Remove list bullets
+        b = re.sub(r"^\s{0,3}(?:[-*+] |\d+\. )", "", b, flags=re.MULTILINE)
+        # Collapse whitespace
+        b = re.sub(r"\s+", " ", b).strip()
+        return b
+
+    cleaned = [clean_block(b) for b in blocks]
+    cleaned = [c for c in cleaned if c]
+
+    # Merge small blocks and split long ones
+    def estimate_tokens(s: str) -> int:
+        # heuristic: ~4 chars per token (English) / ~1.5-2 (CJK). Use conservative 3.
+        return max(1, int(len(s) / 3))
+
+    final_chunks: List[str] = []
+    carry = ""
+    for c in cleaned:
+        if carry:
+            candidate = (carry + "\n\n" + c)
+        else:
+            candidate = c
+        if estimate_tokens(candidate) < min_tokens:
+            carry = candidate
+            continue
+        # candidate big enough; now split by sentences to fit max_tokens
+        unit = candidate
+        carry = ""
+        # sentence split with Chinese and English punctuation
+        sentences = re.split(r"(?<=[。！？.!?])\s+", unit)
+        cur = ""
+        for s in sentences:
+            s = s.strip()
+            if not s:
+                continue
+            cand = (cur + (" " if cur else "") + s)
+            if estimate_tokens(cand) <= max_tokens:
+                cur = cand
+            else:
+                if cur:
+                    final_chunks.append(cur)
+                if estimate_tokens(s) <= max_tokens:
+                    cur = s
+                else:
+                    # hard wrap extremely long sentence
+                    step = max_tokens * 3  # chars approximation
+                    for i in range(0, len(s), step):
+                        final_chunks.append(s[i:i+step])
+                    cur = ""
+        if cur:
+            final_chunks.append(cur)
+
+    if carry:
+        final_chunks.append(carry)
+
+    return final_chunks
+
+
+def reference_normalize_and_chunk_text(raw_text: str, max_chunk_size: int = 1000) -> List[str]:
+    """规范化空白并按句子边界切分文本，保证每块不超过max_chunk_size字符"""
+    import re as _re
+    # Normalize whitespace
+    text = _re.sub(r"\s+", " ", raw_text or "").strip()
+    if not text:
+        return []
+    # Split by sentences (keep delimiters) and make <= max_chunk_size chunks
+    sentences = _re.split(r"(?<=[.!?]) +", text)
+    chunks: List[str] = []
+    current_chunk = ""
+    for sentence in sentences:
+        candidate = (current_chunk + (" " if current_chunk else "") + sentence).strip()
+        if len(candidate) <= max_chunk_size:
+            current_chunk = candidate
+        else:
+            if current_chunk:
+                chunks.append(current_chunk)
+            current_chunk = sentence.strip()
+            if len(current_chunk) > max_chunk_size:
+                # Hard wrap very long single sentence
+                start = 0
+                while start < len(current_chunk):
+                    end = start + max_chunk_size
+                    chunks.append(current_chunk[start:end])
+                    start = end
+                current_chunk = ""
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+
+# ---- 基准 ----
+
+def load_fixtures(directory: str) -> List[Tuple[str, str]]:
+    """读取样例文件为文本：文本类直接解码，PDF 用 PyPDF2 提取（未安装时跳过）"""
+    fixtures = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.lower().endswith(".pdf"):
+            try:
+                from PyPDF2 import PdfReader
+            except ImportError:
+                print(f"⚠️  未安装 PyPDF2，跳过 {name}")
+                continue
+            text = "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+        else:
+            with open(path, "rb") as f:
+                text = f.read().decode("utf-8", errors="ignore")
+        fixtures.append((name, text))
+    return fixtures
+
+
+def split_pieces(text: str, rng: random.Random, max_piece: int = 4096) -> List[str]:
+    """把文本在随机位置切成片段，模拟流式输入"""
+    pieces, pos = [], 0
+    while pos < len(text):
+        step = rng.randint(1, max_piece)
+        pieces.append(text[pos:pos + step])
+        pos += step
+    return pieces
+
+
+def best_time(func: Callable[[], List[str]], repeat: int) -> Tuple[float, List[str]]:
+    best, result = float("inf"), []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分块引擎基准测试与一致性校验")
+    parser.add_argument("--dir", default=FIXTURE_DIR, help="样例文件目录（默认 test/）")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 50], help="样例文本重复的倍数")
+    parser.add_argument("--repeat", type=int, default=3, help="每项计时重复次数（取最快一次）")
+    parser.add_argument("--seed", type=int, default=0, help="随机切分片段的种子")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    fixtures = load_fixtures(args.dir)
+    if not fixtures:
+        print(f"❌ 目录中没有样例文件: {args.dir}")
+        sys.exit(1)
+
+    engines = [
+        ("export", reference_chunk_text_from_export, lambda pieces: list(iter_export_chunks(pieces))),
+        ("normalize", reference_normalize_and_chunk_text, lambda pieces: list(iter_normalized_chunks(pieces))),
+    ]
+    mismatches = 0
+    print(f"{'样例':<24}{'倍数':>6}{'字符数':>12}{'分块':>10}{'块数':>8}{'原实现(ms)':>14}{'流式(ms)':>12}{'加速':>8}")
+    for name, text in fixtures:
+        for scale in args.scales:
+            scaled = "\n\n".join([text] * scale)
+            pieces = split_pieces(scaled, rng)
+            for label, reference, streaming in engines:
+                ref_time, expected = best_time(lambda: reference(scaled), args.repeat)
+                new_time, actual = best_time(lambda: streaming([scaled]), args.repeat)
+                if actual != expected or streaming(pieces) != expected:
+                    mismatches += 1
+                    print(f"❌ 输出不一致: {name} x{scale} ({label})")
+                    continue
+                speedup = ref_time / new_time if new_time > 0 else float("inf")
+                print(f"{name:<24}{scale:>6}{len(scaled):>12}{label:>10}{len(expected):>8}"
+                      f"{ref_time * 1000:>14.1f}{new_time * 1000:>12.1f}{speedup:>7.1f}x")
+
+    if mismatches:
+        print(f"❌ {mismatches} 项输出与原实现不一致")
+        sys.exit(1)
+    print("✅ 所有样例输出与原实现逐字节一致")
+
+
+if __name__ == "__main__":
+    main()
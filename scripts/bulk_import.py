@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+批量导入脚本
+解析文件 → 分块 → 批量生成向量 → COPY 到暂存表 → 一次性建索引 → 原子替换集合分区
+
+示例:
+    python scripts/bulk_import.py --collection manuals docs/ extra.pdf
+    python scripts/bulk_import.py --collection manuals --mode replace docs/
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.database import DEFAULT_COLLECTION, init_database
+from core.bulk_import import BULK_MODES, bulk_import_files
+from core.document_ingest import guess_file_type
+
+
+def collect_paths(inputs):
+    """展开输入的文件与目录（目录递归遍历）"""
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _dirs, files in os.walk(item):
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        elif os.path.isfile(item):
+            yield item
+        else:
+            print(f"⚠️  跳过不存在的路径: {item}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导入文档（延迟建索引）")
+    parser.add_argument("paths", nargs="+", help="文件或目录")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION, help="目标集合")
+    parser.add_argument("--mode", choices=BULK_MODES, default="append", help="append: 追加到集合; replace: 替换集合全部内容")
+    parser.add_argument("--embed-batch-size", type=int, default=64, help="每批生成向量的chunk数")
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print(f"📦 批量导入 → 集合 {args.collection}（模式: {args.mode}）")
+    print("=" * 50)
+
+    init_database()
+    items = ((path, path, guess_file_type(path)) for path in collect_paths(args.paths))
+
+    start = time.time()
+    try:
+        stats = bulk_import_files(items, args.collection, mode=args.mode, embed_batch_size=args.embed_batch_size)
+    except Exception as e:
+        print(f"❌ 批量导入失败: {e}")
+        sys.exit(1)
+
+    elapsed = time.time() - start
+    print(f"✅ 导入完成: {stats['documents']} 个文件，新增 {stats['inserted']} 个文档块，"
+          f"集合共 {stats['total']} 个，耗时 {elapsed:.1f} 秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+目录批量入库脚本
+递归遍历目录，按 include/exclude 通配符筛选文件，多个文件并行经 ingest_file 入库：
+转换在 Docling 进程池中进行，分块、批量生成向量与 COPY 在流式流水线中重叠执行，
+未变化的文件直接跳过，内容变化的文件只为变化的块生成向量。
+每个文件完成后追加写入检查点文件，中断后重新运行会从上次停止的位置继续。
+
+示例:
+    python scripts/ingest_dir.py docs/ --collection manuals --include "*.pdf" --include "*.md"
+    python scripts/ingest_dir.py docs/ --exclude "drafts/*" --dry-run
+    python scripts/ingest_dir.py docs/ --workers 8 --checkpoint /tmp/docs.checkpoint
+"""
+
+import os
+import sys
+import json
+import time
+import fnmatch
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterator, List, Tuple
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.database import DEFAULT_COLLECTION, validate_collection_name
+from core.conversion import CONVERSION_WORKERS
+
+
+def matches(rel_path: str, patterns: List[str]) -> bool:
+    """相对路径或文件名匹配任一通配符"""
+    name = os.path.basename(rel_path)
+    return any(fnmatch.fnmatch(rel_path, p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+
+def walk_files(root: str, include: List[str], exclude: List[str]) -> Iterator[Tuple[str, str, int, float]]:
+    """按目录顺序产出 (路径, 相对路径, 大小, 修改时间)"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            rel_path = os.path.relpath(path, root).replace(os.sep, "/")
+            if include and not matches(rel_path, include):
+                continue
+            if exclude and matches(rel_path, exclude):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            yield path, rel_path, st.st_size, st.st_mtime
+
+
+def load_checkpoint(path: str) -> Dict[str, dict]:
+    """读取检查点（每行一个 JSON 记录，同一文件以最后一条为准）"""
+    done: Dict[str, dict] = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 中断时可能留下半行
+                continue
+            done[record["path"]] = record
+    return done
+
+
+def is_done(record: dict, size: int, mtime: float, retry_failed: bool) -> bool:
+    if not record or record.get("size") != size or record.get("mtime") != mtime:
+        return False
+    return record.get("status") == "done" or not retry_failed
+
+
+def human_size(num: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if num < 1024:
+            return f"{num:.1f}{unit}"
+        num /= 1024
+    return f"{num:.1f}TB"
+
+
+def dry_run(files: List[Tuple[str, str, int, float]], checkpoint: Dict[str, dict], retry_failed: bool) -> None:
+    """只统计待入库文件的数量与大小，不连接数据库"""
+    by_ext: Counter = Counter()
+    size_by_ext: Counter = Counter()
+    done = pending_size = 0
+    for _, rel_path, size, mtime in files:
+        if is_done(checkpoint.get(rel_path), size, mtime, retry_failed):
+            done += 1
+            continue
+        ext = os.path.splitext(rel_path)[1].lower() or "(无扩展名)"
+        by_ext[ext] += 1
+        size_by_ext[ext] += size
+        pending_size += size
+    print(f"📋 共匹配 {len(files)} 个文件，检查点中已完成 {done} 个，"
+          f"待入库 {len(files) - done} 个（{human_size(pending_size)}）")
+    for ext, count in by_ext.most_common():
+        print(f"   {ext:<14}{count:>10} 个 {human_size(size_by_ext[ext]):>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="递归入库目录中的文件（可中断续传）")
+    parser.add_argument("root", help="要入库的目录")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION, help="目标集合")
+    parser.add_argument("--include", action="append", default=[], help="只入库匹配的文件（通配符，可多次指定）")
+    parser.add_argument("--exclude", action="append", default=[], help="跳过匹配的文件（通配符，可多次指定）")
+    parser.add_argument("--workers", type=int, default=CONVERSION_WORKERS, help="同时入库的文件数")
+    parser.add_argument("--checkpoint", help="检查点文件（默认 <目录>/.ingest_checkpoint.jsonl）")
+    parser.add_argument("--retry-failed", action="store_true", help="重新入库检查点中失败的文件")
+    parser.add_argument("--dry-run", action="store_true", help="只统计待入库文件数量与大小")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        print(f"❌ 目录不存在: {args.root}")
+        sys.exit(1)
+    try:
+        collection = validate_collection_name(args.collection)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    checkpoint_path = args.checkpoint or os.path.join(args.root, ".ingest_checkpoint.jsonl")
+    checkpoint_name = os.path.basename(checkpoint_path)
+
+    print("=" * 50)
+    print(f"📂 目录入库: {args.root} → 集合 {collection}")
+    print("=" * 50)
+
+    checkpoint = load_checkpoint(checkpoint_path)
+    files = [f for f in walk_files(args.root, args.include, args.exclude) if f[1] != checkpoint_name]
+    if args.dry_run:
+        dry_run(files, checkpoint, args.retry_failed)
+        return
+
+    from config.database import init_database
+    from core.conversion import conversion_pool
+    from core.document_ingest import guess_file_type, ingest_file
+
+    pending = [f for f in files if not is_done(checkpoint.get(f[1]), f[2], f[3], args.retry_failed)]
+    print(f"📋 共匹配 {len(files)} 个文件，待入库 {len(pending)} 个（检查点: {checkpoint_path}）")
+    if not pending:
+        print("✅ 没有需要入库的文件")
+        return
+
+    init_database()
+    conversion_pool.start()
+    stats = Counter()
+    started = time.time()
+    workers = max(1, args.workers)
+
+    def ingest(item: Tuple[str, str, int, float]) -> int:
+        path, rel_path, _, _ = item
+        # 以相对路径作为文档名，换一个工作目录运行也能对应到同一文档
+        return ingest_file(path, file_type=guess_file_type(path), collection=collection, name=rel_path)[1]
+
+    with open(checkpoint_path, "a", encoding="utf-8") as ckpt, \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest-dir") as executor:
+        queue = iter(pending)
+        running = {}
+        try:
+            while True:
+                # 在途的文件数不超过 worker 数的两倍，避免一次提交全部文件
+                while len(running) < workers * 2:
+                    item = next(queue, None)
+                    if item is None:
+                        break
+                    running[executor.submit(ingest, item)] = item
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    _, rel_path, size, mtime = running.pop(future)
+                    record = {"path": rel_path, "size": size, "mtime": mtime}
+                    try:
+                        added = future.result()
+                        record.update(status="done", chunks=added)
+                        stats["done"] += 1
+                        stats["unchanged"] += int(added == 0)
+                        stats["chunks"] += added
+                        stats["bytes"] += size
+                    except Exception as e:
+                        record.update(status="failed", error=str(e))
+                        stats["failed"] += 1
+                        print(f"❌ {rel_path}: {e}")
+                    ckpt.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    ckpt.flush()
+                    processed = stats["done"] + stats["failed"]
+                    if processed % 100 == 0:
+                        elapsed = time.time() - started
+                        print(f"   已处理 {processed}/{len(pending)} 个文件，{processed / elapsed:.1f} 个/秒")
+        except KeyboardInterrupt:
+            print("⚠️  已中断，等待进行中的文件完成后退出（再次运行将从检查点继续）")
+            for future in running:
+                future.cancel()
+            raise
+        finally:
+            conversion_pool.shutdown()
+
+    elapsed = max(time.time() - started, 1e-6)
+    print("=" * 50)
+    print(f"✅ 入库完成: {stats['done']} 个成功（其中 {stats['unchanged']} 个未变化或无内容），"
+          f"{stats['failed']} 个失败，新增 {stats['chunks']} 个文档块，耗时 {elapsed:.1f} 秒")
+    print(f"📈 吞吐: {stats['done'] / elapsed:.2f} 文件/秒，{stats['chunks'] / elapsed:.1f} 文档块/秒，"
+          f"{stats['bytes'] / (1024 * 1024) / elapsed:.2f} MB/秒")
+    if stats["failed"]:
+        print("   失败的文件可使用 --retry-failed 重新入库")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
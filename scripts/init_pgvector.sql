@@ -4,24 +4,158 @@
 -- 创建 pgvector 扩展
 CREATE EXTENSION IF NOT EXISTS vector;
 
--- 创建文档块表
+-- 创建 trigram 扩展
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- 创建集合注册表
+CREATE TABLE IF NOT EXISTS document_collections (
+    name VARCHAR(64) PRIMARY KEY,
+    partition_name VARCHAR(128) NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+-- 创建文档块表（按集合 LIST 分区）
 CREATE TABLE IF NOT EXISTS document_chunks (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
+    collection VARCHAR(64) NOT NULL DEFAULT 'default',
     content TEXT NOT NULL,
     file_name VARCHAR(255),
     chunk_index INTEGER,
     file_type VARCHAR(50),
     created_at TIMESTAMP DEFAULT NOW(),
-    embedding vector(768)
+    embedding vector(768),
+    document_id BIGINT,
+    chunk_hash CHAR(64),
+    metadata JSONB,
+    content_tsv tsvector GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED,
+    PRIMARY KEY (id, collection)
+) PARTITION BY LIST (collection);
+
+-- 创建文档表（每次上传一个版本，检索只看 active 版本）
+CREATE TABLE IF NOT EXISTS documents (
+    id BIGSERIAL PRIMARY KEY,
+    collection VARCHAR(64) NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    file_type VARCHAR(50),
+    content_hash CHAR(64),
+    version INTEGER NOT NULL DEFAULT 1,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    chunk_count INTEGER NOT NULL DEFAULT 0,
+    byte_size BIGINT,
+    char_count BIGINT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    activated_at TIMESTAMP,
+    first_uploaded_at TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_documents_active
+ON documents (collection, name) WHERE status = 'active';
+
+CREATE INDEX IF NOT EXISTS idx_documents_collection_name
+ON documents (collection, name, version);
+
+CREATE INDEX IF NOT EXISTS idx_documents_status
+ON documents (status) WHERE status <> 'active';
+
+CREATE INDEX IF NOT EXISTS idx_documents_active_recent
+ON documents (collection, activated_at DESC) WHERE status = 'active';
+
+-- 集合统计表（与文档版本切换/删除在同一事务内增量维护）
+CREATE TABLE IF NOT EXISTS collection_stats (
+    collection VARCHAR(64) PRIMARY KEY,
+    file_count BIGINT NOT NULL DEFAULT 0,
+    chunk_count BIGINT NOT NULL DEFAULT 0,
+    byte_size BIGINT NOT NULL DEFAULT 0,
+    char_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- 后台任务表（分批删除、TRUNCATE 清空、VACUUM/REINDEX 等）
+CREATE TABLE IF NOT EXISTS background_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind VARCHAR(64) NOT NULL,
+    params JSONB NOT NULL DEFAULT '{}'::jsonb,
+    status VARCHAR(16) NOT NULL DEFAULT 'queued',
+    progress JSONB NOT NULL DEFAULT '{}'::jsonb,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    dedupe_key VARCHAR(255),
+    worker VARCHAR(128),
+    run_after TIMESTAMP,
+    created_at TIMESTAMP DEFAULT NOW(),
+    started_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    finished_at TIMESTAMP
 );
 
--- 创建向量索引（使用HNSW索引提升性能）
+CREATE INDEX IF NOT EXISTS idx_background_jobs_pending
+ON background_jobs (id) WHERE status IN ('queued', 'running');
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_background_jobs_dedupe
+ON background_jobs (dedupe_key) WHERE status = 'queued' AND dedupe_key IS NOT NULL;
+
+-- 任务附带的上传文件（入库任务可由其它机器上的 worker 读取），任务结束后删除
+CREATE TABLE IF NOT EXISTS job_blobs (
+    id BIGSERIAL PRIMARY KEY,
+    job_id BIGINT NOT NULL REFERENCES background_jobs(id) ON DELETE CASCADE,
+    file_name VARCHAR(255) NOT NULL,
+    file_type VARCHAR(50),
+    byte_size BIGINT NOT NULL,
+    content_hash VARCHAR(64),
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_job_blobs_job_id ON job_blobs (job_id);
+
+-- 上传文件内容按块存放（每行不超过 1MB），上传与读取都逐块进行
+CREATE TABLE IF NOT EXISTS job_blob_parts (
+    blob_id BIGINT NOT NULL REFERENCES job_blobs(id) ON DELETE CASCADE,
+    part INTEGER NOT NULL,
+    data BYTEA NOT NULL,
+    PRIMARY KEY (blob_id, part)
+);
+ALTER TABLE job_blob_parts ALTER COLUMN data SET STORAGE EXTERNAL;
+
+-- 向量设置表（单行）：检索使用的向量列/模型，向量模型迁移期间记录目标列
+CREATE TABLE IF NOT EXISTS embedding_settings (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    active_column VARCHAR(63) NOT NULL,
+    active_model VARCHAR(128) NOT NULL,
+    active_dim INTEGER NOT NULL,
+    target_column VARCHAR(63),
+    target_model VARCHAR(128),
+    target_dim INTEGER,
+    previous_column VARCHAR(63),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+INSERT INTO embedding_settings (id, active_column, active_model, active_dim)
+VALUES (TRUE, 'embedding', 'nomic-embed-text', 768)
+ON CONFLICT (id) DO NOTHING;
+
+-- 默认集合分区
+CREATE TABLE IF NOT EXISTS document_chunks_default PARTITION OF document_chunks FOR VALUES IN ('default');
+INSERT INTO document_collections (name, partition_name)
+VALUES ('default', 'document_chunks_default')
+ON CONFLICT (name) DO NOTHING;
+
+-- 创建向量索引（使用HNSW索引提升性能，自动下发到每个分区）
 CREATE INDEX IF NOT EXISTS idx_document_chunks_embedding 
 ON document_chunks USING hnsw (embedding vector_cosine_ops);
 
+-- 创建 trigram / 全文检索索引
+CREATE INDEX IF NOT EXISTS idx_document_chunks_content_trgm
+ON document_chunks USING GIN (content gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_document_chunks_tsv
+ON document_chunks USING GIN (content_tsv);
+
 -- 创建文件索引
 CREATE INDEX IF NOT EXISTS idx_document_chunks_file_name 
-ON document_chunks (file_name);
+ON document_chunks (collection, file_name);
+
+-- 创建文档引用索引（按 document_id 删除，及按 (chunk_index, id) 的 keyset 分页）
+CREATE INDEX IF NOT EXISTS idx_document_chunks_document_chunk
+ON document_chunks (document_id, chunk_index, id);
 
 -- 创建时间索引
 CREATE INDEX IF NOT EXISTS idx_document_chunks_created_at 
@@ -31,8 +165,8 @@ ON document_chunks (created_at);
 CREATE INDEX IF NOT EXISTS idx_document_chunks_file_chunk 
 ON document_chunks (file_name, chunk_index);
 
--- 设置表空间和参数优化
-ALTER TABLE document_chunks SET (
+-- 设置表空间和参数优化（分区父表不存储数据，参数设置在分区上）
+ALTER TABLE document_chunks_default SET (
     autovacuum_vacuum_scale_factor = 0.1,
     autovacuum_analyze_scale_factor = 0.05
 );
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+后台任务 worker
+独立于 API 进程执行后台任务（上传入库、批量导入、删除、清空、VACUUM、快照、向量模型迁移等），
+可在多台机器上同时运行，任务通过 FOR UPDATE SKIP LOCKED 领取，不会重复执行。
+API 进程设置 JOB_WORKER_ENABLED=false 后只负责提交任务。
+
+示例:
+    python scripts/job_worker.py
+    python scripts/job_worker.py --once
+"""
+
+import os
+import sys
+import signal
+import argparse
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.database import init_database
+from core.jobs import job_worker
+from core.conversion import conversion_pool, pdf_text_extractor
+# 导入各模块以注册任务处理函数
+import core.maintenance  # noqa: F401
+import core.ingestion  # noqa: F401
+import core.snapshot  # noqa: F401
+import core.embedding_migration  # noqa: F401
+
+
+def main():
+    parser = argparse.ArgumentParser(description="后台任务 worker")
+    parser.add_argument("--once", action="store_true", help="执行完当前可领取的任务后退出")
+    args = parser.parse_args()
+
+    init_database()
+    print(f"🛠️  后台任务 worker 启动: {job_worker.worker_id}")
+
+    if args.once:
+        count = job_worker.run_pending()
+        print(f"✅ 已执行 {count} 个任务")
+        conversion_pool.shutdown()
+        pdf_text_extractor.shutdown()
+        return
+
+    def handle_signal(signum, frame):
+        print("\n正在停止 worker（当前任务完成后退出）...")
+        job_worker.stop()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    conversion_pool.start()
+    try:
+        job_worker.run()
+    finally:
+        conversion_pool.shutdown()
+        pdf_text_extractor.shutdown()
+    print("👋 worker 已退出")
+
+
+if __name__ == "__main__":
+    main()
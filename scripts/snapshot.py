@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+语料快照脚本
+导出：active 版本的文档块连同 float16 向量按列写入快照目录
+导入：COPY 到暂存表 → 一次性建索引 → 原子替换集合分区，不需要重新生成向量
+
+示例:
+    python scripts/snapshot.py export /data/snapshots/2024-06-01
+    python scripts/snapshot.py export /data/snapshots/manuals --collection manuals
+    python scripts/snapshot.py import /data/snapshots/2024-06-01 --mode replace
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.database import init_database
+from core.bulk_import import BULK_MODES
+from core.snapshot import SNAPSHOT_PART_ROWS, export_snapshot, import_snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="语料快照导出/导入")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = sub.add_parser("export", help="导出快照")
+    export_parser.add_argument("directory", help="快照目录（不能已存在快照）")
+    export_parser.add_argument("--collection", action="append", help="只导出指定集合，可重复")
+    export_parser.add_argument("--part-rows", type=int, default=SNAPSHOT_PART_ROWS, help="每个 part 的行数")
+
+    import_parser = sub.add_parser("import", help="导入快照")
+    import_parser.add_argument("directory", help="快照目录")
+    import_parser.add_argument("--collection", action="append", help="只导入指定集合，可重复")
+    import_parser.add_argument("--mode", choices=BULK_MODES, default="replace", help="append: 追加; replace: 替换集合全部内容")
+    import_parser.add_argument("--no-verify", action="store_true", help="跳过 sha256 校验")
+    import_parser.add_argument("--allow-model-mismatch", action="store_true", help="允许快照向量模型与当前模型不一致")
+    args = parser.parse_args()
+
+    start = time.time()
+    try:
+        if args.command == "export":
+            print(f"📤 导出快照 → {args.directory}")
+            manifest = export_snapshot(args.directory, args.collection, part_rows=args.part_rows)
+            print(f"✅ 导出完成: {len(manifest['documents'])} 个文档，{manifest['rows']} 个文档块，"
+                  f"{len(manifest['parts'])} 个 part，耗时 {time.time() - start:.1f} 秒")
+        else:
+            print(f"📥 导入快照 ← {args.directory}（模式: {args.mode}）")
+            init_database()
+            stats = import_snapshot(args.directory, mode=args.mode, collections=args.collection,
+                                    verify=not args.no_verify, allow_model_mismatch=args.allow_model_mismatch)
+            for name, item in stats["collections"].items():
+                print(f"   {name}: {item['documents']} 个文档，{item['inserted']} 个文档块")
+            print(f"✅ 导入完成: {stats['documents']} 个文档，{stats['rows']} 个文档块，耗时 {time.time() - start:.1f} 秒")
+    except Exception as e:
+        print(f"❌ 快照{'导出' if args.command == 'export' else '导入'}失败: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()